@@ -0,0 +1,158 @@
+# Контроль допуска к конвейеру генерации: ограниченная очередь, лимит одновременных запросов
+#  сессии и оценка времени ожидания. Запросы, которые не успеют в срок, отклоняются сразу,
+#  а не ждут в очереди, пока пользователь не уйдёт
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional
+
+from config import (ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_PER_SESSION,
+                    ADMISSION_WAIT_SLO, ADMISSION_INITIAL_SERVICE_TIME)
+
+# Вес нового замера в скользящей средней времени обработки
+SERVICE_TIME_ALPHA = 0.2
+
+# Причины отклонения
+REJECT_SESSION = "session"
+REJECT_QUEUE = "queue"
+REJECT_SLO = "slo"
+REJECT_TIMEOUT = "timeout"
+
+
+class AdmissionRejected(Exception):
+    """
+    Запрос не допущен к обработке.
+
+    Attributes:
+        reason (str): Причина (REJECT_*)
+        estimated_wait (float): Оценка ожидания в момент решения, секунды
+    """
+
+    def __init__(self, reason: str, estimated_wait: float):
+        super().__init__(f"Запрос отклонён ({reason}), ожидание ~{estimated_wait:.1f} с")
+        self.reason = reason
+        self.estimated_wait = estimated_wait
+
+
+@dataclass
+class AdmissionTicket:
+    """Допуск к обработке; возвращается в release()."""
+    session_id: Optional[Hashable]
+    started_at: float
+    background: bool = False
+
+
+class AdmissionController:
+    """
+    Допускает к генерации не более max_concurrent запросов одновременно,
+    остальные ждут в очереди длиной не более max_queue.
+
+    Запрос отклоняется сразу, если у сессии уже max_per_session запросов,
+    очередь заполнена или оценка ожидания превышает wait_slo. Оценка ожидания -
+    число запросов впереди, делённое на max_concurrent, умноженное на скользящее
+    среднее времени обработки. Запрос, прождавший в очереди дольше wait_slo, тоже отклоняется.
+
+    Attributes:
+        max_concurrent (int): Одновременно выполняемых запросов
+        max_queue (int): Максимальная длина очереди
+        max_per_session (int): Одновременных запросов одной сессии (в обработке и в очереди)
+        wait_slo (float): Допустимое ожидание в очереди, секунды
+        service_time (float): Скользящее среднее времени обработки, секунды
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_per_session: int = ADMISSION_MAX_PER_SESSION, wait_slo: float = ADMISSION_WAIT_SLO,
+                 initial_service_time: float = ADMISSION_INITIAL_SERVICE_TIME):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.wait_slo = wait_slo
+        self.service_time = initial_service_time
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._sessions: Dict[Hashable, int] = {}
+        self.rejected: Dict[str, int] = {}
+
+    def estimated_wait(self) -> float:
+        """Оценка ожидания для нового запроса, секунды."""
+        with self._condition:
+            return self._estimated_wait()
+
+    def _estimated_wait(self) -> float:
+        ahead = self._running + self._waiting - self.max_concurrent + 1
+        if ahead <= 0:
+            return 0.0
+        return ahead / self.max_concurrent * self.service_time
+
+    def _reject(self, reason: str, estimated_wait: float) -> AdmissionRejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return AdmissionRejected(reason, estimated_wait)
+
+    def acquire(self, session_id: Optional[Hashable] = None, timeout: Optional[float] = None,
+                background: bool = False) -> AdmissionTicket:
+        """
+        Ждёт свободного места для обработки запроса.
+
+        Args:
+            session_id: Идентификатор пользовательской сессии (None - без лимита на сессию)
+            timeout: Допустимое ожидание этого запроса, секунды (например, остаток его срока);
+                действует, если меньше wait_slo
+            background: Фоновая задача (например, прогрев кэша): не отклоняется по очереди и оценке
+                ожидания, ждёт до timeout (None - без ограничения), не попадает в счётчики отклонений
+                и не меняет оценку времени обработки запросов пользователей
+
+        Returns:
+            AdmissionTicket: Допуск, который нужно вернуть через release()
+
+        Raises:
+            AdmissionRejected: Если запрос отклонён
+        """
+        if background:
+            max_wait = float("inf") if timeout is None else timeout
+        else:
+            max_wait = self.wait_slo if timeout is None else min(self.wait_slo, timeout)
+        with self._condition:
+            estimated_wait = self._estimated_wait()
+            if session_id is not None and self._sessions.get(session_id, 0) >= self.max_per_session:
+                raise self._reject(REJECT_SESSION, estimated_wait)
+            if not background and self._running >= self.max_concurrent and self._waiting >= self.max_queue:
+                raise self._reject(REJECT_QUEUE, estimated_wait)
+            if not background and estimated_wait > max_wait:
+                raise self._reject(REJECT_SLO, estimated_wait)
+
+            if session_id is not None:
+                self._sessions[session_id] = self._sessions.get(session_id, 0) + 1
+            self._waiting += 1
+            deadline = time.monotonic() + max_wait
+            try:
+                while self._running >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._release_session(session_id)
+                        if background:
+                            raise AdmissionRejected(REJECT_TIMEOUT, self._estimated_wait())
+                        raise self._reject(REJECT_TIMEOUT, self._estimated_wait())
+                    self._condition.wait(None if remaining == float("inf") else remaining)
+            finally:
+                self._waiting -= 1
+            self._running += 1
+            return AdmissionTicket(session_id, time.monotonic(), background)
+
+    def _release_session(self, session_id: Optional[Hashable]) -> None:
+        if session_id is None:
+            return
+        self._sessions[session_id] -= 1
+        if not self._sessions[session_id]:
+            del self._sessions[session_id]
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        """Освобождает место и обновляет оценку времени обработки."""
+        with self._condition:
+            if not ticket.background:
+                elapsed = time.monotonic() - ticket.started_at
+                self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+            self._running -= 1
+            self._release_session(ticket.session_id)
+            self._condition.notify()
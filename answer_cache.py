@@ -0,0 +1,226 @@
+# Кэш проверенных ответов и результатов поиска, привязанный к версии индекса:
+#  после пересборки индекса записи старой версии не используются.
+#  Результаты поиска сохраняются только для устойчивых формулировок (вопрос и его предобработка),
+#  переформулировки LLM почти не повторяются и в кэш не попадают
+
+import json
+import os
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+from config import ANSWER_CACHE_PATH, ANSWER_CACHE_MAX_RETRIEVALS, ANSWER_CACHE_RETRIEVAL_TTL
+from context_packer import TOKENS_KEY, ChunkTokens
+from generate_answer import Document
+from preprocess import preprocess_query
+
+# Ограничения размера таблицы результатов поиска проверяются раз в столько записей
+RETRIEVAL_PRUNE_EVERY = 100
+
+
+def normalize_query(query: str) -> str:
+    """
+    Приводит вопрос к ключу кэша: нижний регистр, "ё" -> "е",
+    без знаков препинания и лишних пробелов.
+    """
+    query = query.lower().replace("ё", "е")
+    return " ".join(re.sub(r"[^\w\s]", " ", query).split())
+
+
+@dataclass
+class CachedAnswer:
+    """
+    Ответ из кэша.
+
+    Attributes:
+        answer (str): Текст ответа
+        sources (str): Строка использованных источников
+        category (str): Категория вопроса
+        response_type (str): Способ, которым ответ был получен изначально
+    """
+    answer: str
+    sources: str
+    category: str
+    response_type: str
+
+
+class AnswerCache:
+    """
+    Кэш в SQLite, общий для всех сессий и процессов приложения.
+
+    Ответы хранятся по ключу (версия индекса, нормализованный вопрос),
+    результаты поиска - по ключу (версия индекса, формулировки запроса, разделы индекса);
+    результатов поиска не больше max_retrievals, и они живут не дольше retrieval_ttl.
+
+    Attributes:
+        path (str): Файл базы кэша
+        max_retrievals (int): Наибольшее число сохранённых результатов поиска
+        retrieval_ttl (float): Срок жизни результата поиска, секунды
+    """
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, max_retrievals: int = ANSWER_CACHE_MAX_RETRIEVALS,
+                 retrieval_ttl: float = ANSWER_CACHE_RETRIEVAL_TTL):
+        self.path = path
+        self.max_retrievals = max_retrievals
+        self.retrieval_ttl = retrieval_ttl
+        self._retrieval_puts = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS answers (
+                    index_version TEXT,
+                    query TEXT,
+                    answer TEXT,
+                    sources TEXT,
+                    category TEXT,
+                    response_type TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (index_version, query)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_answers_query ON answers (query)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS retrievals (
+                    index_version TEXT,
+                    key TEXT,
+                    documents TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (index_version, key)
+                )
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_answer(self, index_version: str, query: str) -> Optional[CachedAnswer]:
+        """Возвращает проверенный ответ на вопрос для версии индекса или None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT answer, sources, category, response_type FROM answers WHERE index_version = ? AND query = ?',
+                (index_version, normalize_query(query))).fetchone()
+        return CachedAnswer(*row) if row else None
+
+    def get_latest_answer(self, query: str) -> Optional[CachedAnswer]:
+        """Возвращает самый свежий проверенный ответ на вопрос для любой версии индекса или None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT answer, sources, category, response_type FROM answers WHERE query = ? '
+                'ORDER BY created_at DESC LIMIT 1',
+                (normalize_query(query),)).fetchone()
+        return CachedAnswer(*row) if row else None
+
+    def put_answer(self, index_version: str, query: str, answer: str, sources: str,
+                   category: str, response_type: str) -> None:
+        """Сохраняет проверенный ответ."""
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (index_version, normalize_query(query), answer, sources, category,
+                          response_type, time.time()))
+
+    @staticmethod
+    def retrieval_key(queries: Iterable[str], partitions: Optional[List[str]]) -> str:
+        """Ключ результата поиска: формулировки запроса в порядке поиска и разделы индекса."""
+        return json.dumps([list(queries), partitions], ensure_ascii=False)
+
+    def get_documents(self, index_version: str, key: str) -> Optional[List[Document]]:
+        """Возвращает сохранённый результат поиска (не старше retrieval_ttl) или None."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT documents FROM retrievals WHERE index_version = ? AND key = ? '
+                               'AND created_at >= ?',
+                               (index_version, key, time.time() - self.retrieval_ttl)).fetchone()
+        if row is None:
+            return None
+        documents = []
+        for text, metadata in json.loads(row[0]):
+            if TOKENS_KEY in metadata:
+                metadata[TOKENS_KEY] = {name: ChunkTokens(ids, starts)
+                                        for name, (ids, starts) in metadata[TOKENS_KEY].items()}
+            documents.append(Document(page_content=text, metadata=metadata))
+        return documents
+
+    def put_documents(self, index_version: str, key: str, docs: List) -> None:
+        """Сохраняет результат поиска (вместе с токенами фрагментов, если они есть)."""
+        serialized = []
+        for doc in docs:
+            metadata = dict(doc.metadata)
+            if TOKENS_KEY in metadata:
+                metadata[TOKENS_KEY] = {name: ([int(i) for i in tokens.ids], [int(i) for i in tokens.starts])
+                                        for name, tokens in metadata[TOKENS_KEY].items()}
+            serialized.append((doc.page_content, metadata))
+        documents = json.dumps(serialized, ensure_ascii=False)
+        self._retrieval_puts += 1
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO retrievals VALUES (?, ?, ?, ?)',
+                         (index_version, key, documents, time.time()))
+            if self._retrieval_puts % RETRIEVAL_PRUNE_EVERY == 0:
+                self._prune_retrievals(conn)
+
+    def _prune_retrievals(self, conn: sqlite3.Connection) -> int:
+        """Удаляет просроченные результаты поиска и самые старые сверх max_retrievals."""
+        removed = conn.execute('DELETE FROM retrievals WHERE created_at < ?',
+                               (time.time() - self.retrieval_ttl,)).rowcount
+        removed += conn.execute(
+            'DELETE FROM retrievals WHERE rowid IN (SELECT rowid FROM retrievals '
+            'ORDER BY created_at DESC LIMIT -1 OFFSET ?)', (self.max_retrievals,)).rowcount
+        return removed
+
+    def has_answer(self, index_version: str, query: str) -> bool:
+        return self.get_answer(index_version, query) is not None
+
+    def purge(self, keep_versions: Iterable[str]) -> Tuple[int, int]:
+        """
+        Удаляет записи всех версий индекса, кроме keep_versions.
+
+        Returns:
+            Tuple[int, int]: Удалено ответов и результатов поиска
+        """
+        keep_versions = list(keep_versions)
+        placeholders = ", ".join("?" * len(keep_versions)) or "NULL"
+        with self._connect() as conn:
+            answers = conn.execute(f'DELETE FROM answers WHERE index_version NOT IN ({placeholders})',
+                                   keep_versions).rowcount
+            retrievals = conn.execute(f'DELETE FROM retrievals WHERE index_version NOT IN ({placeholders})',
+                                      keep_versions).rowcount
+        return answers, retrievals
+
+
+class CachedRetriever:
+    """
+    Обёртка ретривера одного снимка индекса, сохраняющая результаты поиска в AnswerCache.
+
+    Кэшируется только поиск по устойчивым формулировкам - вопросу и его предобработке
+    (этап отсечения по близости и прогрев); поиск с переформулировками LLM идёт мимо кэша.
+
+    Attributes:
+        retriever: PartitionedRetriever (или совместимый ретривер)
+        cache (AnswerCache): Кэш
+        index_version (str): Версия снимка, которым обслуживается ретривер
+    """
+
+    def __init__(self, retriever, cache: AnswerCache, index_version: str):
+        self.retriever = retriever
+        self.cache = cache
+        self.index_version = index_version
+
+    @staticmethod
+    def _is_stable(queries: List[str]) -> bool:
+        """Формулировки - только вопрос и, возможно, его предобработка."""
+        return len(queries) == 1 or (len(queries) == 2 and queries[1] == preprocess_query(queries[0]))
+
+    def get_relevant_documents_multi(self, queries: List[str], category_scores=None) -> List:
+        if not self._is_stable(queries):
+            return self.retriever.get_relevant_documents_multi(queries, category_scores)
+        select_partitions = getattr(self.retriever, "select_partitions", None)
+        partitions = select_partitions(category_scores) if select_partitions else None
+        key = self.cache.retrieval_key(dict.fromkeys(normalize_query(q) for q in queries if q and q.strip()),
+                                       partitions)
+        docs = self.cache.get_documents(self.index_version, key)
+        if docs is None:
+            docs = self.retriever.get_relevant_documents_multi(queries, category_scores)
+            self.cache.put_documents(self.index_version, key, docs)
+        return docs
+
+    def get_relevant_documents(self, query: str, category_scores=None) -> List:
+        return self.get_relevant_documents_multi([query], category_scores)
@@ -1,15 +1,12 @@
 import random
+import uuid
 from datetime import datetime
 import streamlit as st
 from typing import Optional
 
-from preprocess import preprocess_query
-from classification import ZeroShotQueryClassifier
-from generate_answer import AnswerGenerator
 from database import InteractionLogger
-from knowledge_base import build_vector_store
-from langchain.vectorstores import Chroma
-from config import ANSWER_FOR_SUPPORT_HELP, MAX_TRIES_TO_GET_CORRECT_TEXT_GENERATION
+from startup import BackgroundLoader
+from chat_pipeline import ChatPipeline
 
 from db import CANDIDATE_LABELS, DATE_FORMAT, ChatDAO, MessageDAO, LabelDAO
 from page_template import create_template
@@ -25,13 +22,9 @@ create_template()
 
 # Инициализация
 @st.cache_resource
-def init_classifier() -> ZeroShotQueryClassifier:
-    return ZeroShotQueryClassifier()
-
-
-@st.cache_resource
-def init_answerGenerator() -> AnswerGenerator:
-    return AnswerGenerator()
+def init_components() -> BackgroundLoader:
+    # Модели и индекс загружаются в фоне (startup.py), страница отрисовывается сразу
+    return BackgroundLoader()
 
 
 @st.cache_resource
@@ -39,19 +32,8 @@ def init_db() -> InteractionLogger:
     return InteractionLogger()
 
 
-@st.cache_resource
-def init_vector_store() -> Chroma:
-    return build_vector_store()
-
-
-classifier = init_classifier()
-answerGenerator = init_answerGenerator()
+components_loader = init_components()
 interactionLogger = init_db()
-vector_store = init_vector_store()
-
-# Загрузка/построение векторного индекса (это выполняется при старте)
-with st.spinner("Индексация документов..."):
-    retriever = vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 5})
 
 
 class ChatInterface:
@@ -199,6 +181,10 @@ class ChatInterface:
         if st.button("Сохранить оценку", key=f"save_raiting_{message_id}"):
             rating_value = 1 if rating == "👍 Полезно" else 0
             self.message_dao.update_field(message_id, 'rating', rating_value)
+            # Оценка попадает и в историю запросов (отбор вопросов для прогрева кэша)
+            history_id = st.session_state.get("history_ids", {}).get(message_id)
+            if history_id is not None:
+                interactionLogger.update_rating(history_id, rating_value)
             st.success("Спасибо! Ваша оценка сохранена.")
 
     def _handle_user_query(self):
@@ -238,57 +224,19 @@ class ChatInterface:
         )
 
     def _generate_bot_response(self, user_query: str):
-        """Генерация ответа бота (заглушка)"""
-
-        buffer_queries = []
-        buffer_answers = []
-        is_correct_answer = False
-        
-        user_query = user_query.strip("\n ")
-
-        for i in range(MAX_TRIES_TO_GET_CORRECT_TEXT_GENERATION):
-            
-            user_query = answerGenerator.generate_official_query(user_query)
-            # Предобработка запроса
-            processed_query = preprocess_query(user_query)
-            # Классификация запроса
-            category = classifier.classify(user_query)
-    
-            # Поиск релевантных документов
-            relevant_docs = retriever.get_relevant_documents(processed_query)
-
-            try:
-                answer, sources = answerGenerator.generate_answer(user_query, relevant_docs)
-            except RuntimeError:
-                is_correct_answer = False
-                continue
-
-            is_correct_answer = answerGenerator.is_good_answer(user_query, answer)
-
-            if is_correct_answer:
-                break
-
-            buffer_queries.append(user_query)
-            buffer_answers.append(answer)
-
-            user_query = answerGenerator.generate_new_query(buffer_queries, buffer_answers)
-
-
-        last_label_id = CANDIDATE_LABELS.index(category)
-        self.message_dao.update_field(self.message_dao.get_messages(st.session_state.current_chat)[-1][0],
-                                        "label_id", last_label_id)
-            
-        answer = f"**Ответ:** {answer}"
-        sources = f"**Использованные источники:** {sources}"
-
-        # запись в БД
-        self.message_dao.add_message(
-            st.session_state.current_chat,
-            'assistant',
-            answer,
-            last_label_id,
-            sources,
-        )
+        """Генерация и сохранение ответа бота"""
+        if not components_loader.ready:
+            with st.spinner("Загрузка моделей..."):
+                components_loader.get()
+        pipeline = ChatPipeline(components_loader.get())
+        # Идентификатор сессии браузера для лимита одновременных вопросов (admission.py)
+        session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+        result = pipeline.answer(user_query, session_id=session_id)
+        message_id = pipeline.save_response(self.message_dao, st.session_state.current_chat, result)
+        # Частота вопросов в истории используется для прогрева кэша (cache_warmer.py);
+        # повторы объединяются по нормализованному тексту, как ключи кэша ответов
+        history_id = interactionLogger.log_interaction(user_query, result.category, result.answer, result.sources)
+        st.session_state.setdefault("history_ids", {})[message_id] = history_id
 
 
 def main():
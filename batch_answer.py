@@ -0,0 +1,347 @@
+# Пакетные ответы на вопросы из файла (JSONL/CSV) для проверки базы знаний:
+#  вопросы обрабатываются пакетами - каждый этап (переформулировка, предобработка, классификация,
+#  поиск, генерация, проверка) выполняется сразу для всего пакета, генерация идёт батчами модели.
+#  Результаты дописываются в JSONL после каждого пакета, прерванный запуск продолжается с места остановки.
+#   python batch_answer.py questions.jsonl --output answers.jsonl
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from config import (ANSWER_FOR_SUPPORT_HELP, MAX_TRIES_TO_GET_CORRECT_TEXT_GENERATION, BATCH_ANSWER_SIZE,
+                    BATCH_ANSWER_WORKERS, GENERATION_BACKEND)
+from context_packer import ContextOverflowError
+from db import CANDIDATE_LABELS, RESPONSE_TYPE_RAG, RESPONSE_TYPE_FAQ, RESPONSE_TYPE_OFF_TOPIC
+from preprocess import preprocess_query
+from relevance_gate import OFF_TOPIC, ON_TOPIC, top_relevance
+
+
+@dataclass
+class BatchItem:
+    """
+    Состояние вопроса при пакетной обработке.
+
+    Attributes:
+        id (str): Идентификатор вопроса во входном файле
+        query (str): Исходный вопрос
+        current (str): Текущая формулировка
+        variants (List[str]): Все формулировки вопроса (поиск идёт по ним вместе)
+        buffer_queries (List[str]): Формулировки, ответы на которые не прошли проверку
+        buffer_answers (List[str]): Ответы, не прошедшие проверку
+        answer (str): Последний ответ
+        sources (str): Источники последнего ответа
+        category (str): Категория вопроса
+        response_type (str): Способ получения ответа (RESPONSE_TYPE_*)
+        attempts (int): Число раундов генерации
+        verified (bool): Ответ прошёл проверку моделью (или принят без неё по близости фрагментов)
+        verify (bool): Проверять ли ответ моделью
+        relevance (Optional[float]): Близость лучшего фрагмента до генерации
+        timings (Dict[str, float]): Доля времени этапов пакета, приходящаяся на вопрос, секунды
+        done (bool): Обработка закончена
+    """
+    id: str
+    query: str
+    current: str
+    variants: List[str] = field(default_factory=list)
+    buffer_queries: List[str] = field(default_factory=list)
+    buffer_answers: List[str] = field(default_factory=list)
+    answer: str = ANSWER_FOR_SUPPORT_HELP
+    sources: str = ""
+    category: str = CANDIDATE_LABELS[-1]
+    response_type: str = RESPONSE_TYPE_RAG
+    attempts: int = 0
+    verified: bool = False
+    verify: bool = True
+    relevance: Optional[float] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    done: bool = False
+
+    def finish(self, answer: str, sources: str, response_type: str, verified: bool = False) -> None:
+        self.answer, self.sources, self.response_type, self.verified = answer, sources, response_type, verified
+        self.done = True
+
+    def record(self, index_version: str) -> Dict[str, Any]:
+        """Строка результата для выходного JSONL."""
+        return {
+            "id": self.id,
+            "query": self.query,
+            "answer": self.answer,
+            "sources": self.sources,
+            "category": self.category,
+            "response_type": self.response_type,
+            "attempts": self.attempts,
+            "verified": self.verified,
+            "relevance": self.relevance,
+            "index_version": index_version,
+            "timings": {name: round(seconds, 4) for name, seconds in self.timings.items()},
+        }
+
+
+class BatchAnswerer:
+    """
+    Ответы на пакет вопросов теми же этапами, что и ChatPipeline, но с обработкой всего пакета
+    на каждом этапе: классификатор и LLM получают батчи, предобработка идёт в пуле процессов,
+    поиск - в пуле потоков (поиск в Chroma и эмбеддинги отпускают GIL).
+
+    Attributes:
+        components: startup.Components с загруженными моделями и индексом
+        workers (int): Число процессов предобработки и потоков поиска
+    """
+
+    def __init__(self, components, workers: Optional[int] = BATCH_ANSWER_WORKERS):
+        self.components = components
+        self.workers = workers or os.cpu_count() or 1
+        # spawn: дочерние процессы не наследуют загруженные модели и потоки родителя
+        self._processes = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._threads = ThreadPoolExecutor(self.workers)
+
+    def close(self) -> None:
+        self._processes.shutdown()
+        self._threads.shutdown()
+
+    @staticmethod
+    def _stage(name: str, items: Sequence[BatchItem], func: Callable[[], Any]) -> Any:
+        """Выполняет этап для пакета и делит его длительность поровну между вопросами."""
+        start = time.perf_counter()
+        result = func()
+        share = (time.perf_counter() - start) / max(len(items), 1)
+        for item in items:
+            item.timings[name] = item.timings.get(name, 0.0) + share
+        return result
+
+    def _preprocess(self, queries: List[str]) -> List[str]:
+        return list(self._processes.map(preprocess_query, queries,
+                                        chunksize=max(len(queries) // self.workers, 1)))
+
+    def _retrieve(self, retriever, queries_list: List[List[str]],
+                  category_scores_list: List[Optional[list]]) -> List[list]:
+        return list(self._threads.map(retriever.get_relevant_documents_multi, queries_list, category_scores_list))
+
+    def _generate(self, prompts: List) -> List[Optional[str]]:
+        """Генерирует батчами; при ошибке (например, нехватке памяти) - по одному, None для неудачных."""
+        answer_generator = self.components.answer_generator
+        try:
+            return answer_generator.get_answers(prompts)
+        except RuntimeError as error:
+            print(f"⚠️ Ошибка пакетной генерации ({error}), генерация по одному")
+        answers = []
+        for prompt in prompts:
+            try:
+                answers.append(answer_generator.get_answer(prompt))
+            except RuntimeError:
+                answers.append(None)
+        return answers
+
+    def answer_batch(self, questions: Sequence[Tuple[str, str]], retriever,
+                     index_version: Optional[str] = None) -> List[BatchItem]:
+        """
+        Отвечает на пакет вопросов.
+
+        Args:
+            questions: Пары (id, вопрос)
+            retriever: Ретривер одного снимка индекса
+            index_version: Версия этого снимка (отсечение по близости действует только для снимка калибровки)
+
+        Returns:
+            List[BatchItem]: Результаты в порядке вопросов
+        """
+        classifier = self.components.classifier
+        answer_generator = self.components.answer_generator
+        faq_index = self.components.faq_index
+        relevance_gate = self.components.relevance_gate
+        items = [BatchItem(question_id, query.strip("\n "), query.strip("\n ")) for question_id, query in questions]
+        for item in items:
+            item.variants.append(item.query)
+
+        # Быстрый путь: вопрос совпадает с заголовком статьи портала
+        if faq_index is not None:
+            matches = self._stage("faq", items, lambda: [faq_index.match(item.query) for item in items])
+            found = [(item, match) for item, match in zip(items, matches) if match is not None]
+            faq_items = [item for item, _ in found]
+            categories = self._stage("classification", faq_items,
+                                     lambda: classifier.classify_batch([item.query for item in faq_items]))
+            for (item, match), scores in zip(found, categories):
+                item.category = scores[0][0]
+                item.finish(match.content, match.source, RESPONSE_TYPE_FAQ)
+
+        # Отсечение вопросов без близких фрагментов в индексе
+        active = [item for item in items if not item.done]
+        if relevance_gate is not None and relevance_gate.applies_to(index_version) and active:
+            processed = self._stage("preprocessing", active, lambda: self._preprocess([item.query for item in active]))
+            docs_list = self._stage("relevance", active, lambda: self._retrieve(
+                retriever, [[item.query, query] for item, query in zip(active, processed)],
+                [None] * len(active)))
+            for item, docs in zip(active, docs_list):
+                item.relevance = top_relevance(docs)
+                decision = relevance_gate.decide(item.relevance)
+                if decision == OFF_TOPIC:
+                    item.finish(ANSWER_FOR_SUPPORT_HELP, "", RESPONSE_TYPE_OFF_TOPIC)
+                item.verify = decision != ON_TOPIC
+
+        for _ in range(MAX_TRIES_TO_GET_CORRECT_TEXT_GENERATION):
+            active = [item for item in items if not item.done]
+            if not active:
+                break
+            for item in active:
+                item.attempts += 1
+
+            official = self._stage("rewrite", active, lambda: self._generate(
+                [answer_generator.generate_official_prompt(item.current) for item in active]))
+            for item, query in zip(active, official):
+                item.current = query if query is not None else item.current
+            processed = self._stage("preprocessing", active, lambda: self._preprocess([item.current for item in active]))
+            for item, query in zip(active, processed):
+                item.variants.extend([item.current, query])
+            scores_list = self._stage("classification", active,
+                                      lambda: classifier.classify_batch([item.current for item in active]))
+            for item, scores in zip(active, scores_list):
+                item.category = scores[0][0]
+            docs_list = self._stage("retrieval", active, lambda: self._retrieve(
+                retriever, [item.variants for item in active], scores_list))
+
+            prompts, generating = [], []
+            for item, docs in zip(active, docs_list):
+                try:
+                    prompts.append(answer_generator.build_answer_prompt(item.current, docs))
+                except ContextOverflowError:
+                    # Запрос не помещается в окно модели - повторные попытки не помогут
+                    item.finish(ANSWER_FOR_SUPPORT_HELP, "", RESPONSE_TYPE_RAG)
+                    continue
+                item.sources = answer_generator.extract_sources(docs)
+                generating.append(item)
+            answers = self._stage("generation", generating, lambda: self._generate(prompts))
+            generated = []
+            for item, answer in zip(generating, answers):
+                if answer is not None:
+                    item.answer = answer
+                    generated.append(item)
+
+            for item in [item for item in generated if not item.verify]:
+                item.finish(item.answer, item.sources, RESPONSE_TYPE_RAG, verified=True)
+            checking = [item for item in generated if item.verify]
+            verdicts = self._stage("verification", checking, lambda: answer_generator.are_good_answers(
+                [item.current for item in checking], [item.answer for item in checking]))
+            failed = []
+            for item, good in zip(checking, verdicts):
+                if good:
+                    item.finish(item.answer, item.sources, RESPONSE_TYPE_RAG, verified=True)
+                else:
+                    item.buffer_queries.append(item.current)
+                    item.buffer_answers.append(item.answer)
+                    failed.append(item)
+
+            new_queries = self._stage("rewrite", failed, lambda: answer_generator.generate_new_queries(
+                [item.buffer_queries for item in failed], [item.buffer_answers for item in failed]))
+            for item, query in zip(failed, new_queries):
+                item.current = query
+                item.variants.append(query)
+        return items
+
+
+def read_questions(path: str) -> List[Tuple[str, str]]:
+    """
+    Читает вопросы: JSONL с полем query (или question) и необязательным id,
+    либо CSV с теми же колонками. Без id (или с пустым id) идентификатор - "#" и номер вопроса в файле.
+
+    Raises:
+        ValueError: Если идентификаторы повторяются (ответы на них нельзя было бы различить при продолжении)
+    """
+    with open(path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f)) if path.endswith(".csv") else [json.loads(line) for line in f if line.strip()]
+    questions = [(str(row["id"]) if row.get("id") not in (None, "") else f"#{i}",
+                  row.get("query") or row.get("question") or "") for i, row in enumerate(rows)]
+    counts = Counter(question_id for question_id, _ in questions)
+    duplicates = [question_id for question_id, count in counts.items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Повторяющиеся id вопросов в {path}: {', '.join(duplicates[:10])}")
+    return questions
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """ID вопросов, уже записанных в выходной файл (обрезанная при сбое последняя строка пропускается)."""
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def run(components, questions: List[Tuple[str, str]], output_path: str,
+        batch_size: int = BATCH_ANSWER_SIZE, workers: Optional[int] = BATCH_ANSWER_WORKERS) -> None:
+    """
+    Отвечает на вопросы пакетами и дописывает результаты в output_path после каждого пакета.
+
+    Args:
+        components: startup.Components
+        questions: Пары (id, вопрос)
+        output_path: Выходной JSONL; уже записанные вопросы пропускаются
+        batch_size: Вопросов в пакете
+        workers: Число процессов предобработки и потоков поиска
+    """
+    done = completed_ids(output_path)
+    pending = [(question_id, query) for question_id, query in questions if question_id not in done and query.strip()]
+    print(f"📋 Вопросов: {len(questions)}, уже готово: {len(questions) - len(pending)}, осталось: {len(pending)}")
+    answerer = BatchAnswerer(components, workers)
+    start = time.perf_counter()
+    answered = 0
+    try:
+        with open(output_path, "a", encoding="utf-8") as f:
+            for i in range(0, len(pending), batch_size):
+                # Один снимок индекса на пакет, даже если во время обработки произойдёт переключение
+                index_version, retriever = components.index_watcher.get_snapshot()
+                items = answerer.answer_batch(pending[i:i + batch_size], retriever, index_version)
+                for item in items:
+                    f.write(json.dumps(item.record(index_version), ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                answered += len(items)
+                elapsed = time.perf_counter() - start
+                print(f"✅ {answered}/{len(pending)} за {elapsed:.0f} с ({answered / elapsed:.2f} вопр./с)")
+    finally:
+        answerer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетные ответы на вопросы из файла")
+    parser.add_argument("input", help="JSONL или CSV с вопросами (поля query/question и id)")
+    parser.add_argument("--output", required=True, help="Выходной JSONL (дописывается, запуск можно продолжить)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_ANSWER_SIZE, help="Вопросов в пакете")
+    parser.add_argument("--generation-batch-size", type=int, default=None, help="Промптов в одном проходе LLM")
+    parser.add_argument("--workers", type=int, default=BATCH_ANSWER_WORKERS,
+                        help="Процессов предобработки и потоков поиска (по умолчанию - по числу ядер)")
+    parser.add_argument("--restart", action="store_true", help="Начать заново, удалив выходной файл")
+    parser.add_argument("--models", choices=["stub", "real"], default="real")
+    parser.add_argument("--llm", default=None, help="Среда выполнения LLM для --models real")
+    args = parser.parse_args()
+
+    try:
+        questions = read_questions(args.input)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    if args.models == "stub":
+        from benchmarks.stubs import stub_components
+        components = stub_components()
+    else:
+        from startup import load_components
+        components = load_components(warmup=False, generation_backend=args.llm or GENERATION_BACKEND)
+    if args.generation_batch_size:
+        components.answer_generator.generation_batch_size = args.generation_batch_size
+    run(components, questions, args.output, args.batch_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Сравнение получения найденных фрагментов: тексты и метаданные из Chroma (SQLite) против docstore
+#  Запуск из корня репозитория: python -m benchmarks.bench_docstore
+
+import argparse
+import random
+import time
+
+from config import RETRIEVER_TOP_K
+from docstore import DocStore
+from index_manager import IndexManager
+from knowledge_base import load_vector_store
+
+
+def _measure(name: str, fetch, batches, repeats: int) -> float:
+    """Получает все пачки ID repeats раз и печатает лучшее время на пачку."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for ids in batches:
+            fetch(ids)
+        best = min(best, (time.perf_counter() - start) / len(batches))
+    print(f"{name:<10} {best * 1000:8.3f} мс на {len(batches[0])} фрагментов")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк получения фрагментов")
+    parser.add_argument("--queries", type=int, default=1000, help="Число имитируемых запросов")
+    parser.add_argument("--k", type=int, default=RETRIEVER_TOP_K)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    manager = IndexManager()
+    snapshot_dir = manager.snapshot_dir(manager.current_version())
+    docstore = DocStore.open(snapshot_dir)
+    if docstore is None:
+        raise SystemExit("Текущий снимок построен без docstore: пересоберите индекс (python index_manager.py rebuild)")
+    collection = load_vector_store(snapshot_dir)._collection
+
+    rng = random.Random(0)
+    batches = [[rng.randrange(len(docstore)) for _ in range(args.k)] for _ in range(args.queries)]
+    chroma = _measure("chroma", lambda ids: collection.get(ids=[str(i) for i in ids],
+                                                          include=["documents", "metadatas"]),
+                      batches, args.repeats)
+    store = _measure("docstore", docstore.get, batches, args.repeats)
+    print(f"Ускорение: x{chroma / store:.1f}")
+
+
+if __name__ == "__main__":
+    main()
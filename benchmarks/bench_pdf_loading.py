@@ -0,0 +1,47 @@
+# Сравнение скорости загрузки PDF: PyPDFLoader против PyMuPDFLoader (холодный и тёплый кэш)
+#  Запуск из корня репозитория: python -m benchmarks.bench_pdf_loading
+
+import argparse
+import shutil
+import time
+
+from config import PDF_WORKERS
+from file_cache import cache_path
+from knowledge_base import list_pdf_files, load_documents_from_pdfs
+from pdf_loader import PyMuPDFLoader
+
+
+def _measure(name: str, load, repeats: int) -> float:
+    """Запускает загрузку repeats раз и печатает лучшее время."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        docs = load()
+        best = min(best, time.perf_counter() - start)
+    chars = sum(len(doc.page_content) for doc in docs)
+    print(f"{name:<28} {best:8.2f} с  страниц: {len(docs):5d}  символов: {chars}")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки PDF")
+    parser.add_argument("--repeats", type=int, default=3, help="Число повторов каждого замера")
+    parser.add_argument("--workers", type=int, default=PDF_WORKERS, help="Число процессов PyMuPDF")
+    args = parser.parse_args()
+
+    file_paths = list_pdf_files()
+    print(f"Файлов: {len(file_paths)}")
+
+    def cold_pymupdf():
+        shutil.rmtree(cache_path("pdf_pages", ""), ignore_errors=True)
+        return PyMuPDFLoader(max_workers=args.workers).load(file_paths)
+
+    baseline = _measure("PyPDFLoader", lambda: load_documents_from_pdfs("pypdf"), args.repeats)
+    cold = _measure("PyMuPDF (без кэша)", cold_pymupdf, args.repeats)
+    warm = _measure("PyMuPDF (с кэшем)", lambda: PyMuPDFLoader(max_workers=args.workers).load(file_paths),
+                    args.repeats)
+    print(f"Ускорение: без кэша x{baseline / cold:.1f}, с кэшем x{baseline / warm:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Масштабирование шардированного индекса: время построения и задержка поиска в зависимости от числа шардов
+#  Эмбеддинги - детерминированное хэширование слов, чтобы замер показывал Chroma и scatter-gather,
+#  а не модель эмбеддингов. Запуск из корня репозитория:
+#   python -m benchmarks.bench_shards --chunks 200000 --shards 1 2 4 8
+
+import argparse
+import random
+import tempfile
+import time
+import zlib
+from typing import List
+
+import numpy as np
+
+from generate_answer import Document
+from retrieval import PartitionedRetriever
+from sharded_index import build_shards
+
+DIMENSION = 384
+
+
+class HashingEmbeddings:
+    """Эмбеддинг текста - нормированная сумма псевдослучайных векторов его слов."""
+
+    def __init__(self, dimension: int = DIMENSION):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.split():
+            vector += np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(self.dimension)
+        return (vector / max(np.linalg.norm(vector), 1e-12)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def _corpus(chunks: int, sources: int, seed: int = 0) -> List[Document]:
+    rng = random.Random(seed)
+    vocabulary = [f"слово{i}" for i in range(5000)]
+    return [Document(page_content=" ".join(rng.choices(vocabulary, k=60)),
+                     metadata={"source": f"регламент_{rng.randrange(sources)}.pdf", "page": rng.randrange(300),
+                               "doc_type": "regulation"})
+            for _ in range(chunks)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк шардированного индекса")
+    parser.add_argument("--chunks", type=int, default=50000, help="Число фрагментов")
+    parser.add_argument("--sources", type=int, default=200, help="Число файлов-источников")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--by", choices=["source", "hash"], default="hash")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    embeddings = HashingEmbeddings()
+    docs = _corpus(args.chunks, args.sources)
+    queries = [[doc.page_content[:120], doc.page_content[-120:], doc.page_content[60:180]]
+               for doc in random.Random(1).sample(docs, args.queries)]
+
+    print(f"{'шарды':>6} {'построение,с':>13} {'p50,мс':>8} {'p90,мс':>8} {'запросов/с':>11}")
+    for num_shards in args.shards:
+        with tempfile.TemporaryDirectory(prefix="bench_shards_") as snapshot_dir:
+            start = time.perf_counter()
+            index = build_shards(docs, snapshot_dir, embeddings, num_shards, args.by)
+            build_seconds = time.perf_counter() - start
+
+            retriever = PartitionedRetriever(index)
+            latencies = []
+            for variants in queries:
+                start = time.perf_counter()
+                retriever.get_relevant_documents_multi(variants)
+                latencies.append(time.perf_counter() - start)
+            p50, p90 = np.percentile(latencies, [50, 90]) * 1000
+            print(f"{num_shards:>6} {build_seconds:>13.1f} {p50:>8.1f} {p90:>8.1f} {len(latencies) / sum(latencies):>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
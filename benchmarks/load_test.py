@@ -0,0 +1,250 @@
+# Нагрузочный тест конвейера чата: N одновременных сессий проходят тот же путь, что и приложение
+#  (создание чата, запись вопроса, поиск и генерация ответа, запись ответа, оценка)
+#  Запуск из корня репозитория:
+#   python -m benchmarks.load_test --models stub --concurrency 1 2 4 8 16
+#   python -m benchmarks.load_test --models real --concurrency 1 2 4
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from chat_pipeline import ChatPipeline
+from deadline import Deadline
+from db import ChatDAO, MessageDAO
+
+DEFAULT_QUESTIONS = [
+    "Как зарегистрироваться на портале поставщиков?",
+    "Не могу войти в личный кабинет, пишет ошибка сертификата",
+    "Как подать оферту на котировочную сессию?",
+    "Как осуществляется электронное исполнение контракта?",
+    "Где посмотреть историю закупок заказчика?",
+    "Почему не приходит письмо с подтверждением почты?",
+    "Как изменить данные организации в профиле?",
+    "Что делать, если заказчик отклонил документ о приёмке?",
+]
+
+
+@dataclass
+class DBStats:
+    """Статистика обращений к SQLite, общая для всех DAO теста."""
+    calls: int = 0
+    lock_waits: int = 0
+    lock_wait_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, waited: bool, seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            if waited:
+                self.lock_waits += 1
+                self.lock_wait_seconds += seconds
+
+
+class _LockCountingMixin:
+    """
+    Выполняет запрос сначала без ожидания блокировки (timeout=0): если база занята,
+    засчитывает ожидание и повторяет запрос обычным способом, замеряя время ожидания.
+    """
+    stats: DBStats
+
+    def _execute(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            with sqlite3.connect(self.db_name, timeout=0) as conn:
+                cursor = conn.execute(query, params)
+                conn.commit()
+            self.stats.record(False, 0.0)
+            return cursor
+        except sqlite3.OperationalError as error:
+            if "locked" not in str(error):
+                raise
+        cursor = super()._execute(query, params)
+        self.stats.record(True, time.perf_counter() - start)
+        return cursor
+
+
+def _instrumented_daos(db_name: str, stats: DBStats):
+    chat_dao_cls = type("InstrumentedChatDAO", (_LockCountingMixin, ChatDAO), {"stats": stats})
+    message_dao_cls = type("InstrumentedMessageDAO", (_LockCountingMixin, MessageDAO), {"stats": stats})
+    return chat_dao_cls(db_name), message_dao_cls(db_name)
+
+
+@dataclass
+class LevelReport:
+    """Результаты прогона при одном уровне параллельности."""
+    concurrency: int
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    latency_p50: float
+    latency_p90: float
+    latency_p99: float
+    db_calls: int
+    lock_waits: int
+    lock_wait_seconds: float
+    coalesced: int
+    shed: int
+    truncated: int
+    stage_seconds: Dict[str, float]
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+
+def _run_session(pipeline: ChatPipeline, chat_dao, message_dao, questions: List[str],
+                 rng: random.Random, latencies: List[float], stages: List[Dict[str, float]],
+                 shed: List[str], truncated: List[str], errors: List[BaseException], barrier: threading.Barrier,
+                 deadline_seconds: Optional[float] = None) -> None:
+    """Одна пользовательская сессия: повторяет шаги ChatInterface._process_user_query."""
+    barrier.wait()
+    chat_id = chat_dao.create_chat()
+    session_id = f"session-{chat_id}"
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        try:
+            if i == 0:
+                chat_dao.update_chat_title(chat_id, (question[:30] + "...") if len(question) > 30 else question)
+            message_dao.add_message(chat_id, 'user', question)
+            message_dao.get_messages(chat_id)
+            deadline = Deadline(deadline_seconds) if deadline_seconds is not None else None
+            result = pipeline.answer(question, session_id=session_id, deadline=deadline)
+            message_id = pipeline.save_response(message_dao, chat_id, result)
+            message_dao.update_field(message_id, 'rating', rng.randint(0, 1))
+            stages.append(result.timings)
+            if result.shed_reason:
+                shed.append(result.shed_reason)
+            if result.truncated:
+                truncated.append(question)
+        except Exception as error:
+            errors.append(error)
+        latencies.append(time.perf_counter() - start)
+
+
+def run_level(pipeline: ChatPipeline, db_name: str, concurrency: int, requests_per_session: int,
+              questions: List[str], seed: int = 0, deadline_seconds: Optional[float] = None) -> LevelReport:
+    """
+    Запускает concurrency сессий по requests_per_session вопросов.
+
+    Returns:
+        LevelReport: Пропускная способность, перцентили задержки, ожидания блокировок и ошибки
+    """
+    stats = DBStats()
+    latencies: List[float] = []
+    stages: List[Dict[str, float]] = []
+    shed: List[str] = []
+    truncated: List[str] = []
+    errors: List[BaseException] = []
+    barrier = threading.Barrier(concurrency + 1)
+    threads = []
+    for session in range(concurrency):
+        rng = random.Random(seed + session)
+        chat_dao, message_dao = _instrumented_daos(db_name, stats)
+        session_questions = [rng.choice(questions) for _ in range(requests_per_session)]
+        threads.append(threading.Thread(
+            target=_run_session,
+            args=(pipeline, chat_dao, message_dao, session_questions, rng, latencies, stages, shed, truncated,
+                  errors, barrier, deadline_seconds)))
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) if latencies else (0.0, 0.0, 0.0)
+    stage_names = {name for timing in stages for name in timing}
+    stage_seconds = {name: float(np.mean([timing.get(name, 0.0) for timing in stages])) for name in stage_names}
+    return LevelReport(
+        concurrency=concurrency,
+        requests=len(latencies),
+        errors=len(errors),
+        seconds=seconds,
+        throughput=len(latencies) / seconds if seconds else 0.0,
+        latency_p50=float(p50),
+        latency_p90=float(p90),
+        latency_p99=float(p99),
+        db_calls=stats.calls,
+        lock_waits=stats.lock_waits,
+        lock_wait_seconds=stats.lock_wait_seconds,
+        coalesced=sum("coalesced" in timing for timing in stages),
+        shed=len(shed),
+        truncated=len(truncated),
+        stage_seconds=stage_seconds,
+    )
+
+
+def _print_report(report: LevelReport) -> None:
+    stages = ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in sorted(report.stage_seconds.items()))
+    print(f"{report.concurrency:>5} {report.requests:>7} {report.throughput:>8.2f} "
+          f"{report.latency_p50:>7.2f} {report.latency_p90:>7.2f} {report.latency_p99:>7.2f} "
+          f"{report.lock_waits:>6} {report.lock_wait_seconds:>8.3f} {report.coalesced:>6} {report.shed:>6} {report.truncated:>6} {report.error_rate:>7.1%}   {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест конвейера чата")
+    parser.add_argument("--models", choices=["stub", "real"], default="stub",
+                        help="stub - заглушки без весов, real - модели и индекс из config.py")
+    parser.add_argument("--llm", default=None,
+                        help="Среда выполнения LLM для --models real (hf, llama_cpp, stub)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests-per-session", type=int, default=5)
+    parser.add_argument("--seconds-per-token", type=float, default=0.01,
+                        help="Имитируемое время токена для заглушки LLM")
+    parser.add_argument("--seconds-per-model-call", type=float, default=0.02,
+                        help="Имитируемое время классификации и поиска для --models stub")
+    parser.add_argument("--admission", action="store_true",
+                        help="Включить контроль допуска (admission.py) для --models stub")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Срок ответа на вопрос, секунды (по умолчанию REQUEST_DEADLINE_SECONDS)")
+    parser.add_argument("--questions", help="Файл с вопросами, по одному в строке")
+    parser.add_argument("--db", help="Файл SQLite для теста (по умолчанию временный)")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    if args.models == "stub":
+        from benchmarks.stubs import stub_components
+        components = stub_components(args.seconds_per_token, args.seconds_per_model_call)
+        if args.admission:
+            from admission import AdmissionController
+            components.admission = AdmissionController()
+    else:
+        from config import GENERATION_BACKEND
+        from startup import load_components
+        components = load_components(generation_backend=args.llm or GENERATION_BACKEND)
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    db_name = args.db or os.path.join(tempfile.mkdtemp(prefix="load_test_"), "chats.db")
+    pipeline = ChatPipeline(components)
+    print(f"База: {db_name}")
+    print(f"{'conc':>5} {'req':>7} {'req/s':>8} {'p50,с':>7} {'p90,с':>7} {'p99,с':>7} "
+          f"{'locks':>6} {'lock,с':>8} {'coal':>6} {'shed':>6} {'trunc':>6} {'errors':>7}   этапы, мс")
+    reports = []
+    for concurrency in args.concurrency:
+        report = run_level(pipeline, db_name, concurrency, args.requests_per_session, questions,
+                           deadline_seconds=args.deadline)
+        _print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([asdict(report) for report in reports], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+# Воспроизведение реальных вопросов пользователей из history.db и chats.db через конвейер ответа
+#  Запуск из корня репозитория:
+#   python -m benchmarks.replay extract --sample 300 --anonymize --output replay.jsonl
+#   python -m benchmarks.replay run replay.jsonl --models real --speed 10 --output run_new.json
+#   python -m benchmarks.replay compare run_old.json run_new.json
+#  По умолчанию прогон идёт с пустым временным кэшем ответов (--answer-cache fresh), чтобы сравнение
+#  версий кода не зависело от того, что накопилось в рабочем кэше, и не писало в него ответы прогона
+
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from chat_pipeline import ChatPipeline
+from database import DB_PATH
+from db.constants import DATABASE_NAME, DATE_FORMAT, CANDIDATE_LABELS
+
+SOURCES_PREFIX = "**Использованные источники:**"
+
+# Кэш ответов при прогоне: выключен, пустой временный или рабочий (ANSWER_CACHE_PATH)
+ANSWER_CACHE_OFF = "off"
+ANSWER_CACHE_FRESH = "fresh"
+ANSWER_CACHE_SHARED = "shared"
+
+# Персональные данные, которые маскируются при --anonymize
+_ANONYMIZE_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<EMAIL>"),
+    (re.compile(r"(?:\+7|8)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}"), "<PHONE>"),
+    (re.compile(r"\b\d{5,}\b"), "<NUM>"),
+]
+
+
+def anonymize(text: str) -> str:
+    """Заменяет адреса почты, телефоны и длинные числа (ИНН, номера договоров) метками."""
+    for pattern, label in _ANONYMIZE_PATTERNS:
+        text = pattern.sub(label, text)
+    return text
+
+
+def parse_sources(sources: Optional[str]) -> Set[str]:
+    """Множество источников из строки AnswerGenerator.extract_sources (с префиксом сообщения или без)."""
+    if not sources:
+        return set()
+    sources = sources.replace(SOURCES_PREFIX, "")
+    return {source.strip() for source in sources.split(";") if source.strip()}
+
+
+@dataclass
+class ReplayQuery:
+    """
+    Вопрос из журнала.
+
+    Attributes:
+        query (str): Текст вопроса
+        timestamp (str): Время вопроса (DATE_FORMAT)
+        category (Optional[str]): Категория, определённая при ответе
+        sources (str): Источники исходного ответа
+        rating (Optional[int]): Оценка исходного ответа
+        origin (str): Откуда взят вопрос ("history" или "chats")
+        frequency (int): Сколько раз вопрос задавали (вес при выборке)
+    """
+    query: str
+    timestamp: str
+    category: Optional[str]
+    sources: str
+    rating: Optional[int]
+    origin: str
+    frequency: int = 1
+
+
+def _history_queries(path: str) -> List[ReplayQuery]:
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute(
+            "SELECT user_query, timestamp, category, sources, rating, frequency FROM history").fetchall()
+    # Одна запись на вопрос: у history.db только время последнего обращения, поэтому копии
+    # по частоте пришли бы одновременно; частота учитывается весом при выборке
+    return [ReplayQuery(query, timestamp, category, sources or "", rating, "history", frequency or 1)
+            for query, timestamp, category, sources, rating, frequency in rows]
+
+
+def _chat_queries(path: str) -> List[ReplayQuery]:
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute('''
+            SELECT u.content, u.timestamp, u.label_id, a.sources, a.rating
+            FROM messages u
+            JOIN messages a ON a.id = (
+                SELECT MIN(id) FROM messages WHERE chat_id = u.chat_id AND id > u.id AND role = 'assistant')
+            WHERE u.role = 'user' ''').fetchall()
+    return [ReplayQuery(query, timestamp,
+                        CANDIDATE_LABELS[label_id] if isinstance(label_id, int) else None,
+                        sources or "", rating, "chats")
+            for query, timestamp, label_id, sources, rating in rows]
+
+
+def extract(history_path: Optional[str], chats_path: Optional[str], sample: Optional[int],
+            anonymize_text: bool, seed: int = 0) -> List[ReplayQuery]:
+    """
+    Собирает вопросы из журналов, делает случайную выборку и упорядочивает по времени.
+
+    Выборка без повторений, вероятность попадания вопроса растёт с его частотой
+    (взвешенная выборка Эфраимидиса-Спиракиса): каждый вопрос воспроизводится
+    не больше одного раза в момент, записанный в журнале.
+
+    Args:
+        history_path: history.db (None - не использовать)
+        chats_path: chats.db (None - не использовать)
+        sample: Размер выборки (None - все вопросы)
+        anonymize_text: Маскировать персональные данные
+        seed: Зерно выборки
+
+    Returns:
+        List[ReplayQuery]: Вопросы в порядке времени
+    """
+    queries = []
+    if history_path:
+        queries.extend(_history_queries(history_path))
+    if chats_path:
+        queries.extend(_chat_queries(chats_path))
+    if sample is not None and sample < len(queries):
+        rng = random.Random(seed)
+        keys = [rng.random() ** (1.0 / max(item.frequency, 1)) for item in queries]
+        order = sorted(range(len(queries)), key=keys.__getitem__, reverse=True)
+        queries = [queries[i] for i in order[:sample]]
+    if anonymize_text:
+        for item in queries:
+            item.query = anonymize(item.query)
+    return sorted(queries, key=lambda item: item.timestamp or "")
+
+
+def _schedule(queries: List[ReplayQuery], speed: float) -> List[float]:
+    """Смещения запуска вопросов от начала воспроизведения; speed 0 - без пауз."""
+    if not speed or not queries:
+        return [0.0] * len(queries)
+    times = [datetime.strptime(item.timestamp, DATE_FORMAT).timestamp() for item in queries]
+    # Паузы длиннее часа (ночь, выходные) сокращаются, иначе воспроизведение растянется на месяцы
+    offsets, offset = [0.0], 0.0
+    for previous, current in zip(times, times[1:]):
+        offset += min(max(current - previous, 0.0), 3600.0) / speed
+        offsets.append(offset)
+    return offsets
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(queries: List[ReplayQuery], components, speed: float = 0.0, concurrency: int = 1,
+        answer_cache: Optional[str] = None) -> dict:
+    """
+    Воспроизводит вопросы через конвейер ответа.
+
+    Args:
+        queries: Вопросы
+        components: startup.Components
+        speed: Ускорение относительно записанного темпа (0 - без пауз)
+        concurrency: Сколько вопросов может обрабатываться одновременно
+        answer_cache: Режим кэша ответов (ANSWER_CACHE_*), записывается в метаданные прогона
+
+    Returns:
+        dict: Метаданные прогона и результат по каждому вопросу
+    """
+    pipeline = ChatPipeline(components)
+    offsets = _schedule(queries, speed)
+    start = time.perf_counter()
+
+    def replay(i: int) -> dict:
+        delay = start + offsets[i] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        item = queries[i]
+        begin = time.perf_counter()
+        try:
+            result = pipeline.answer(item.query, session_id=f"replay-{i}")
+        except Exception as error:
+            return {"query": item.query, "error": repr(error), "latency": time.perf_counter() - begin}
+        return {
+            "query": item.query,
+            "latency": time.perf_counter() - begin,
+            "response_type": result.response_type,
+            "category": result.category,
+            "sources": sorted(parse_sources(result.sources)),
+            "logged_sources": sorted(parse_sources(item.sources)),
+            "logged_category": item.category,
+            "logged_rating": item.rating,
+            "timings": result.timings,
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(replay, range(len(queries))))
+    return {
+        "git_commit": _git_commit(),
+        "index_version": getattr(components.index_watcher, "version", None),
+        "speed": speed,
+        "concurrency": concurrency,
+        "answer_cache": answer_cache,
+        "seconds": time.perf_counter() - start,
+        "results": results,
+    }
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> Optional[float]:
+    if not a and not b:
+        return None
+    return len(a & b) / len(a | b)
+
+
+def summarize(run_result: dict) -> Dict[str, float]:
+    """Сводка прогона: перцентили задержки, доля ответов из кэша, совпадение источников с журналом."""
+    results = [r for r in run_result["results"] if "error" not in r]
+    latencies = [r["latency"] for r in results] or [0.0]
+    types = [r["response_type"] for r in results]
+    overlaps = [j for r in results
+                if (j := _jaccard(set(r["sources"]), set(r["logged_sources"]))) is not None]
+    categories = [r["category"] == r["logged_category"] for r in results if r["logged_category"]]
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    summary = {
+        "queries": len(run_result["results"]),
+        "errors": len(run_result["results"]) - len(results),
+        "latency_p50": float(p50),
+        "latency_p90": float(p90),
+        "latency_p99": float(p99),
+        "cache_hit_rate": types.count("cache") / len(types) if types else 0.0,
+        "faq_rate": types.count("faq") / len(types) if types else 0.0,
+        "shed_rate": types.count("shed") / len(types) if types else 0.0,
+        "source_overlap": float(np.mean(overlaps)) if overlaps else 0.0,
+        "category_agreement": float(np.mean(categories)) if categories else 0.0,
+    }
+    return summary
+
+
+def compare(old: dict, new: dict) -> None:
+    """Печатает сводки двух прогонов и совпадение источников между ними по одинаковым вопросам."""
+    old_summary, new_summary = summarize(old), summarize(new)
+    print(f"{'':<20} {'было':>12} {'стало':>12}")
+    print(f"{'коммит':<20} {str(old.get('git_commit')):>12} {str(new.get('git_commit')):>12}")
+    print(f"{'индекс':<20} {str(old.get('index_version'))[-12:]:>12} {str(new.get('index_version'))[-12:]:>12}")
+    print(f"{'кэш ответов':<20} {str(old.get('answer_cache')):>12} {str(new.get('answer_cache')):>12}")
+    if old.get("answer_cache") != new.get("answer_cache"):
+        print("⚠️ Прогоны выполнены с разными режимами кэша ответов: задержки и cache_hit_rate несравнимы")
+    for key in old_summary:
+        print(f"{key:<20} {old_summary[key]:>12.3f} {new_summary[key]:>12.3f}")
+
+    old_sources = {r["query"]: set(r.get("sources", [])) for r in old["results"] if "error" not in r}
+    overlaps = [j for r in new["results"] if "error" not in r and r["query"] in old_sources
+                if (j := _jaccard(set(r["sources"]), old_sources[r["query"]])) is not None]
+    if overlaps:
+        print(f"{'источники было/стало':<20} {float(np.mean(overlaps)):>25.3f}")
+
+
+def _load_components(args):
+    if args.models == "stub":
+        from benchmarks.stubs import stub_components
+        return stub_components(args.seconds_per_token)
+    from config import GENERATION_BACKEND
+    from startup import load_components
+    return load_components(generation_backend=args.llm or GENERATION_BACKEND)
+
+
+def _configure_answer_cache(components, mode: str, cache_dir: str) -> None:
+    """
+    Подключает кэш ответов выбранного режима. Кроме рабочего режима, прогрев кэша
+    при переключении снимка отключается: он писал бы в кэш вопросы из рабочей истории.
+    """
+    from answer_cache import AnswerCache
+
+    if mode == ANSWER_CACHE_SHARED:
+        if components.answer_cache is None:
+            components.answer_cache = AnswerCache()
+        return
+    components.index_watcher.on_new_snapshot = None
+    components.answer_cache = AnswerCache(os.path.join(cache_dir, "answers.db")) if mode == ANSWER_CACHE_FRESH else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение вопросов из журналов")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = commands.add_parser("extract", help="Выборка вопросов из history.db и chats.db")
+    extract_parser.add_argument("--history", default=DB_PATH)
+    extract_parser.add_argument("--chats", default=DATABASE_NAME)
+    extract_parser.add_argument("--no-history", action="store_true")
+    extract_parser.add_argument("--no-chats", action="store_true")
+    extract_parser.add_argument("--sample", type=int)
+    extract_parser.add_argument("--seed", type=int, default=0)
+    extract_parser.add_argument("--anonymize", action="store_true", help="Маскировать почту, телефоны и номера")
+    extract_parser.add_argument("--output", required=True, help="Файл JSONL с вопросами")
+
+    run_parser = commands.add_parser("run", help="Прогон вопросов через конвейер")
+    run_parser.add_argument("queries", help="Файл JSONL, созданный командой extract")
+    run_parser.add_argument("--models", choices=["stub", "real"], default="real")
+    run_parser.add_argument("--llm", default=None, help="Среда выполнения LLM для --models real")
+    run_parser.add_argument("--seconds-per-token", type=float, default=0.0)
+    run_parser.add_argument("--speed", type=float, default=0.0,
+                            help="Ускорение записанного темпа (0 - подряд без пауз)")
+    run_parser.add_argument("--concurrency", type=int, default=1)
+    run_parser.add_argument("--answer-cache", choices=[ANSWER_CACHE_OFF, ANSWER_CACHE_FRESH, ANSWER_CACHE_SHARED],
+                            default=ANSWER_CACHE_FRESH,
+                            help="Кэш ответов: off - без кэша, fresh - пустой временный (по умолчанию), "
+                                 "shared - рабочий кэш приложения (прогон пишет в него ответы)")
+    run_parser.add_argument("--output", required=True, help="Файл JSON с результатами")
+
+    compare_parser = commands.add_parser("compare", help="Сравнение двух прогонов")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        queries = extract(None if args.no_history else args.history, None if args.no_chats else args.chats,
+                          args.sample, args.anonymize, args.seed)
+        with open(args.output, "w", encoding="utf-8") as f:
+            for item in queries:
+                f.write(json.dumps(asdict(item), ensure_ascii=False) + "\n")
+        print(f"Вопросов: {len(queries)}")
+    elif args.command == "run":
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [ReplayQuery(**json.loads(line)) for line in f if line.strip()]
+        components = _load_components(args)
+        with tempfile.TemporaryDirectory(prefix="replay-cache-") as cache_dir:
+            _configure_answer_cache(components, args.answer_cache, cache_dir)
+            result = run(queries, components, args.speed, args.concurrency, args.answer_cache)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        for key, value in summarize(result).items():
+            print(f"{key:<20} {value:.3f}")
+    else:
+        with open(args.old, encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        compare(old, new)
+
+
+if __name__ == "__main__":
+    main()
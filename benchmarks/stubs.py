@@ -0,0 +1,95 @@
+# Заглушки моделей и индекса для нагрузочных тестов и бенчмарков без весов и GPU
+
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+from config import STUB_SECONDS_PER_TOKEN
+from db import CANDIDATE_LABELS
+from generate_answer import AnswerGenerator, Document
+from generation_backends import StubBackend
+from startup import Components
+
+STUB_DOCUMENTS = [
+    Document(page_content="Для регистрации на Портале поставщиков нажмите кнопку «Регистрация», "
+                          "войдите с помощью электронной подписи и заполните карточку организации.",
+             metadata={"source": "статья с сайта портал поставщиков: Регистрация", "doc_type": "article"}),
+    Document(page_content="Электронное исполнение контракта осуществляется с использованием "
+                          "электронных документов, подписанных усиленной электронной подписью.",
+             metadata={"source": "Регламент_информационного_взаимодействия.pdf", "page": 12,
+                       "doc_type": "regulation"}),
+]
+
+
+class StubClassifier:
+    """Детерминированный классификатор: категория выбирается по хэшу запроса."""
+
+    def __init__(self, seconds_per_call: float = 0.0):
+        self.seconds_per_call = seconds_per_call
+
+    def classify_with_scores(self, query: str) -> List[Tuple[str, float]]:
+        if self.seconds_per_call:
+            time.sleep(self.seconds_per_call)
+        best = zlib.crc32(query.encode("utf-8")) % len(CANDIDATE_LABELS)
+        rest = (1.0 - 0.8) / (len(CANDIDATE_LABELS) - 1)
+        return [(CANDIDATE_LABELS[best], 0.8)] + [(label, rest) for i, label in enumerate(CANDIDATE_LABELS)
+                                                  if i != best]
+
+    def classify_batch(self, queries: List[str], batch_size: int = 0) -> List[List[Tuple[str, float]]]:
+        return [self.classify_with_scores(query) for query in queries]
+
+    def classify(self, query: str) -> str:
+        return self.classify_with_scores(query)[0][0]
+
+
+class StubRetriever:
+    """Ретривер, возвращающий фиксированный набор документов."""
+
+    def __init__(self, seconds_per_call: float = 0.0):
+        self.seconds_per_call = seconds_per_call
+
+    def get_relevant_documents_multi(self, queries: List[str], category_scores=None) -> List[Document]:
+        if self.seconds_per_call:
+            time.sleep(self.seconds_per_call)
+        return list(STUB_DOCUMENTS)
+
+    def get_relevant_documents(self, query: str, category_scores=None) -> List[Document]:
+        return self.get_relevant_documents_multi([query], category_scores)
+
+
+class StubIndexWatcher:
+    """Аналог IndexWatcher с одним неизменным снимком."""
+
+    version = "stub"
+    on_new_snapshot = None
+
+    def __init__(self, retriever: StubRetriever):
+        self.retriever = retriever
+
+    def get_snapshot(self) -> Tuple[str, StubRetriever]:
+        return self.version, self.retriever
+
+    def get_retriever(self) -> StubRetriever:
+        return self.retriever
+
+
+def stub_components(seconds_per_token: float = STUB_SECONDS_PER_TOKEN,
+                    seconds_per_model_call: float = 0.0,
+                    answer_generator: Optional[AnswerGenerator] = None) -> Components:
+    """
+    Собирает Components из заглушек.
+
+    Args:
+        seconds_per_token: Имитируемое время генерации токена LLM
+        seconds_per_model_call: Имитируемое время вызова классификатора и поиска
+        answer_generator: Готовый генератор (по умолчанию - на StubBackend)
+    """
+    answer_generator = answer_generator or AnswerGenerator(
+        backend=StubBackend(seconds_per_token=seconds_per_token))
+    return Components(
+        classifier=StubClassifier(seconds_per_model_call),
+        answer_generator=answer_generator,
+        embeddings=None,
+        index_watcher=StubIndexWatcher(StubRetriever(seconds_per_model_call)),
+        faq_index=None,
+    )
@@ -0,0 +1,174 @@
+# Прогрев кэша ответов самыми частыми вопросами из history.db
+#  Запускается автоматически при переключении на новый снимок индекса (CACHE_WARMUP_ON_SWAP)
+#  или вручную для текущего снимка:
+#   python cache_warmer.py --top-n 100
+
+import argparse
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+from config import CACHE_WARMUP_TOP_N, CACHE_WARMUP_BATCH_SIZE, CACHE_WARMUP_ONLY_RATED, CACHE_WARMUP_MAX_SECONDS
+from admission import AdmissionRejected
+from answer_cache import CachedRetriever
+from batch_answer import BatchAnswerer
+from database import InteractionLogger, DB_PATH
+from db import RESPONSE_TYPE_RAG
+
+
+@dataclass
+class WarmupReport:
+    """
+    Итоги прогрева.
+
+    Attributes:
+        index_version (str): Версия индекса, для которой прогрет кэш
+        queries (int): Число отобранных вопросов
+        skipped (int): Уже были в кэше
+        cached (int): Добавлено проверенных ответов
+        unverified (int): Ответ не прошёл проверку (или вопрос отсечён как посторонний, ответ из FAQ)
+        not_started (int): Не начаты из-за общего ограничения времени прогрева
+        failed (int): Вопросы, обработка которых завершилась ошибкой
+        seconds (float): Длительность
+    """
+    index_version: str
+    queries: int = 0
+    skipped: int = 0
+    cached: int = 0
+    unverified: int = 0
+    not_started: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (f"индекс {self.index_version}: вопросов {self.queries}, уже в кэше {self.skipped}, "
+                f"добавлено {self.cached}, без проверенного ответа {self.unverified}, "
+                f"не начаты {self.not_started}, ошибок {self.failed}, {self.seconds:.1f} с")
+
+
+class CacheWarmer:
+    """
+    Прогоняет самые частые вопросы через пакетный конвейер ответа (batch_answer.BatchAnswerer)
+    для заданного снимка индекса, заполняя кэш ответов и результатов поиска до того,
+    как их зададут пользователи.
+
+    Вопросы обрабатываются пакетами по batch_size: каждый этап выполняется для всего пакета,
+    генерация идёт батчами модели. Пакет занимает одно место контроля допуска как фоновая
+    задача: ждёт, пока LLM освободится от запросов пользователей, не отклоняется по их SLO
+    и не попадает в счётчики отклонений. Ответы не обрываются по времени; новый пакет
+    не начинается, если до конца max_seconds не успеет хотя бы один раунд генерации
+    (components.round_estimate), чтобы не задерживать переключение на новый снимок.
+
+    Attributes:
+        components: startup.Components с включённым кэшем ответов
+        top_n (int): Сколько самых частых вопросов прогревать
+        batch_size (int): Вопросов в пакете
+        history_path (str): База истории запросов (database.InteractionLogger)
+        only_rated (bool): Брать только вопросы с положительной оценкой ответа
+        max_seconds (Optional[float]): Общее время прогрева (None - без ограничения)
+    """
+
+    def __init__(self, components, top_n: int = CACHE_WARMUP_TOP_N, batch_size: int = CACHE_WARMUP_BATCH_SIZE,
+                 history_path: str = DB_PATH, only_rated: bool = CACHE_WARMUP_ONLY_RATED,
+                 max_seconds: Optional[float] = CACHE_WARMUP_MAX_SECONDS):
+        if components.answer_cache is None:
+            raise ValueError("Прогрев требует включённого кэша ответов (ANSWER_CACHE_ENABLED)")
+        self.components = components
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.history_path = history_path
+        self.only_rated = only_rated
+        self.max_seconds = max_seconds
+
+    def frequent_queries(self) -> List[str]:
+        """Самые частые вопросы с положительной оценкой (или без отрицательной при only_rated=False)."""
+        with InteractionLogger(self.history_path) as logger:
+            return [query for query, _ in logger.get_frequent_queries(self.top_n, self.only_rated)]
+
+    def _remaining(self, start: float) -> Optional[float]:
+        if self.max_seconds is None:
+            return None
+        return self.max_seconds - (time.perf_counter() - start)
+
+    def warm(self, snapshot: Optional[Tuple[str, Any]] = None) -> WarmupReport:
+        """
+        Прогревает кэш для снимка индекса.
+
+        Args:
+            snapshot: Версия и ретривер снимка (по умолчанию - текущий снимок)
+
+        Returns:
+            WarmupReport: Итоги прогрева
+        """
+        start = time.perf_counter()
+        version, retriever = snapshot or self.components.index_watcher.get_snapshot()
+        cache = self.components.answer_cache
+        admission = self.components.admission
+        round_seconds = self.components.round_estimate.seconds
+        report = WarmupReport(version)
+
+        queries = self.frequent_queries()
+        report.queries = len(queries)
+        pending = [query for query in queries if not cache.has_answer(version, query)]
+        report.skipped = len(queries) - len(pending)
+        if not pending:
+            report.seconds = time.perf_counter() - start
+            print("🔥 Прогрев кэша:", report.summary())
+            return report
+
+        retriever = CachedRetriever(retriever, cache, version)
+        answerer = BatchAnswerer(self.components, self.batch_size)
+        try:
+            for i in range(0, len(pending), self.batch_size):
+                batch = pending[i:i + self.batch_size]
+                remaining = self._remaining(start)
+                if remaining is not None and remaining < round_seconds:
+                    report.not_started = len(pending) - i
+                    break
+                ticket = None
+                if admission is not None:
+                    try:
+                        # Ждём не дольше, чем оставляет время хотя бы на один раунд
+                        ticket = admission.acquire(
+                            timeout=remaining - round_seconds if remaining is not None else None, background=True)
+                    except AdmissionRejected:
+                        report.not_started = len(pending) - i
+                        break
+                try:
+                    items = answerer.answer_batch([(str(i + j), query) for j, query in enumerate(batch)], retriever, version)
+                except Exception as error:
+                    print(f"⚠️ Прогрев: ошибка на пакете из {len(batch)} вопросов: {error}")
+                    report.failed += len(batch)
+                    continue
+                finally:
+                    if ticket is not None:
+                        admission.release(ticket)
+                for item in items:
+                    # В кэш попадают только проверенные ответы, как и в ChatPipeline
+                    if item.verified and item.response_type == RESPONSE_TYPE_RAG:
+                        cache.put_answer(version, item.query, item.answer, item.sources, item.category,
+                                         RESPONSE_TYPE_RAG)
+                        report.cached += 1
+                    else:
+                        report.unverified += 1
+        finally:
+            answerer.close()
+        report.seconds = time.perf_counter() - start
+        print("🔥 Прогрев кэша:", report.summary())
+        return report
+
+
+if __name__ == "__main__":
+    from startup import load_components
+
+    parser = argparse.ArgumentParser(description="Прогрев кэша ответов частыми вопросами")
+    parser.add_argument("--top-n", type=int, default=CACHE_WARMUP_TOP_N)
+    parser.add_argument("--batch-size", type=int, default=CACHE_WARMUP_BATCH_SIZE)
+    parser.add_argument("--history", default=DB_PATH)
+    parser.add_argument("--include-unrated", action="store_true",
+                        help="Брать и вопросы без оценки (по умолчанию - только с положительной)")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Общее время прогрева, секунды (по умолчанию без ограничения)")
+    args = parser.parse_args()
+    CacheWarmer(load_components(warmup=False), args.top_n, args.batch_size,
+                args.history, not args.include_unrated, args.max_seconds).warm()
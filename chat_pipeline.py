@@ -0,0 +1,318 @@
+# Конвейер ответа на вопрос пользователя, не зависящий от интерфейса:
+#  используется приложением, нагрузочным тестом и другими инструментами
+
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from preprocess import preprocess_query
+from context_packer import ContextOverflowError
+from answer_cache import CachedRetriever, normalize_query
+from admission import AdmissionRejected
+from deadline import Deadline
+from relevance_gate import OFF_TOPIC, ON_TOPIC, top_relevance
+from config import ANSWER_FOR_SUPPORT_HELP, MAX_TRIES_TO_GET_CORRECT_TEXT_GENERATION, DEADLINE_TRUNCATED_NOTE
+from db import (CANDIDATE_LABELS, RESPONSE_TYPE_RAG, RESPONSE_TYPE_FAQ, RESPONSE_TYPE_CACHE,
+                RESPONSE_TYPE_SHED, RESPONSE_TYPE_OFF_TOPIC, RESPONSE_TYPE_DEADLINE, MessageDAO)
+
+
+@dataclass
+class PipelineResult:
+    """
+    Результат обработки вопроса.
+
+    Attributes:
+        answer (str): Текст ответа
+        sources (str): Строка использованных источников
+        category (str): Категория вопроса
+        response_type (str): Способ получения ответа (RESPONSE_TYPE_*)
+        attempts (int): Число раундов генерации
+        timings (Dict[str, float]): Суммарная длительность этапов в секундах
+        coalesced (bool): Ответ получен от одновременного запроса с тем же вопросом
+        shed_reason (Optional[str]): Причина отклонения при перегрузке (admission.REJECT_*)
+        relevance (Optional[float]): Близость лучшего найденного фрагмента до генерации
+        truncated (bool): Ответ прерван сроком запроса (лучший ответ на момент срока или контакты поддержки)
+    """
+    answer: str
+    sources: str
+    category: str
+    response_type: str
+    attempts: int = 0
+    timings: Dict[str, float] = field(default_factory=dict)
+    coalesced: bool = False
+    shed_reason: Optional[str] = None
+    relevance: Optional[float] = None
+    truncated: bool = False
+
+
+class _StageTimer:
+    """Накапливает длительность этапов конвейера."""
+
+    def __init__(self, timings: Dict[str, float], name: str):
+        self.timings, self.name = timings, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+class ChatPipeline:
+    """
+    Генерация ответа: быстрый ответ статьёй (FAQ), проверенный ответ из кэша для текущей
+    версии индекса, отсечение вопросов без близких фрагментов в индексе, затем раунды
+    переформулировки, классификации, поиска, генерации и проверки ответа.
+
+    Attributes:
+        components: startup.Components с загруженными моделями и индексом
+    """
+
+    def __init__(self, components):
+        self.components = components
+
+    def answer(self, user_query: str, snapshot: Optional[Tuple[str, Any]] = None,
+               session_id: Optional[str] = None, deadline: Optional[Deadline] = None) -> PipelineResult:
+        """
+        Отвечает на вопрос пользователя.
+
+        Args:
+            user_query: Вопрос пользователя
+            snapshot: Версия и ретривер снимка индекса (по умолчанию - текущий снимок)
+            session_id: Идентификатор сессии пользователя для лимита одновременных вопросов
+            deadline: Срок ответа (по умолчанию - REQUEST_DEADLINE_SECONDS с момента вызова)
+
+        Returns:
+            PipelineResult: Ответ, источники, категория и длительности этапов
+        """
+        deadline = deadline or Deadline()
+        classifier = self.components.classifier
+        faq_index = self.components.faq_index
+        answer_cache = self.components.answer_cache
+        timings: Dict[str, float] = {}
+        user_query = user_query.strip("\n ")
+
+        # Быстрый путь: вопрос почти дословно совпадает с заголовком статьи портала
+        with _StageTimer(timings, "faq"):
+            faq_match = faq_index.match(user_query) if faq_index is not None else None
+        if faq_match is not None:
+            with _StageTimer(timings, "classification"):
+                category = classifier.classify(user_query)
+            return PipelineResult(faq_match.content, faq_match.source, category,
+                                  RESPONSE_TYPE_FAQ, 0, timings)
+
+        # Один снимок индекса на весь запрос, даже если во время ответа произойдёт переключение
+        index_version, retriever = snapshot or self.components.index_watcher.get_snapshot()
+        if answer_cache is not None:
+            with _StageTimer(timings, "cache"):
+                cached = answer_cache.get_answer(index_version, user_query)
+            if cached is not None:
+                return PipelineResult(cached.answer, cached.sources, cached.category,
+                                      RESPONSE_TYPE_CACHE, 0, timings)
+            retriever = CachedRetriever(retriever, answer_cache, index_version)
+
+        # Поиск без генерации: если близких фрагментов нет, раунды генерации ничего не найдут
+        relevance, decision = None, None
+        relevance_gate = self.components.relevance_gate
+        if relevance_gate is not None and relevance_gate.applies_to(index_version):
+            with _StageTimer(timings, "relevance"):
+                relevance = top_relevance(retriever.get_relevant_documents_multi(
+                    [user_query, preprocess_query(user_query)]))
+            decision = relevance_gate.decide(relevance)
+            if decision == OFF_TOPIC:
+                return PipelineResult(ANSWER_FOR_SUPPORT_HELP, "", CANDIDATE_LABELS[-1], RESPONSE_TYPE_OFF_TOPIC,
+                                      0, timings, relevance=relevance)
+
+        # Одинаковые вопросы, заданные одновременно (например, при сбое портала),
+        # обрабатываются один раз: остальные сессии ждут результат первой
+        key = (index_version, normalize_query(user_query))
+        start = time.perf_counter()
+        remaining = deadline.remaining()
+        try:
+            result, coalesced = self.components.inflight.do(
+                key, lambda: self._admitted_generate(user_query, index_version, retriever, timings, session_id,
+                                                     deadline, verify=decision != ON_TOPIC),
+                timeout=remaining if remaining != float("inf") else None)
+        except AdmissionRejected as rejected:
+            return self._shed(user_query, rejected, timings)
+        except FutureTimeoutError:
+            # Ответ на такой же вопрос другой сессии не успел к сроку этого запроса
+            print(f"⏱ Срок запроса ({deadline.seconds} с) истёк в ожидании ответа на такой же вопрос")
+            return PipelineResult(ANSWER_FOR_SUPPORT_HELP, "", CANDIDATE_LABELS[-1], RESPONSE_TYPE_DEADLINE, 0,
+                                  {**timings, "coalesced": time.perf_counter() - start}, truncated=True,
+                                  coalesced=True, relevance=relevance)
+        if not coalesced:
+            return replace(result, relevance=relevance)
+        return replace(result, timings={**timings, "coalesced": time.perf_counter() - start}, coalesced=True,
+                       relevance=relevance)
+
+    def _admitted_generate(self, user_query: str, index_version: str, retriever, timings: Dict[str, float],
+                           session_id: Optional[str], deadline: Deadline, verify: bool = True) -> PipelineResult:
+        """Генерация после допуска контроллером нагрузки (если он включён)."""
+        admission = self.components.admission
+        if admission is None:
+            return self._generate(user_query, index_version, retriever, timings, deadline, verify)
+        # Ожидание в очереди входит в срок запроса
+        remaining = deadline.remaining()
+        with _StageTimer(timings, "queue"):
+            ticket = admission.acquire(session_id, remaining if remaining != float("inf") else None)
+        try:
+            return self._generate(user_query, index_version, retriever, timings, deadline, verify)
+        finally:
+            admission.release(ticket)
+
+    def _shed(self, user_query: str, rejected: AdmissionRejected, timings: Dict[str, float]) -> PipelineResult:
+        """
+        Быстрый ответ на отклонённый при перегрузке вопрос: проверенный ответ из кэша
+        для любой версии индекса, иначе контакты поддержки. Классификатор не вызывается.
+        """
+        answer_cache = self.components.answer_cache
+        cached = answer_cache.get_latest_answer(user_query) if answer_cache is not None else None
+        print(f"🚦 {rejected}")
+        if cached is not None:
+            return PipelineResult(cached.answer, cached.sources, cached.category, RESPONSE_TYPE_SHED,
+                                  0, timings, shed_reason=rejected.reason)
+        return PipelineResult(ANSWER_FOR_SUPPORT_HELP, "", CANDIDATE_LABELS[-1], RESPONSE_TYPE_SHED,
+                              0, timings, shed_reason=rejected.reason)
+
+    def _generate(self, user_query: str, index_version: str, retriever, timings: Dict[str, float],
+                  deadline: Deadline, verify: bool = True) -> PipelineResult:
+        """
+        Раунды переформулировки, классификации, поиска, генерации и проверки ответа.
+        При verify=False (найдены очень близкие фрагменты) первый ответ принимается без проверки.
+
+        Каждый вызов LLM ограничен бюджетом этапа из срока запроса; раунд, который по оценке
+        не успеет до срока, не начинается, и возвращается лучший ответ на этот момент с пометкой.
+        Если срок истёк до первого раунда (например, в очереди), сразу возвращаются контакты поддержки.
+        """
+        classifier = self.components.classifier
+        answer_generator = self.components.answer_generator
+        answer_cache = self.components.answer_cache
+        round_estimate = self.components.round_estimate
+        original_query = user_query
+
+        buffer_queries: List[str] = []
+        buffer_answers: List[str] = []
+        answer, sources = ANSWER_FOR_SUPPORT_HELP, ""
+        attempts = 0
+        verified = False
+        truncated = False
+        # Последний ответ остановлен по времени генерации, а не закончен моделью
+        answer_cut = False
+
+        # Все формулировки вопроса за запрос: ищем по ним вместе одним батчем
+        query_variants = [user_query]
+
+        if deadline.expired():
+            print(f"⏱ Срок запроса ({deadline.seconds} с) истёк до начала генерации")
+            return PipelineResult(ANSWER_FOR_SUPPORT_HELP, "", CANDIDATE_LABELS[-1], RESPONSE_TYPE_DEADLINE,
+                                  0, timings, truncated=True)
+
+        for _ in range(MAX_TRIES_TO_GET_CORRECT_TEXT_GENERATION):
+            # Первый раунд выполняется, если срок не истёк, следующие - только если успевают до срока
+            if attempts and not deadline.fits(round_estimate.seconds):
+                truncated = True
+                break
+            round_start = time.perf_counter()
+            attempts += 1
+            with _StageTimer(timings, "rewrite"):
+                rewritten = answer_generator.generate_official_query(user_query, deadline.stage_budget("rewrite"))
+            # Оборванная по времени переформулировка хуже исходного вопроса
+            if not answer_generator.stopped_by_time:
+                user_query = rewritten
+            # Предобработка запроса
+            processed_query = preprocess_query(user_query)
+            query_variants.extend([user_query, processed_query])
+            # Классификация запроса
+            with _StageTimer(timings, "classification"):
+                category_scores = classifier.classify_with_scores(user_query)
+            category = category_scores[0][0]
+
+            # Поиск релевантных документов (в первую очередь в разделах индекса для категории)
+            with _StageTimer(timings, "retrieval"):
+                relevant_docs = retriever.get_relevant_documents_multi(query_variants, category_scores)
+
+            if deadline.expired():
+                truncated = True
+                break
+            budget = deadline.stage_budget("generation")
+            try:
+                with _StageTimer(timings, "generation"):
+                    answer, sources = answer_generator.generate_answer(user_query, relevant_docs, budget)
+            except ContextOverflowError:
+                # Запрос не помещается в окно модели - повторные попытки не помогут
+                answer, sources = ANSWER_FOR_SUPPORT_HELP, ""
+                answer_cut = False
+                break
+            except RuntimeError:
+                continue
+            answer_cut = answer_generator.stopped_by_time
+
+            if not verify:
+                verified = True
+                break
+            if deadline.expired():
+                truncated = True
+                break
+            with _StageTimer(timings, "verification"):
+                is_correct_answer = answer_generator.is_good_answer(user_query, answer,
+                                                                    deadline.stage_budget("verification"))
+            round_estimate.observe(time.perf_counter() - round_start)
+            if is_correct_answer:
+                verified = True
+                break
+
+            buffer_queries.append(user_query)
+            buffer_answers.append(answer)
+
+            if not deadline.fits(round_estimate.seconds):
+                # Следующий раунд не успеет - новую формулировку не генерируем
+                truncated = True
+                break
+            with _StageTimer(timings, "rewrite"):
+                rewritten = answer_generator.generate_new_query(buffer_queries, buffer_answers,
+                                                                deadline.stage_budget("rewrite"))
+            if not answer_generator.stopped_by_time:
+                user_query = rewritten
+                query_variants.append(user_query)
+
+        truncated = (truncated and not verified) or answer_cut
+        if truncated:
+            print(f"⏱ Ответ прерван сроком запроса ({deadline.seconds} с) после {attempts} раунд(ов)")
+            return PipelineResult(answer, sources, category, RESPONSE_TYPE_DEADLINE, attempts, timings,
+                                  truncated=True)
+        if verified and answer_cache is not None:
+            answer_cache.put_answer(index_version, original_query, answer, sources, category, RESPONSE_TYPE_RAG)
+        return PipelineResult(answer, sources, category, RESPONSE_TYPE_RAG, attempts, timings)
+
+    @staticmethod
+    def save_response(message_dao: MessageDAO, chat_id: int, result: PipelineResult) -> int:
+        """
+        Сохраняет ответ ассистента и категорию последнего вопроса чата.
+
+        Returns:
+            int: ID сообщения ассистента
+        """
+        last_label_id = CANDIDATE_LABELS.index(result.category)
+        message_dao.update_field(message_dao.get_messages(chat_id)[-1][0], "label_id", last_label_id)
+
+        content = f"**Ответ:** {result.answer}"
+        if result.truncated:
+            content += f"\n\n_{DEADLINE_TRUNCATED_NOTE}_"
+        # запись в БД
+        return message_dao.add_message(
+            chat_id,
+            'assistant',
+            content,
+            last_label_id,
+            f"**Использованные источники:** {result.sources}",
+            result.response_type,
+        )
+
+    def respond(self, message_dao: MessageDAO, chat_id: int, user_query: str,
+                session_id: Optional[str] = None) -> PipelineResult:
+        """Отвечает на последний вопрос чата и сохраняет ответ."""
+        result = self.answer(user_query, session_id=session_id)
+        self.save_response(message_dao, chat_id, result)
+        return result
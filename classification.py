@@ -1,6 +1,5 @@
-from transformers import pipeline
-from config import CLASSIFIER_MODEL_NAME
-from typing import List
+from config import CLASSIFIER_MODEL_NAME, INFERENCE_BACKEND, CLASSIFIER_BATCH_SIZE
+from typing import List, Tuple
 from db import CANDIDATE_LABELS
 
 class ZeroShotQueryClassifier:
@@ -13,33 +12,77 @@ class ZeroShotQueryClassifier:
     """
     
     def __init__(self, model_name: str = CLASSIFIER_MODEL_NAME, 
-                 candidate_labels: List[str] = CANDIDATE_LABELS):
+                 candidate_labels: List[str] = CANDIDATE_LABELS,
+                 backend: str = INFERENCE_BACKEND):
         """
         Инициализирует классификатор.
         
         Args:
             model_name: Название модели для классификации
             candidate_labels: Список возможных категорий. Если None, будет использован стандартный набор.
+            backend: Среда выполнения: "torch" или "onnx" (квантованная int8 модель)
         """
-        self.classifier = pipeline("zero-shot-classification", model=model_name)
+        if backend == "onnx":
+            from onnx_backend import onnx_zero_shot_pipeline
+            self.classifier = onnx_zero_shot_pipeline(model_name)
+        elif backend == "torch":
+            from transformers import pipeline
+            self.classifier = pipeline("zero-shot-classification", model=model_name)
+        else:
+            raise ValueError(f"Неизвестная среда выполнения моделей: {backend}")
         self.candidate_labels = candidate_labels
     
-    def classify(self, query: str) -> str:
+    def classify_with_scores(self, query: str) -> List[Tuple[str, float]]:
         """
-        Классифицирует текстовый запрос.
+        Классифицирует текстовый запрос и возвращает оценки всех категорий.
         
         Args:
             query: Текст запроса для классификации
             
         Returns:
-            str: Название наиболее подходящей категории
+            List[Tuple[str, float]]: Пары (категория, вероятность) по убыванию вероятности
         """
         result = self.classifier(
             query, 
             candidate_labels=self.candidate_labels, 
             hypothesis_template="Это {}."
         )
-        return result["labels"][0]
+        return list(zip(result["labels"], result["scores"]))
+
+    def classify_batch(self, queries: List[str], batch_size: int = CLASSIFIER_BATCH_SIZE) -> List[List[Tuple[str, float]]]:
+        """
+        Классифицирует несколько запросов батчами модели.
+        
+        Args:
+            queries: Тексты запросов
+            batch_size: Число пар (запрос, категория) в одном проходе модели
+            
+        Returns:
+            List[List[Tuple[str, float]]]: Для каждого запроса - результат classify_with_scores
+        """
+        if not queries:
+            return []
+        results = self.classifier(
+            list(queries),
+            candidate_labels=self.candidate_labels,
+            hypothesis_template="Это {}.",
+            batch_size=batch_size
+        )
+        if isinstance(results, dict):
+            results = [results]
+        return [list(zip(result["labels"], result["scores"])) for result in results]
+
+    def classify(self, query: str) -> str:
+        """
+        Классифицирует текстовый запрос.
+        
+        Args:
+            query: Текст запроса для классификации
+            
+        Returns:
+            str: Название наиболее подходящей категории
+        """
+        return self.classify_with_scores(query)[0][0]
 
 
 if __name__ == "__main__":
@@ -3,8 +3,32 @@ import os
 # Путь к PDF-документам
 PDF_DOCS_DIR = os.path.join(os.getcwd(), "pdf_docs")
  
+# Способ извлечения текста из PDF: "pymupdf" (параллельно, с кэшем страниц) или "pypdf"
+PDF_BACKEND = "pymupdf"
+# Число процессов для извлечения страниц (None - по числу ядер)
+PDF_WORKERS = None
+# Число страниц PDF в одной задаче пула процессов
+PDF_PAGES_PER_TASK = 16
+
 # Путь для сохранения векторного индекса (Chroma)
 CHROMA_PERSIST_DIR = os.path.join(os.getcwd(), "chroma_index")
+
+# Версионирование индекса: число хранимых снимков (кроме текущего)
+# и период (в секундах), с которым приложение проверяет переключение на новый снимок
+INDEX_SNAPSHOTS_TO_KEEP = 2
+INDEX_CHECK_INTERVAL = 10
+# Снимок, который процесс приложения открыл или продлил за это число секунд, не удаляется
+# при очистке, даже если он старше хранимых: запас на несколько проверок указателя и самый долгий запрос
+INDEX_LEASE_SECONDS = 120
+
+# Прогрев моделей одним запросом при запуске приложения
+STARTUP_WARMUP = True
+
+# Каталог для дисковых кэшей (снимки таблиц, извлечённый текст и т.п.)
+CACHE_DIR = os.path.join(os.getcwd(), "cache")
+
+# Файл со статьями портала поставщиков
+ARTICLES_PATH = "./arcticles.xls"
  
 # Настройки для поддержки (подумаем как это прикрутить, если у модели плохой ответ)
 SUPPORT_EMAIL = "pp-tender@mos.ru"
@@ -17,17 +41,171 @@ ANSWER_FOR_SUPPORT_HELP = (f"Извините, я не смог найти ин
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2" #"intfloat/multilingual-e5-large"
 
 
+# Хранилище текстов фрагментов снимка индекса (docstore.py): фрагментов в сжатом блоке,
+# уровень сжатия zstd и число распакованных блоков в памяти процесса
+DOCSTORE_ENABLED = True
+DOCSTORE_BLOCK_CHUNKS = 16
+DOCSTORE_ZSTD_LEVEL = 9
+DOCSTORE_BLOCK_CACHE_SIZE = 256
+
+# Шардирование индекса (sharded_index.py): число коллекций Chroma в снимке (1 - одна коллекция без шардов),
+# способ распределения фрагментов ("source" - по файлу, "hash" - по тексту фрагмента)
+# и число потоков построения и поиска (None - по потоку на шард)
+INDEX_SHARDS = 1
+INDEX_SHARD_BY = "source"
+INDEX_BUILD_WORKERS = None
+SHARD_SEARCH_WORKERS = None
+
+# Число фрагментов, возвращаемых поиском
+RETRIEVER_TOP_K = 5
+# Константа Reciprocal Rank Fusion при объединении результатов поиска по нескольким формулировкам
+RRF_K = 60
+
+# Разделы индекса по типу источника: тип -> подстроки имени файла (без учёта регистра).
+# Статьи из Excel получают тип "article", PDF без совпадений - "other"
+DOC_TYPE_FILENAME_PATTERNS = {
+    "regulation": ["регламент"],
+    "law": ["закон"],
+}
+# Разделы, в которых сначала ищется ответ для категории запроса (None - весь индекс).
+# Вопросы о функционале часто касаются процедур закупок, которые задаёт 44-ФЗ, поэтому ищутся
+# и в разделе "law"; технические сбои (вход, подпись, ошибки портала) законом не описаны,
+# и его длинные статьи только вытесняли бы инструкции из выдачи
+CATEGORY_PARTITIONS = {
+    "вопрос о функционале": ["article", "regulation", "law"],
+    "техническая поддержка": ["article", "regulation"],
+    "другое": None,
+}
+# Если разница вероятностей двух лучших категорий меньше порога, поиск идёт по всему индексу
+CATEGORY_MARGIN_THRESHOLD = 0.2
+
+# Быстрый ответ статьёй портала: минимальная косинусная близость вопроса и заголовка статьи
+FAQ_ENABLED = True
+FAQ_MATCH_THRESHOLD = 0.9
+
+# Отсечение по близости найденных фрагментов (relevance_gate.py): вопросы без близких фрагментов
+# сразу получают контакты поддержки, при очень близких ответ не перепроверяется моделью.
+# Пороги подбираются командой: python relevance_gate.py calibrate labeled.jsonl
+# и действуют только для модели эмбеддингов, среды выполнения и содержимого индекса (хэша фрагментов),
+# на которых подобраны
+RELEVANCE_GATE_ENABLED = True
+RELEVANCE_THRESHOLDS_PATH = os.path.join(os.getcwd(), "relevance_thresholds.json")
+# Допустимая доля вопросов по теме, отсекаемых как посторонние
+RELEVANCE_MAX_MISSED_RELEVANT = 0.02
+# Требуемая доля вопросов по теме среди ответов без проверки
+RELEVANCE_MIN_ON_TOPIC_PRECISION = 0.98
+
+# Срок ответа на вопрос (deadline.py), секунды - граница p99 задержки; None - без ограничения.
+# Генерация останавливается по времени, раунды, которые не успеют до срока, не начинаются,
+# и пользователь получает лучший ответ на момент срока (или контакты поддержки) с пометкой
+REQUEST_DEADLINE_SECONDS = 60.0
+# Доля срока, которую может занять один вызов LLM на этапе (не больше остатка срока)
+DEADLINE_STAGE_BUDGETS = {"rewrite": 0.15, "generation": 0.5, "verification": 0.1}
+# Начальная оценка длительности раунда генерации до первых замеров, секунды
+DEADLINE_INITIAL_ROUND_SECONDS = 20.0
+DEADLINE_TRUNCATED_NOTE = "Ответ подготовлен в сокращённом режиме из-за ограничения времени."
+
+# Кэш проверенных ответов и результатов поиска по версии индекса (SQLite)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = os.path.join(CACHE_DIR, "answers.db")
+# Наибольшее число сохранённых результатов поиска (самые старые удаляются) и их срок жизни, секунды
+ANSWER_CACHE_MAX_RETRIEVALS = 5000
+ANSWER_CACHE_RETRIEVAL_TTL = 7 * 24 * 3600
+# Прогрев кэша самыми частыми вопросами из history.db при переключении на новый снимок индекса
+CACHE_WARMUP_ON_SWAP = True
+CACHE_WARMUP_TOP_N = 50
+# Сколько вопросов прогрева обрабатывается одним пакетом (батчами модели, как в batch_answer.py)
+CACHE_WARMUP_BATCH_SIZE = 4
+# Прогревать только вопросы с положительной оценкой ответа
+CACHE_WARMUP_ONLY_RATED = True
+# Общее время прогрева, после которого новые пакеты не начинаются и снимок переключается, секунды.
+# Пакет начинается, только если до конца осталось не меньше DEADLINE_INITIAL_ROUND_SECONDS
+# (одного раунда генерации): ответы прогрева не обрываются по времени
+CACHE_WARMUP_MAX_SECONDS = 180.0
+
+# Контроль допуска к генерации (admission.py): при перегрузке вопрос сразу получает
+# ответ из кэша (любой версии индекса) или контакты поддержки вместо долгого ожидания
+ADMISSION_ENABLED = True
+# Сколько вопросов генерируется одновременно (одна модель на GPU обрабатывает запросы по очереди)
+ADMISSION_MAX_CONCURRENT = 1
+# Максимальная длина очереди к генерации
+ADMISSION_MAX_QUEUE = 16
+# Одновременных вопросов одной сессии пользователя
+ADMISSION_MAX_PER_SESSION = 1
+# Допустимое ожидание в очереди, секунды
+ADMISSION_WAIT_SLO = 30.0
+# Начальная оценка времени генерации ответа до первых замеров, секунды
+ADMISSION_INITIAL_SERVICE_TIME = 10.0
+
 # Модель для классификации (zero-shot) – модель для XNLI
 CLASSIFIER_MODEL_NAME = "MoritzLaurer/mDeBERTa-v3-base-mnli-xnli"
+# Число пар (запрос, категория) в одном проходе классификатора при пакетной обработке
+CLASSIFIER_BATCH_SIZE = 32
+
+# Среда выполнения эмбеддингов и классификатора: "torch" или "onnx"
+# (int8 ONNX-модели предварительно экспортируются командой: python onnx_backend.py export)
+INFERENCE_BACKEND = "torch"
+ONNX_MODELS_DIR = os.path.join(os.getcwd(), "onnx_models")
+ONNX_EMBEDDING_BATCH_SIZE = 32
+# Допуски проверки ONNX-моделей (tests/test_onnx_backend.py): 1 - косинусная близость эмбеддингов и разница вероятностей классов
+ONNX_EMBEDDING_TOLERANCE = 0.02
+ONNX_CLASSIFIER_TOLERANCE = 0.05
  
 # Локальная LLM для генерации ответов (YandexGPT-5 Lite Instruct)
 LLM_MODEL_NAME = "yandex/YandexGPT-5-Lite-8B-instruct"
 MAX_TRIES_TO_GET_CORRECT_TEXT_GENERATION = 2
  
+# Среда выполнения LLM: "hf" (transformers), "llama_cpp" (квантованная GGUF-модель на CPU)
+# или "stub" (детерминированная заглушка без весов для нагрузочных тестов)
+GENERATION_BACKEND = "hf"
+# Черновая модель для assisted (speculative) decoding в среде "hf"; None - выключено.
+# Должна использовать тот же токенизатор, что и LLM_MODEL_NAME
+DRAFT_MODEL_NAME = None
+# Путь к GGUF-файлу модели для llama_cpp
+GGUF_MODEL_PATH = os.path.join(os.getcwd(), "models", "YandexGPT-5-Lite-8B-instruct-Q4_K_M.gguf")
+GGUF_CONTEXT_WINDOW = 8192
+# Число потоков llama.cpp (None - по числу ядер)
+GGUF_THREADS = None
+# Заглушка: окно контекста и имитируемое время генерации одного токена в секундах
+STUB_CONTEXT_WINDOW = 8192
+STUB_SECONDS_PER_TOKEN = 0.0
+
 # Параметры генерации ответа
 MAX_NEW_TOKENS = 500
 TEMPERATURE = 0.2
+# Число промптов в одном вызове generate при пакетной генерации (batch_answer.py)
+GENERATION_BATCH_SIZE = 8
+
+# Пакетные ответы на вопросы из файла (batch_answer.py): вопросов в одном пакете
+# (после каждого пакета результаты сохраняются на диск) и число потоков/процессов
+# предобработки и поиска (None - по числу ядер)
+BATCH_ANSWER_SIZE = 64
+BATCH_ANSWER_WORKERS = None
 
 #Параметры для разделения текста PDF файлов на чанки
 CHUNK_SIZE = 1200
-CHUNK_OVERLAP = 200
\ No newline at end of file
+CHUNK_OVERLAP = 200
+
+# Параметры упаковки контекста в промпт
+# Бюджет токенов на документы в промпте (дополнительно ограничивается окном модели)
+CONTEXT_TOKEN_BUDGET = 2048
+# Окно контекста модели в токенах; None - определить по конфигурации модели
+MODEL_CONTEXT_WINDOW = None
+# Запас токенов на служебные символы шаблона и разделители
+CONTEXT_SAFETY_MARGIN = 32
+# Минимальная длина (в символах) совпадения конца одного чанка с началом другого
+CONTEXT_MIN_OVERLAP_CHARS = 30
+# Фрагменты короче этого числа токенов после обрезки в контекст не добавляются
+CONTEXT_MIN_PIECE_TOKENS = 32
+# Токенизаторы (модели HuggingFace), которыми фрагменты токенизируются при индексации (хранятся в docstore);
+# генератор с тем же токенизатором собирает токены промпта без повторной токенизации документов
+PRETOKENIZE_TOKENIZERS = [LLM_MODEL_NAME]
+
+# Удаление почти-дубликатов при индексации (MinHash + LSH)
+DEDUP_ENABLED = True
+MINHASH_NUM_PERM = 128
+MINHASH_SHINGLE_SIZE = 5
+LSH_BANDS = 32
+# Пороги оценки коэффициента Жаккара, начиная с которых файлы/чанки считаются дубликатами
+DEDUP_FILE_THRESHOLD = 0.9
+DEDUP_CHUNK_THRESHOLD = 0.85
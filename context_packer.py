@@ -0,0 +1,396 @@
+# Упаковка найденных фрагментов в контекст промпта с учётом бюджета токенов:
+#  удаление перекрытий между соседними чанками, склейка и отбор по релевантности
+
+import bisect
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import CHUNK_OVERLAP, CONTEXT_MIN_OVERLAP_CHARS, CONTEXT_MIN_PIECE_TOKENS
+
+# Ключ метаданных документа с токенами, посчитанными при индексации: {имя токенизатора: ChunkTokens}
+TOKENS_KEY = "_tokens"
+PIECE_SEPARATOR = "\n\n"
+# Окончание заголовка фрагмента (format_piece) и типичное окончание фрагмента: текст после них
+#  токенизируется в их окружении, чтобы на стыках получались те же токены, что и при токенизации
+#  промпта целиком (SentencePiece добавляет «▁» в начало отдельно токенизированного текста)
+HEADER_END = "):"
+CHUNK_END = "."
+
+
+class ContextOverflowError(ValueError):
+    """Промпт не помещается в контекстное окно модели даже без документов."""
+
+
+def chunk_prompt_text(text: str) -> str:
+    """Текст фрагмента в том виде, в котором он попадает в промпт (для него считаются токены при индексации)."""
+    return text.strip().replace("\n", " ")
+
+
+def tokenizer_key(name: str, tokenizer) -> str:
+    """
+    Версия токенизатора для токенов, сохранённых при индексации: имя модели и хэш словаря
+    (если токенизатор его отдаёт) и окружения, в котором токенизируются фрагменты,
+    чтобы токены обновлённой модели или старого формата не путались с текущими.
+    """
+    get_vocab = getattr(tokenizer, "get_vocab", None)
+    vocab = json.dumps(sorted(get_vocab().items()), ensure_ascii=False) if get_vocab is not None else ""
+    digest = hashlib.sha1(f"{HEADER_END}{vocab}".encode("utf-8")).hexdigest()[:12]
+    return f"{name}@{digest}"
+
+
+def tokenize_with_starts(tokenizer, text: str) -> Tuple[List[int], List[int]]:
+    """
+    Токенизирует текст без служебных токенов и возвращает смещения начала токенов в символах.
+
+    Быстрые токенизаторы HuggingFace отдают смещения сами, для остальных они
+    восстанавливаются декодированием префиксов (медленно, но только при индексации).
+    """
+    try:
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return list(encoding["input_ids"]), [start for start, _ in encoding["offset_mapping"]]
+    except (TypeError, NotImplementedError):
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        return ids, [len(tokenizer.decode(ids[:i], skip_special_tokens=True)) for i in range(len(ids))]
+
+
+def encode_after(tokenizer, context: str, text: str) -> Optional[List[int]]:
+    """
+    Токены text так, как он токенизируется сразу после context (без служебных токенов).
+
+    Returns:
+        Optional[List[int]]: Токены или None, если context сливается с началом text в общий токен
+    """
+    context_ids = tokenizer.encode(context, add_special_tokens=False)
+    ids = tokenizer.encode(context + text, add_special_tokens=False)
+    if ids[:len(context_ids)] != context_ids:
+        return None
+    return ids[len(context_ids):]
+
+
+@dataclass
+class ChunkTokens:
+    """
+    Токены текста фрагмента (chunk_prompt_text) токенизатором генерирующей модели.
+
+    Attributes:
+        ids (List[int]): ID токенов
+        starts (List[int]): Смещение начала каждого токена в символах в тексте с пробелом после
+            заголовка (" " + текст): первый токен включает этот пробел
+    """
+    ids: List[int]
+    starts: List[int]
+
+
+def tokenize_chunk(tokenizer, text: str) -> Optional["ChunkTokens"]:
+    """
+    Токены текста фрагмента (chunk_prompt_text) в том виде, в котором он стоит в промпте -
+    после заголовка «...): »; пробел после заголовка входит в первый токен фрагмента.
+
+    Returns:
+        Optional[ChunkTokens]: Токены или None, если заголовок сливается с фрагментом в общий токен
+    """
+    header_ids = tokenizer.encode(HEADER_END, add_special_tokens=False)
+    ids, starts = tokenize_with_starts(tokenizer, f"{HEADER_END} {text}")
+    if ids[:len(header_ids)] != header_ids:
+        return None
+    skip = len(header_ids)
+    return ChunkTokens(ids[skip:], [max(start - len(HEADER_END), 0) for start in starts[skip:]])
+
+
+@dataclass
+class ContextPiece:
+    """
+    Склеенный фрагмент контекста из одного источника/страницы.
+
+    Attributes:
+        source (str): Имя источника
+        page (Any): Номер страницы (если есть)
+        text (str): Текст фрагмента без перекрытий
+        rank (int): Лучшая позиция среди исходных чанков (0 - самый релевантный)
+        members (List[int]): Индексы исходных документов, вошедших во фрагмент
+        tokens (Optional[ChunkTokens]): Токены текста, если они известны с индексации
+    """
+    source: str
+    page: Any
+    text: str
+    rank: int
+    members: List[int] = field(default_factory=list)
+    tokens: Optional[ChunkTokens] = None
+
+
+def _suffix_prefix_overlap(left: str, right: str, max_overlap: int, min_overlap: int) -> int:
+    """
+    Возвращает длину самого длинного совпадения конца left с началом right
+    (не длиннее max_overlap и не короче min_overlap), иначе 0.
+    """
+    if len(right) < min_overlap or len(left) < min_overlap:
+        return 0
+    tail = left[-max_overlap:]
+    seed = right[:min_overlap]
+    start = tail.find(seed)
+    while start != -1:
+        if right.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(seed, start + 1)
+    return 0
+
+
+def _merge_pair(left: str, right: str, max_overlap: int, min_overlap: int) -> Optional[str]:
+    """Склеивает два фрагмента, если один содержит другой или они перекрываются."""
+    if right in left:
+        return left
+    if left in right:
+        return right
+    overlap = _suffix_prefix_overlap(left, right, max_overlap, min_overlap)
+    if overlap:
+        return left + right[overlap:]
+    overlap = _suffix_prefix_overlap(right, left, max_overlap, min_overlap)
+    if overlap:
+        return right + left[overlap:]
+    return None
+
+
+def _merge_tokens(left: ContextPiece, right: ContextPiece, text: str) -> Optional[ChunkTokens]:
+    """
+    Токены склейки двух фрагментов без повторной токенизации: токены первого фрагмента
+    и токены второго, начинающиеся после перекрытия.
+
+    Склейка возможна, только если перекрытие начинается после пробела, оба фрагмента
+    токенизировали его одинаково и оно заканчивается на границе токена второго фрагмента;
+    иначе (слово разрезано краем чанка) возвращается None, и текст склейки токенизируется заново.
+    Смещения токенов считаются в тексте с пробелом в начале (см. ChunkTokens): пробел перед
+    вторым фрагментом соответствует пробелу перед перекрытием в первом.
+    """
+    if text == left.text:
+        return left.tokens
+    if text == right.text:
+        return right.tokens
+    if left.tokens is None or right.tokens is None:
+        return None
+    if not text.startswith(left.text):
+        left, right = right, left
+    overlap = len(left.text) + len(right.text) - len(text)
+    shift = len(left.text) - overlap
+    if not left.text[shift - 1].isspace():
+        return None
+    skip = bisect.bisect_left(right.tokens.starts, overlap + 1)
+    if skip == len(right.tokens.starts) or right.tokens.starts[skip] != overlap + 1:
+        return None
+    tail = bisect.bisect_left(left.tokens.starts, shift)
+    if (list(left.tokens.ids[tail:]) != list(right.tokens.ids[:skip])
+            or [start - shift for start in left.tokens.starts[tail:]] != list(right.tokens.starts[:skip])):
+        return None
+    return ChunkTokens(
+        list(left.tokens.ids) + list(right.tokens.ids[skip:]),
+        list(left.tokens.starts) + [start + shift for start in right.tokens.starts[skip:]],
+    )
+
+
+class ContextPacker:
+    """
+    Собирает контекст для промпта из найденных документов.
+
+    Чанки одного источника и страницы, нарезанные с перекрытием (CHUNK_OVERLAP),
+    склеиваются без повторов, после чего фрагменты добавляются в порядке
+    релевантности, пока не исчерпан бюджет токенов. Длина измеряется токенизатором
+    генерирующей модели; если у документов есть токены этого токенизатора,
+    посчитанные при индексации, текст фрагментов повторно не токенизируется.
+
+    Attributes:
+        tokenizer: Токенизатор с методами encode/decode (интерфейс HuggingFace)
+        tokenizer_name (Optional[str]): Имя токенизатора для поиска токенов в метаданных документов
+        token_budget (int): Максимальное число токенов контекста
+        max_overlap (int): Максимальная длина перекрытия соседних чанков в символах
+        min_overlap (int): Минимальная длина совпадения, считающегося перекрытием
+        min_piece_tokens (int): Минимальный размер обрезанного фрагмента в токенах
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        token_budget: int,
+        max_overlap: int = CHUNK_OVERLAP,
+        min_overlap: int = CONTEXT_MIN_OVERLAP_CHARS,
+        min_piece_tokens: int = CONTEXT_MIN_PIECE_TOKENS,
+        tokenizer_name: Optional[str] = None
+    ):
+        self.tokenizer = tokenizer
+        self.tokenizer_name = tokenizer_name
+        self.token_budget = token_budget
+        self.max_overlap = max_overlap
+        self.min_overlap = min_overlap
+        self.min_piece_tokens = min_piece_tokens
+
+    def count_tokens(self, text: str) -> int:
+        """Возвращает длину текста в токенах модели."""
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def encode(self, text: str) -> List[int]:
+        """Токены текста без служебных токенов."""
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def encode_chunk(self, text: str) -> Optional[List[int]]:
+        """Токены текста фрагмента после заголовка (см. tokenize_chunk) или None, если стык не совпадает."""
+        return encode_after(self.tokenizer, HEADER_END, " " + text)
+
+    def special_tokens(self) -> Tuple[List[int], List[int]]:
+        """Служебные токены, которые токенизатор добавляет в начало и конец текста (например, BOS)."""
+        probe = "Документ"
+        plain = self.encode(probe)
+        full = self.tokenizer.encode(probe, add_special_tokens=True)
+        for i in range(len(full) - len(plain) + 1):
+            if full[i:i + len(plain)] == plain:
+                return list(full[:i]), list(full[i + len(plain):])
+        return [], []
+
+    def _document_tokens(self, doc) -> Optional[ChunkTokens]:
+        if self.tokenizer_name is None:
+            return None
+        return (doc.metadata.get(TOKENS_KEY) or {}).get(self.tokenizer_name)
+
+    def piece_tokens(self, piece: ContextPiece) -> int:
+        """Длина текста фрагмента в токенах (без токенизации, если токены известны)."""
+        if piece.tokens is not None:
+            return len(piece.tokens.ids)
+        return self.count_tokens(piece.text)
+
+    def merge_documents(self, docs: List) -> List[ContextPiece]:
+        """
+        Группирует документы по (источник, страница) и склеивает перекрывающиеся чанки.
+
+        Args:
+            docs: Документы в порядке убывания релевантности
+
+        Returns:
+            List[ContextPiece]: Фрагменты в порядке убывания релевантности
+        """
+        groups: Dict[Tuple[str, str], List[ContextPiece]] = {}
+        for rank, doc in enumerate(docs):
+            source = doc.metadata.get("source", f"Документ_{rank + 1}")
+            page = doc.metadata.get("page")
+            piece = ContextPiece(source, page, doc.page_content.strip(), rank, [rank],
+                                 self._document_tokens(doc))
+            bucket = groups.setdefault((source, str(page)), [])
+
+            # Склеиваем новый чанк с уже накопленными фрагментами, пока это возможно
+            merged = True
+            while merged:
+                merged = False
+                for other in bucket:
+                    text = _merge_pair(other.text, piece.text, self.max_overlap, self.min_overlap)
+                    if text is not None:
+                        bucket.remove(other)
+                        piece = ContextPiece(source, page, text, min(other.rank, piece.rank),
+                                             sorted(other.members + piece.members),
+                                             _merge_tokens(other, piece, text))
+                        merged = True
+                        break
+            bucket.append(piece)
+
+        pieces = [piece for bucket in groups.values() for piece in bucket]
+        return sorted(pieces, key=lambda p: p.rank)
+
+    def _truncate(self, piece: ContextPiece, max_tokens: int) -> None:
+        """Обрезает фрагмент до max_tokens токенов."""
+        if piece.tokens is not None:
+            piece.tokens = ChunkTokens(list(piece.tokens.ids[:max_tokens]), list(piece.tokens.starts[:max_tokens]))
+            piece.text = self.tokenizer.decode(piece.tokens.ids, skip_special_tokens=True)
+            return
+        ids = self.encode(piece.text)[:max_tokens]
+        piece.text = self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def pack(self, docs: List, token_budget: Optional[int] = None) -> List[ContextPiece]:
+        """
+        Отбирает фрагменты в пределах бюджета токенов.
+
+        Args:
+            docs: Документы в порядке убывания релевантности
+            token_budget: Бюджет токенов (по умолчанию self.token_budget)
+
+        Returns:
+            List[ContextPiece]: Фрагменты, суммарно не превышающие бюджет
+        """
+        budget = self.token_budget if token_budget is None else token_budget
+        packed = []
+        for piece in self.merge_documents(docs):
+            if budget < self.min_piece_tokens:
+                break
+            header_tokens = self.count_tokens(self.format_piece(len(packed) + 1, piece, ""))
+            text_tokens = self.piece_tokens(piece)
+            if header_tokens + text_tokens > budget:
+                # Самый релевантный хвост не влезает целиком - берём начало фрагмента
+                available = budget - header_tokens
+                if available < self.min_piece_tokens:
+                    continue
+                self._truncate(piece, available)
+                text_tokens = self.piece_tokens(piece)
+            packed.append(piece)
+            budget -= header_tokens + text_tokens
+        return packed
+
+    @staticmethod
+    def format_piece(index: int, piece: ContextPiece, text: str) -> str:
+        """Форматирует фрагмент для промпта."""
+        location = piece.source
+        if isinstance(piece.page, int) or str(piece.page).isdigit():
+            location = f"{piece.source}, стр. {piece.page}"
+        return f"Документ {index} ({location}): {text}"
+
+    def format(self, docs: List, token_budget: Optional[int] = None) -> str:
+        """
+        Формирует текст контекста в пределах бюджета токенов.
+
+        Args:
+            docs: Документы в порядке убывания релевантности
+            token_budget: Бюджет токенов (по умолчанию self.token_budget)
+
+        Returns:
+            str: Отформатированный контекст
+        """
+        pieces = self.pack(docs, token_budget)
+        return PIECE_SEPARATOR.join(
+            self.format_piece(i, piece, chunk_prompt_text(piece.text))
+            for i, piece in enumerate(pieces, start=1)
+        )
+
+    def _header(self, index: int, piece: ContextPiece) -> str:
+        """Заголовок фрагмента без пробела после двоеточия (он входит в первый токен фрагмента)."""
+        return self.format_piece(index, piece, "")[:-1]
+
+    def format_ids(self, docs: List, token_budget: Optional[int] = None,
+                   prefix: str = "", suffix: str = "") -> Optional[List[int]]:
+        """
+        Формирует токены промпта prefix + контекст + suffix из токенов фрагментов, посчитанных
+        при индексации: токенизируются только шаблон, заголовки фрагментов и разделители.
+
+        Текст между фрагментами токенизируется одним куском вместе со следующим заголовком
+        в окружении стыков (HEADER_END, CHUNK_END), поэтому токены совпадают с токенизацией
+        промпта prefix + format(docs) + suffix целиком, включая служебные токены.
+
+        Args:
+            docs: Документы в порядке убывания релевантности
+            token_budget: Бюджет токенов (по умолчанию self.token_budget)
+            prefix: Текст промпта до контекста
+            suffix: Текст промпта после контекста
+
+        Returns:
+            Optional[List[int]]: Токены промпта или None, если ни у одного фрагмента нет готовых
+                токенов или стык фрагмента с шаблоном токенизируется иначе, чем в целом промпте
+        """
+        pieces = self.pack(docs, token_budget)
+        if not any(piece.tokens is not None for piece in pieces):
+            return None
+        leading, trailing = self.special_tokens()
+        ids = leading + self.encode(prefix + self._header(1, pieces[0]))
+        for i, piece in enumerate(pieces, start=1):
+            chunk_ids = piece.tokens.ids if piece.tokens is not None else self.encode_chunk(
+                chunk_prompt_text(piece.text))
+            glue = PIECE_SEPARATOR + self._header(i + 1, pieces[i]) if i < len(pieces) else suffix
+            glue_ids = encode_after(self.tokenizer, CHUNK_END, glue)
+            if chunk_ids is None or glue_ids is None:
+                return None
+            ids.extend(chunk_ids)
+            ids.extend(glue_ids)
+        return ids + trailing
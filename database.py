@@ -1,7 +1,10 @@
 import sqlite3
+import threading
 from datetime import datetime
 from typing import List, Tuple, Optional, Dict, Any
 
+from answer_cache import normalize_query
+
 DB_PATH = "history.db"
 
 class InteractionLogger:
@@ -12,6 +15,12 @@ class InteractionLogger:
         db_path (str): Путь к файлу базы данных
         conn (sqlite3.Connection): Соединение с базой данных
         cursor (sqlite3.Cursor): Курсор для выполнения запросов
+
+    Один экземпляр используется всеми сессиями Streamlit (st.cache_resource), поэтому
+    соединение и курсор доступны только под блокировкой.
+
+    Повторы вопроса объединяются по нормализованному тексту (query_key, тот же ключ,
+    что и в кэше ответов), оценки накапливаются в счётчиках positive_ratings и negative_ratings.
     """
     
     def __init__(self, db_path: str = DB_PATH):
@@ -24,10 +33,11 @@ class InteractionLogger:
         self.db_path = db_path
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        self._lock = threading.Lock()
         self._init_db()
     
     def _init_db(self) -> None:
-        """Создает таблицу history, если она не существует."""
+        """Создает таблицу history, если она не существует, и добавляет новые колонки в старую."""
         self.cursor.execute("""
             CREATE TABLE IF NOT EXISTS history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -37,9 +47,24 @@ class InteractionLogger:
                 answer TEXT,
                 sources TEXT,
                 rating INTEGER,
-                frequency INTEGER
+                frequency INTEGER,
+                query_key TEXT,
+                positive_ratings INTEGER DEFAULT 0,
+                negative_ratings INTEGER DEFAULT 0
             )
         """)
+        columns = {row[1] for row in self.cursor.execute("PRAGMA table_info(history)")}
+        if "query_key" not in columns:
+            self.cursor.execute("ALTER TABLE history ADD COLUMN query_key TEXT")
+            self.cursor.execute("ALTER TABLE history ADD COLUMN positive_ratings INTEGER DEFAULT 0")
+            self.cursor.execute("ALTER TABLE history ADD COLUMN negative_ratings INTEGER DEFAULT 0")
+            # Оценка последнего ответа старых записей засчитывается один раз
+            rows = self.cursor.execute("SELECT id, user_query, rating FROM history").fetchall()
+            self.cursor.executemany(
+                "UPDATE history SET query_key = ?, positive_ratings = ?, negative_ratings = ? WHERE id = ?",
+                [(normalize_query(query or ""), int(rating is not None and rating > 0),
+                  int(rating is not None and rating <= 0), record_id) for record_id, query, rating in rows])
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_query_key ON history (query_key)")
         self.conn.commit()
     
     def log_interaction(
@@ -50,7 +75,8 @@ class InteractionLogger:
         sources: str
     ) -> int:
         """
-        Логирует взаимодействие с пользователем.
+        Логирует взаимодействие с пользователем. Повтор вопроса (с точностью до нормализации)
+        увеличивает частоту существующей записи, оценки предыдущих ответов сохраняются.
         
         Args:
             user_query: Текст запроса пользователя
@@ -62,47 +88,49 @@ class InteractionLogger:
             int: ID созданной или обновленной записи
         """
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        query_key = normalize_query(user_query)
         
-        # Проверяем существование такого же запроса
-        self.cursor.execute(
-            "SELECT id, frequency FROM history WHERE user_query = ?", 
-            (user_query,)
-        )
-        row = self.cursor.fetchone()
-        
-        if row:
-            # Обновляем существующую запись
-            record_id, freq = row
+        # Поиск и обновление/создание записи - одна транзакция под блокировкой,
+        # частота увеличивается в самом запросе, чтобы не терять параллельные обращения
+        with self._lock, self.conn:
             self.cursor.execute("""
                 UPDATE history 
-                SET frequency = ?, timestamp = ?, category = ?, answer = ?, sources = ?, rating = NULL 
-                WHERE id = ?
-            """, (freq + 1, timestamp, category, answer, sources, record_id))
-        else:
-            # Создаем новую запись
-            self.cursor.execute("""
-                INSERT INTO history (
-                    timestamp, user_query, category, answer, sources, rating, frequency
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (timestamp, user_query, category, answer, sources, None, 1))
-            record_id = self.cursor.lastrowid
+                SET frequency = frequency + 1, timestamp = ?, category = ?, answer = ?, sources = ?
+                WHERE id = (SELECT id FROM history WHERE query_key = ? LIMIT 1)
+            """, (timestamp, category, answer, sources, query_key))
+            if self.cursor.rowcount:
+                # Обновлена существующая запись
+                self.cursor.execute(
+                    "SELECT id FROM history WHERE query_key = ? LIMIT 1", 
+                    (query_key,)
+                )
+                record_id = self.cursor.fetchone()[0]
+            else:
+                # Создаем новую запись
+                self.cursor.execute("""
+                    INSERT INTO history (
+                        timestamp, user_query, category, answer, sources, rating, frequency, query_key
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (timestamp, user_query, category, answer, sources, None, 1, query_key))
+                record_id = self.cursor.lastrowid
         
-        self.conn.commit()
         return record_id
     
     def update_rating(self, record_id: int, rating_value: int) -> None:
         """
-        Обновляет оценку для указанной записи.
+        Обновляет оценку последнего ответа и счётчик положительных или отрицательных оценок записи.
         
         Args:
             record_id: ID записи в базе данных
-            rating_value: Значение оценки (целое число)
+            rating_value: Значение оценки (целое число, больше 0 - положительная)
         """
-        self.cursor.execute(
-            "UPDATE history SET rating = ? WHERE id = ?", 
-            (rating_value, record_id)
-        )
-        self.conn.commit()
+        positive = int(rating_value > 0)
+        with self._lock, self.conn:
+            self.cursor.execute(
+                "UPDATE history SET rating = ?, positive_ratings = positive_ratings + ?, "
+                "negative_ratings = negative_ratings + ? WHERE id = ?", 
+                (rating_value, positive, 1 - positive, record_id)
+            )
     
     def get_history(self, limit: int = 10) -> List[Tuple]:
         """
@@ -114,15 +142,42 @@ class InteractionLogger:
         Returns:
             List[Tuple]: Список записей из истории
         """
-        self.cursor.execute(
-            "SELECT timestamp, user_query, category, rating FROM history ORDER BY id DESC LIMIT ?", 
-            (limit,)
-        )
-        return self.cursor.fetchall()
+        with self._lock:
+            self.cursor.execute(
+                "SELECT timestamp, user_query, category, rating FROM history ORDER BY id DESC LIMIT ?", 
+                (limit,)
+            )
+            return self.cursor.fetchall()
+    
+    def get_frequent_queries(self, limit: int = 50, only_rated: bool = False) -> List[Tuple[str, int]]:
+        """
+        Возвращает самые частые запросы, у которых положительных оценок не меньше отрицательных.
+        Записи с одинаковым нормализованным текстом объединяются.
+
+        Args:
+            limit: Максимальное количество запросов
+            only_rated: Только запросы, у которых положительных оценок больше, чем отрицательных
+
+        Returns:
+            List[Tuple[str, int]]: Пары (самая частая формулировка запроса, суммарная частота) по убыванию частоты
+        """
+        rating_filter = "positive > negative" if only_rated else "positive >= negative"
+        with self._lock:
+            self.cursor.execute(
+                "SELECT (SELECT user_query FROM history AS variant WHERE variant.query_key = grouped.query_key"
+                "        ORDER BY frequency DESC LIMIT 1), total FROM ("
+                "  SELECT query_key, SUM(frequency) AS total, MAX(timestamp) AS last,"
+                "         SUM(positive_ratings) AS positive, SUM(negative_ratings) AS negative"
+                "  FROM history GROUP BY query_key"
+                f") AS grouped WHERE {rating_filter} ORDER BY total DESC, last DESC LIMIT ?",
+                (limit,)
+            )
+            return self.cursor.fetchall()
     
     def close(self) -> None:
         """Закрывает соединение с базой данных."""
-        self.conn.close()
+        with self._lock:
+            self.conn.close()
     
     def __enter__(self):
         """Поддержка контекстного менеджера."""
@@ -2,4 +2,6 @@ from .chat_dao import ChatDAO
 from .base_dao import BaseDAO
 from .message_dao import MessageDAO
 from .label_dao import LabelDAO
-from .constants import DATE_FORMAT, CANDIDATE_LABELS
\ No newline at end of file
+from .constants import DATE_FORMAT, CANDIDATE_LABELS, RESPONSE_TYPE_RAG, RESPONSE_TYPE_FAQ, RESPONSE_TYPE_CACHE, RESPONSE_TYPE_SHED, RESPONSE_TYPE_OFF_TOPIC, RESPONSE_TYPE_DEADLINE
+from .maintenance import ChatArchiver
+
@@ -1,3 +1,23 @@
 DATABASE_NAME = 'chats.db'
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
-CANDIDATE_LABELS = ["вопрос о функционале", "техническая поддержка", "другое"] #"жалоба"
\ No newline at end of file
+CANDIDATE_LABELS = ["вопрос о функционале", "техническая поддержка", "другое"] #"жалоба"
+
+# Способ получения ответа ассистента (поле messages.response_type)
+RESPONSE_TYPE_RAG = "rag"
+RESPONSE_TYPE_FAQ = "faq"
+RESPONSE_TYPE_CACHE = "cache"
+# Вопрос отклонён при перегрузке: ответ из кэша или контакты поддержки
+RESPONSE_TYPE_SHED = "shed"
+# В базе знаний нет ничего близкого к вопросу: контакты поддержки без генерации
+RESPONSE_TYPE_OFF_TOPIC = "off_topic"
+# Ответ прерван сроком запроса: лучший ответ на момент срока или контакты поддержки
+RESPONSE_TYPE_DEADLINE = "deadline"
+
+# Архив удалённых и старых чатов (db/maintenance.py)
+ARCHIVE_DATABASE_NAME = 'chats_archive.db'
+# Чаты без сообщений дольше стольких дней переносятся в архив (None - только удалённые)
+ARCHIVE_RETENTION_DAYS = 180
+# Сколько чатов переносится в одной транзакции, чтобы не блокировать приложение надолго
+ARCHIVE_BATCH_SIZE = 200
+# Сколько свободных страниц освобождает один шаг incremental vacuum
+VACUUM_PAGES_PER_STEP = 1000
@@ -0,0 +1,205 @@
+# Обслуживание chats.db: перенос удалённых и старых чатов в архивную базу и освобождение места
+#  Запуск (можно по расписанию, приложение при этом продолжает работать):
+#   python -m db.maintenance
+#   python -m db.maintenance --retention-days 365 --batch-size 500
+
+import argparse
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from .constants import (DATABASE_NAME, DATE_FORMAT, ARCHIVE_DATABASE_NAME, ARCHIVE_RETENTION_DAYS,
+                        ARCHIVE_BATCH_SIZE, VACUUM_PAGES_PER_STEP)
+from .chat_dao import ChatDAO
+from .message_dao import MessageDAO
+
+# PRAGMA auto_vacuum: 2 - освобождённые страницы возвращаются по PRAGMA incremental_vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+# Сколько ждать блокировку базы, занятой приложением (секунды)
+LOCK_TIMEOUT = 30
+
+
+@dataclass
+class ArchiveReport:
+    """
+    Итоги архивации.
+
+    Attributes:
+        chats (int): Перенесено чатов
+        messages (int): Перенесено сообщений
+        batches (int): Число транзакций переноса
+        freed_pages (int): Страниц возвращено файловой системе
+        seconds (float): Длительность
+    """
+    chats: int = 0
+    messages: int = 0
+    batches: int = 0
+    freed_pages: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (f"чатов: {self.chats}, сообщений: {self.messages}, транзакций: {self.batches}, "
+                f"освобождено страниц: {self.freed_pages}, {self.seconds:.1f} с")
+
+
+class ChatArchiver:
+    """
+    Переносит удалённые (deleted = TRUE) чаты и сообщения, а также чаты без активности
+    дольше retention_days, в архивную базу.
+
+    Перенос идёт пачками по batch_size чатов: каждая пачка копируется в архив
+    и удаляется из рабочей базы в одной транзакции (архив подключается через ATTACH),
+    поэтому данные не теряются и не дублируются при прерывании, а приложение
+    ждёт блокировку не дольше одной пачки. После каждой пачки освободившиеся
+    страницы возвращаются через incremental vacuum.
+
+    Attributes:
+        db_name (str): Рабочая база
+        archive_name (str): Архивная база
+        retention_days (Optional[int]): Срок хранения неактивных чатов; None - переносить только удалённые
+        batch_size (int): Чатов в одной транзакции
+    """
+
+    def __init__(self, db_name: str = DATABASE_NAME, archive_name: str = ARCHIVE_DATABASE_NAME,
+                 retention_days: Optional[int] = ARCHIVE_RETENTION_DAYS,
+                 batch_size: int = ARCHIVE_BATCH_SIZE, vacuum_pages: int = VACUUM_PAGES_PER_STEP):
+        self.db_name = db_name
+        self.archive_name = archive_name
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        # Таблицы рабочей базы со всеми миграциями
+        ChatDAO(db_name)
+        MessageDAO(db_name)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Транзакции управляются явно (BEGIN IMMEDIATE / COMMIT)
+        conn = sqlite3.connect(self.db_name, timeout=LOCK_TIMEOUT, isolation_level=None)
+        conn.execute('ATTACH DATABASE ? AS archive', (self.archive_name,))
+        return conn
+
+    @staticmethod
+    def _columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+        return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})').fetchall()]
+
+    def _init_archive(self, conn: sqlite3.Connection) -> None:
+        """Создаёт таблицы архива и добавляет в них колонки, появившиеся в рабочей базе."""
+        for table in ('chats', 'messages'):
+            conn.execute(f'CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0')
+            archived = set(self._columns(conn, 'archive', table))
+            for column in self._columns(conn, 'main', table):
+                if column not in archived:
+                    conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {column}')
+            if 'archived_at' not in archived:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN archived_at DATETIME')
+        conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_messages_chat_id ON messages (chat_id)')
+
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Включает auto_vacuum = INCREMENTAL в рабочей базе. Для существующей базы это
+        требует однократного полного VACUUM (база блокируется на время перестроения).
+
+        Returns:
+            bool: True, если режим пришлось переключать
+        """
+        with sqlite3.connect(self.db_name, timeout=LOCK_TIMEOUT, isolation_level=None) as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+                return False
+            print("🔧 Включаем incremental vacuum (однократный VACUUM)...")
+            conn.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}')
+            conn.execute('VACUUM')
+            return True
+
+    def _cutoff(self) -> Optional[str]:
+        if self.retention_days is None:
+            return None
+        return (datetime.now() - timedelta(days=self.retention_days)).strftime(DATE_FORMAT)
+
+    def _next_chat_ids(self, conn: sqlite3.Connection, cutoff: Optional[str]) -> List[int]:
+        # Даты хранятся в DATE_FORMAT, поэтому сравниваются как строки
+        rows = conn.execute('''
+            SELECT c.id FROM main.chats c
+            WHERE c.deleted = TRUE
+               OR (? IS NOT NULL AND COALESCE(
+                       (SELECT MAX(m.timestamp) FROM main.messages m WHERE m.chat_id = c.id),
+                       c.created_at) < ?)
+            ORDER BY c.id
+            LIMIT ?''', (cutoff, cutoff, self.batch_size)).fetchall()
+        return [row[0] for row in rows]
+
+    def _move(self, conn: sqlite3.Connection, table: str, where: str, params: tuple, archived_at: str) -> int:
+        columns = ", ".join(self._columns(conn, 'main', table))
+        conn.execute(f'''
+            INSERT INTO archive.{table} ({columns}, archived_at)
+            SELECT {columns}, ? FROM main.{table} WHERE {where}''', (archived_at, *params))
+        return conn.execute(f'DELETE FROM main.{table} WHERE {where}', params).rowcount
+
+    def _archive_batch(self, conn: sqlite3.Connection, cutoff: Optional[str], report: ArchiveReport) -> bool:
+        """Переносит одну пачку; возвращает False, когда переносить больше нечего."""
+        archived_at = datetime.now().strftime(DATE_FORMAT)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            chat_ids = self._next_chat_ids(conn, cutoff)
+            if chat_ids:
+                placeholders = ", ".join("?" * len(chat_ids))
+                report.messages += self._move(conn, 'messages', f'chat_id IN ({placeholders})',
+                                              tuple(chat_ids), archived_at)
+                report.chats += self._move(conn, 'chats', f'id IN ({placeholders})', tuple(chat_ids), archived_at)
+            else:
+                # Удалённые сообщения в активных чатах
+                moved = self._move(conn, 'messages',
+                                   'id IN (SELECT id FROM main.messages WHERE deleted = TRUE LIMIT ?)',
+                                   (self.batch_size,), archived_at)
+                report.messages += moved
+                if not moved:
+                    conn.execute('ROLLBACK')
+                    return False
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        report.batches += 1
+        return True
+
+    def _incremental_vacuum(self, conn: sqlite3.Connection) -> int:
+        before = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA main.incremental_vacuum({self.vacuum_pages})').fetchall()
+        return before - conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+
+    def run(self) -> ArchiveReport:
+        """
+        Переносит все подходящие чаты и сообщения в архив.
+
+        Returns:
+            ArchiveReport: Итоги архивации
+        """
+        start = time.perf_counter()
+        report = ArchiveReport()
+        self.enable_incremental_vacuum()
+        cutoff = self._cutoff()
+        conn = self._connect()
+        try:
+            self._init_archive(conn)
+            while self._archive_batch(conn, cutoff, report):
+                report.freed_pages += self._incremental_vacuum(conn)
+            # Остаток свободных страниц
+            while freed := self._incremental_vacuum(conn):
+                report.freed_pages += freed
+        finally:
+            conn.close()
+        report.seconds = time.perf_counter() - start
+        print("🗄 Архивация:", report.summary())
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перенос удалённых и старых чатов в архивную базу")
+    parser.add_argument("--db", default=DATABASE_NAME)
+    parser.add_argument("--archive", default=ARCHIVE_DATABASE_NAME)
+    parser.add_argument("--retention-days", type=int, default=ARCHIVE_RETENTION_DAYS,
+                        help="Срок хранения неактивных чатов; 0 - переносить только удалённые")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    ChatArchiver(args.db, args.archive, args.retention_days or None, args.batch_size).run()
@@ -22,10 +22,19 @@ class MessageDAO(BaseDAO):
                 rating INTEGER DEFAULT NULL,
                 label_id INTEGER DEFAULT NULL,
                 deleted BOOL DEFAULT FALSE,
+                response_type TEXT DEFAULT NULL,
                 FOREIGN KEY(chat_id) REFERENCES chats(id),
                 FOREIGN KEY(label_id) REFERENCES labels(id)
             )
         ''')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages (chat_id)')
+        self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        """Добавляет колонки, появившиеся после создания таблицы в существующих базах"""
+        columns = {row[1] for row in self._execute('PRAGMA table_info(messages)').fetchall()}
+        if 'response_type' not in columns:
+            self._execute('ALTER TABLE messages ADD COLUMN response_type TEXT DEFAULT NULL')
 
     def get_message(self, message_id: int) -> Tuple:
         cursor = self._execute('''
@@ -49,12 +58,13 @@ class MessageDAO(BaseDAO):
                     role: str,
                     content: str,
                     label_id: Optional[int] = None,
-                    sources: Optional[str] = None) -> int:
+                    sources: Optional[str] = None,
+                    response_type: Optional[str] = None) -> int:
         cursor = self._execute(
             '''INSERT INTO messages 
-               (chat_id, role, content, sources, rating, label_id, timestamp)
-               VALUES (?, ?, ?, ?, NULL, ?, ?)''',
-            (chat_id, role, content, sources, label_id, datetime.now().strftime(DATE_FORMAT)))
+               (chat_id, role, content, sources, rating, label_id, timestamp, response_type)
+               VALUES (?, ?, ?, ?, NULL, ?, ?, ?)''',
+            (chat_id, role, content, sources, label_id, datetime.now().strftime(DATE_FORMAT), response_type))
         return cursor.lastrowid
 
     def update_field(self, message_id: int, field: str, value: str | int) -> None:
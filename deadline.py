@@ -0,0 +1,66 @@
+# Срок ответа на вопрос: общий срок запроса делится на бюджеты этапов (вызовов LLM),
+#  новый раунд генерации не начинается, если по оценке не успеет до срока
+
+import threading
+import time
+from typing import Dict, Optional
+
+from config import REQUEST_DEADLINE_SECONDS, DEADLINE_STAGE_BUDGETS, DEADLINE_INITIAL_ROUND_SECONDS
+
+# Вес нового замера в скользящей средней длительности раунда
+ROUND_TIME_ALPHA = 0.2
+
+
+class Deadline:
+    """
+    Срок ответа на один вопрос.
+
+    Attributes:
+        seconds (Optional[float]): Длительность срока (None - без ограничения)
+        stage_budgets (Dict[str, float]): Доля срока, которую может занять один вызов на этапе
+    """
+
+    def __init__(self, seconds: Optional[float] = REQUEST_DEADLINE_SECONDS,
+                 stage_budgets: Dict[str, float] = DEADLINE_STAGE_BUDGETS):
+        self.seconds = seconds
+        self.stage_budgets = stage_budgets
+        self._expires_at = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self) -> float:
+        """Оставшееся время, секунды (бесконечность без ограничения)."""
+        if self._expires_at is None:
+            return float("inf")
+        return max(self._expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def fits(self, seconds: float) -> bool:
+        """Успеет ли до срока работа длительностью seconds."""
+        return seconds <= self.remaining()
+
+    def stage_budget(self, stage: str) -> Optional[float]:
+        """
+        Ограничение времени одного вызова на этапе: доля срока этапа, но не больше остатка.
+
+        Returns:
+            Optional[float]: Секунды или None без ограничения
+        """
+        if self.seconds is None:
+            return None
+        share = self.stage_budgets.get(stage)
+        if share is None:
+            return self.remaining()
+        return min(self.seconds * share, self.remaining())
+
+
+class RoundTimeEstimate:
+    """Скользящее среднее длительности раунда генерации, общее для всех запросов."""
+
+    def __init__(self, initial: float = DEADLINE_INITIAL_ROUND_SECONDS):
+        self.seconds = initial
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.seconds += ROUND_TIME_ALPHA * (seconds - self.seconds)
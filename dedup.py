@@ -0,0 +1,275 @@
+# Поиск и удаление почти-дубликатов документов и чанков при индексации (MinHash + LSH)
+
+import json
+import re
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (MINHASH_NUM_PERM, MINHASH_SHINGLE_SIZE, LSH_BANDS,
+                    DEDUP_FILE_THRESHOLD, DEDUP_CHUNK_THRESHOLD)
+
+# Метаданные, в которых хранятся источники удалённых дубликатов (JSON-список [источник, страница])
+DUPLICATE_SOURCES_KEY = "duplicate_sources"
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _shingles(text: str, size: int) -> List[str]:
+    """Разбивает нормализованный текст на словесные n-граммы."""
+    words = re.sub(r"[^\w\s]", " ", text.lower()).split()
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+class MinHasher:
+    """
+    Вычисляет MinHash-сигнатуры текстов.
+
+    Attributes:
+        num_perm (int): Число хэш-функций (длина сигнатуры)
+        shingle_size (int): Длина словесной n-граммы
+    """
+
+    def __init__(self, num_perm: int = MINHASH_NUM_PERM,
+                 shingle_size: int = MINHASH_SHINGLE_SIZE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # a < 2^29 и x < 2^32, поэтому a * x + b не переполняет uint64
+        self._a = rng.randint(1, 1 << 29, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Возвращает MinHash-сигнатуру текста.
+
+        Args:
+            text: Исходный текст
+
+        Returns:
+            np.ndarray: Массив uint64 длины num_perm
+        """
+        shingles = _shingles(text, self.shingle_size)
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in set(shingles)], dtype=np.uint64)
+        # (a * x + b) mod p для всех пар (шингл, хэш-функция)
+        permuted = (np.outer(hashes, self._a) + self._b) % np.uint64(_MERSENNE_PRIME)
+        return (permuted & np.uint64(_MAX_HASH)).min(axis=0)
+
+    @staticmethod
+    def similarity(left: np.ndarray, right: np.ndarray) -> float:
+        """Оценка коэффициента Жаккара по двум сигнатурам."""
+        return float(np.mean(left == right))
+
+
+class LSHIndex:
+    """
+    LSH-индекс по полосам MinHash-сигнатур для поиска кандидатов в дубликаты.
+
+    Attributes:
+        bands (int): Число полос; длина сигнатуры должна делиться на него
+    """
+
+    def __init__(self, bands: int = LSH_BANDS):
+        self.bands = bands
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(band, rows.tobytes()) for band, rows in enumerate(np.array_split(signature, self.bands))]
+
+    def query(self, signature: np.ndarray) -> List[int]:
+        """
+        Возвращает ключи, совпавшие с сигнатурой хотя бы по одной полосе.
+
+        Args:
+            signature: MinHash-сигнатура
+
+        Returns:
+            List[int]: Ключи кандидатов в порядке возрастания
+        """
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+        return sorted(candidates)
+
+    def insert(self, key: int, signature: np.ndarray) -> None:
+        """Добавляет сигнатуру в индекс."""
+        for band_key in self._band_keys(signature):
+            self._buckets[band_key].append(key)
+
+
+@dataclass
+class DedupReport:
+    """
+    Отчёт об удалённых дубликатах.
+
+    Attributes:
+        duplicate_files (List[Dict]): Пары файлов {"kept", "removed", "similarity"}
+        documents_before (int): Число документов (страниц/статей) до удаления файлов-дубликатов
+        documents_after (int): Число документов после удаления
+        chunks_before (int): Число чанков до удаления дубликатов
+        chunks_after (int): Число чанков после удаления
+        duplicate_chunks (List[Dict]): Удалённые чанки {"kept", "removed", "similarity"}
+    """
+    duplicate_files: List[Dict] = field(default_factory=list)
+    documents_before: int = 0
+    documents_after: int = 0
+    chunks_before: int = 0
+    chunks_after: int = 0
+    duplicate_chunks: List[Dict] = field(default_factory=list)
+
+    def summary(self) -> str:
+        """Краткое текстовое описание отчёта."""
+        return (f"файлов-дубликатов: {len(self.duplicate_files)}, "
+                f"документов: {self.documents_before} -> {self.documents_after}, "
+                f"чанков: {self.chunks_before} -> {self.chunks_after}")
+
+    def save(self, path: str) -> None:
+        """Сохраняет отчёт в JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=2)
+
+
+def _location(doc) -> List:
+    return [doc.metadata.get("source"), doc.metadata.get("page")]
+
+
+def add_duplicate_source(doc, source: str, page=None) -> None:
+    """Добавляет источник дубликата в метаданные сохранённого документа."""
+    entries = get_duplicate_sources(doc)
+    if [source, page] not in entries and [source, page] != _location(doc):
+        entries.append([source, page])
+    doc.metadata[DUPLICATE_SOURCES_KEY] = json.dumps(entries, ensure_ascii=False)
+
+
+def get_duplicate_sources(doc) -> List[List]:
+    """Возвращает список [источник, страница] удалённых дубликатов документа."""
+    raw = doc.metadata.get(DUPLICATE_SOURCES_KEY)
+    return json.loads(raw) if raw else []
+
+
+class NearDuplicateDetector:
+    """
+    Удаляет почти-дубликаты на уровне файлов и чанков, сохраняя имена
+    всех источников в метаданных оставленного документа.
+
+    Attributes:
+        hasher (MinHasher): Вычислитель сигнатур
+        file_threshold (float): Порог сходства файлов
+        chunk_threshold (float): Порог сходства чанков
+        bands (int): Число полос LSH
+        report (DedupReport): Отчёт о последнем запуске
+    """
+
+    def __init__(
+        self,
+        hasher: Optional[MinHasher] = None,
+        file_threshold: float = DEDUP_FILE_THRESHOLD,
+        chunk_threshold: float = DEDUP_CHUNK_THRESHOLD,
+        bands: int = LSH_BANDS
+    ):
+        self.hasher = hasher or MinHasher()
+        self.file_threshold = file_threshold
+        self.chunk_threshold = chunk_threshold
+        self.bands = bands
+        self.report = DedupReport()
+
+    def dedup_files(self, documents: List) -> List:
+        """
+        Удаляет документы файлов, почти полностью совпадающих с ранее встреченным файлом.
+
+        Args:
+            documents: Документы (страницы), у которых metadata["source"] - имя файла
+
+        Returns:
+            List: Документы без файлов-дубликатов
+        """
+        by_source: Dict[str, List] = defaultdict(list)
+        for doc in documents:
+            by_source[doc.metadata.get("source")].append(doc)
+
+        sources = list(by_source)
+        signatures = [self.hasher.signature("\n".join(d.page_content for d in by_source[s]))
+                      for s in sources]
+        lsh = LSHIndex(self.bands)
+        removed = set()
+        for i, source in enumerate(sources):
+            for j in lsh.query(signatures[i]):
+                similarity = self.hasher.similarity(signatures[i], signatures[j])
+                if similarity >= self.file_threshold:
+                    self._merge_files(by_source[sources[j]], by_source[source])
+                    self.report.duplicate_files.append(
+                        {"kept": sources[j], "removed": source, "similarity": similarity})
+                    removed.add(i)
+                    break
+            else:
+                lsh.insert(i, signatures[i])
+
+        result = [doc for i, s in enumerate(sources) if i not in removed for doc in by_source[s]]
+        self.report.documents_before = len(documents)
+        self.report.documents_after = len(result)
+        return result
+
+    @staticmethod
+    def _merge_files(kept: List, removed: List) -> None:
+        """Переносит имя удалённого файла в метаданные страниц оставленного."""
+        aligned = len(kept) == len(removed)
+        for i, doc in enumerate(kept):
+            page = removed[i].metadata.get("page") if aligned else None
+            add_duplicate_source(doc, removed[0].metadata.get("source"), page)
+            if aligned:
+                for source, dup_page in get_duplicate_sources(removed[i]):
+                    add_duplicate_source(doc, source, dup_page)
+
+    def dedup_chunks(self, chunks: List) -> List:
+        """
+        Удаляет почти-дубликаты среди чанков.
+
+        Args:
+            chunks: Чанки после разбиения документов
+
+        Returns:
+            List: Чанки без дубликатов; у оставленных заполнен DUPLICATE_SOURCES_KEY
+        """
+        lsh = LSHIndex(self.bands)
+        exact: Dict[str, int] = {}
+        kept: Dict[int, np.ndarray] = {}
+        result_index: Dict[int, int] = {}
+        result = []
+        for i, chunk in enumerate(chunks):
+            normalized = " ".join(chunk.page_content.split())
+            target = exact.get(normalized)
+            similarity = 1.0
+            if target is None:
+                signature = self.hasher.signature(normalized)
+                for j in lsh.query(signature):
+                    similarity = self.hasher.similarity(signature, kept[j])
+                    if similarity >= self.chunk_threshold:
+                        target = j
+                        break
+                if target is None:
+                    kept[i] = signature
+                    lsh.insert(i, signature)
+            if target is None:
+                exact[normalized] = i
+                result_index[i] = len(result)
+                result.append(chunk)
+                continue
+
+            original = result[result_index[target]]
+            add_duplicate_source(original, *_location(chunk))
+            for source, page in get_duplicate_sources(chunk):
+                add_duplicate_source(original, source, page)
+            self.report.duplicate_chunks.append(
+                {"kept": _location(original), "removed": _location(chunk), "similarity": similarity})
+
+        self.report.chunks_before = len(chunks)
+        self.report.chunks_after = len(result)
+        return result
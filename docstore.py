@@ -0,0 +1,249 @@
+# Компактное хранилище фрагментов индекса только для чтения: тексты сжаты zstd поблочно
+#  и читаются через mmap, метаданные хранятся в массивах numpy со словарями строк.
+#  Строится при создании снимка индекса; поиск получает из Chroma только ID фрагментов.
+#  Рядом хранятся токены фрагментов для токенизаторов генерирующих моделей (по версии токенизатора).
+
+import json
+import mmap
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import DOCSTORE_BLOCK_CHUNKS, DOCSTORE_ZSTD_LEVEL, DOCSTORE_BLOCK_CACHE_SIZE
+from context_packer import TOKENS_KEY, ChunkTokens, chunk_prompt_text, tokenize_chunk
+
+DOCSTORE_DIRNAME = "docstore"
+TEXTS_FILENAME = "texts.zst"
+BLOCK_OFFSETS_FILENAME = "block_offsets.npy"
+CHUNK_SPANS_FILENAME = "chunk_spans.npy"
+METADATA_FILENAME = "metadata.npy"
+STRINGS_FILENAME = "strings.json"
+TOKENS_DIRNAME = "tokens"
+TOKENS_MANIFEST_FILENAME = "tokens.json"
+TOKEN_IDS_FILENAME = "ids.npy"
+TOKEN_STARTS_FILENAME = "starts.npy"
+TOKEN_OFFSETS_FILENAME = "offsets.npy"
+
+# Метаданные, хранящиеся отдельными колонками; остальные ключи - общей строкой JSON
+SOURCE_KEY, PAGE_KEY, DOC_TYPE_KEY = "source", "page", "doc_type"
+NO_PAGE = -1
+
+
+def build_tokens(docs: Sequence, directory: str, key: str, tokenizer) -> None:
+    """
+    Токенизирует фрагменты и сохраняет токены в хранилище под версией токенизатора.
+
+    Токенизируется текст фрагмента в том виде, в котором он попадает в промпт (chunk_prompt_text
+    после заголовка, см. context_packer.tokenize_chunk); фрагменты, которые так токенизировать
+    нельзя, сохраняются без токенов и при ответе токенизируются заново.
+    Токены всех фрагментов хранятся одним массивом, offsets[i]:offsets[i + 1] - токены фрагмента i,
+    starts - смещения начала токенов в тексте фрагмента (нужны для склейки перекрывающихся фрагментов).
+
+    Args:
+        docs: Фрагменты в порядке ID
+        directory: Каталог хранилища
+        key: Версия токенизатора (context_packer.tokenizer_key)
+        tokenizer: Токенизатор генерирующей модели
+    """
+    ids, starts, offsets = [], [], [0]
+    for doc in docs:
+        chunk_tokens = tokenize_chunk(tokenizer, chunk_prompt_text(doc.page_content))
+        if chunk_tokens is not None:
+            ids.extend(chunk_tokens.ids)
+            starts.extend(chunk_tokens.starts)
+        offsets.append(len(ids))
+
+    manifest_path = os.path.join(directory, TOKENS_MANIFEST_FILENAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    dirname = manifest.get(key) or str(len(manifest))
+    tokens_dir = os.path.join(directory, TOKENS_DIRNAME, dirname)
+    os.makedirs(tokens_dir, exist_ok=True)
+    np.save(os.path.join(tokens_dir, TOKEN_IDS_FILENAME), np.asarray(ids, dtype=np.uint32))
+    np.save(os.path.join(tokens_dir, TOKEN_STARTS_FILENAME), np.asarray(starts, dtype=np.uint32))
+    np.save(os.path.join(tokens_dir, TOKEN_OFFSETS_FILENAME), np.asarray(offsets, dtype=np.uint64))
+    manifest[key] = dirname
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    print(f"🔤 Токены фрагментов ({key}): {len(ids)} на {len(docs)} фрагм.")
+
+
+def build_docstore(docs: Sequence, directory: str, block_chunks: int = DOCSTORE_BLOCK_CHUNKS,
+                   level: int = DOCSTORE_ZSTD_LEVEL, tokenizers: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Записывает фрагменты в хранилище. ID фрагмента - его номер в docs.
+
+    Args:
+        docs: Фрагменты (page_content, metadata)
+        directory: Каталог хранилища
+        block_chunks: Число фрагментов в одном сжатом блоке
+        level: Уровень сжатия zstd
+        tokenizers: Токенизаторы генерирующих моделей по версии (см. build_tokens)
+    """
+    import zstandard
+
+    os.makedirs(directory, exist_ok=True)
+    compressor = zstandard.ZstdCompressor(level=level)
+    strings: Dict[str, Dict[str, int]] = {SOURCE_KEY: {}, DOC_TYPE_KEY: {}, "extra": {}}
+
+    def intern(table: str, value: str) -> int:
+        return strings[table].setdefault(value, len(strings[table]))
+
+    block_offsets = [0]
+    # (блок, начало, конец) текста фрагмента в распакованном блоке, в байтах UTF-8
+    chunk_spans = np.zeros((len(docs), 3), dtype=np.uint32)
+    # (источник, страница, тип источника, прочие метаданные)
+    metadata = np.zeros((len(docs), 4), dtype=np.int32)
+    with open(os.path.join(directory, TEXTS_FILENAME), "wb") as f:
+        for block, start in enumerate(range(0, len(docs), block_chunks)):
+            parts, position = [], 0
+            for chunk_id in range(start, min(start + block_chunks, len(docs))):
+                doc = docs[chunk_id]
+                text = doc.page_content.encode("utf-8")
+                chunk_spans[chunk_id] = (block, position, position + len(text))
+                parts.append(text)
+                position += len(text)
+
+                meta = dict(doc.metadata or {})
+                page = meta.pop(PAGE_KEY, None)
+                metadata[chunk_id] = (
+                    intern(SOURCE_KEY, str(meta.pop(SOURCE_KEY, ""))),
+                    page if isinstance(page, int) else NO_PAGE,
+                    intern(DOC_TYPE_KEY, str(meta.pop(DOC_TYPE_KEY, ""))),
+                    intern("extra", json.dumps(meta, ensure_ascii=False, sort_keys=True)),
+                )
+            compressed = compressor.compress(b"".join(parts))
+            f.write(compressed)
+            block_offsets.append(block_offsets[-1] + len(compressed))
+
+    np.save(os.path.join(directory, BLOCK_OFFSETS_FILENAME), np.asarray(block_offsets, dtype=np.uint64))
+    np.save(os.path.join(directory, CHUNK_SPANS_FILENAME), chunk_spans)
+    np.save(os.path.join(directory, METADATA_FILENAME), metadata)
+    with open(os.path.join(directory, STRINGS_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({table: list(values) for table, values in strings.items()}, f, ensure_ascii=False)
+    for key, tokenizer in (tokenizers or {}).items():
+        build_tokens(docs, directory, key, tokenizer)
+
+
+class DocStore:
+    """
+    Хранилище фрагментов, открытое только для чтения.
+
+    Сжатые тексты и массивы отображаются в память (mmap), поэтому несколько процессов
+    приложения используют одни и те же страницы кэша ОС, а получение k фрагментов -
+    это чтение и распаковка нескольких блоков без обращений к SQLite.
+
+    Attributes:
+        directory (str): Каталог хранилища
+        tokenizers (List[str]): Версии токенизаторов, для которых сохранены токены фрагментов
+    """
+
+    def __init__(self, directory: str, block_cache_size: int = DOCSTORE_BLOCK_CACHE_SIZE, document_cls=None):
+        """
+        Args:
+            directory: Каталог хранилища
+            block_cache_size: Сколько распакованных блоков держать в памяти
+            document_cls: Класс возвращаемых документов (по умолчанию generate_answer.Document)
+        """
+        import zstandard
+
+        if document_cls is None:
+            from generate_answer import Document as document_cls
+        self.directory = directory
+        self.document_cls = document_cls
+        self._zstandard = zstandard
+        # Распаковщик zstd не потокобезопасен - у каждого потока свой
+        self._local = threading.local()
+
+        with open(os.path.join(directory, TEXTS_FILENAME), "rb") as f:
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        self._block_offsets = np.load(os.path.join(directory, BLOCK_OFFSETS_FILENAME), mmap_mode="r")
+        self._chunk_spans = np.load(os.path.join(directory, CHUNK_SPANS_FILENAME), mmap_mode="r")
+        self._metadata = np.load(os.path.join(directory, METADATA_FILENAME), mmap_mode="r")
+        with open(os.path.join(directory, STRINGS_FILENAME), encoding="utf-8") as f:
+            strings = json.load(f)
+        self._sources: List[str] = strings[SOURCE_KEY]
+        self._doc_types: List[str] = strings[DOC_TYPE_KEY]
+        self._extras: List[Dict[str, Any]] = [json.loads(extra) for extra in strings["extra"]]
+        self._block = lru_cache(maxsize=block_cache_size)(self._read_block)
+
+        # Токены фрагментов: {версия токенизатора: (ids, starts, offsets)}
+        self._tokens: Dict[str, tuple] = {}
+        manifest_path = os.path.join(directory, TOKENS_MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                for key, dirname in json.load(f).items():
+                    tokens_dir = os.path.join(directory, TOKENS_DIRNAME, dirname)
+                    self._tokens[key] = tuple(
+                        np.load(os.path.join(tokens_dir, filename), mmap_mode="r")
+                        for filename in (TOKEN_IDS_FILENAME, TOKEN_STARTS_FILENAME, TOKEN_OFFSETS_FILENAME))
+        self.tokenizers = list(self._tokens)
+
+    @classmethod
+    def open(cls, snapshot_dir: str, **kwargs) -> Optional["DocStore"]:
+        """Открывает хранилище снимка индекса или возвращает None, если снимок построен без него."""
+        directory = os.path.join(snapshot_dir, DOCSTORE_DIRNAME)
+        if not os.path.exists(os.path.join(directory, STRINGS_FILENAME)):
+            return None
+        return cls(directory, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self._chunk_spans)
+
+    def _read_block(self, block: int) -> bytes:
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = self._zstandard.ZstdDecompressor()
+        start, end = int(self._block_offsets[block]), int(self._block_offsets[block + 1])
+        return decompressor.decompress(self._blob[start:end])
+
+    def text(self, chunk_id: int) -> str:
+        """Текст фрагмента."""
+        block, start, end = (int(value) for value in self._chunk_spans[chunk_id])
+        return self._block(block)[start:end].decode("utf-8")
+
+    def metadata(self, chunk_id: int) -> Dict[str, Any]:
+        """Метаданные фрагмента в исходном виде."""
+        source, page, doc_type, extra = (int(value) for value in self._metadata[chunk_id])
+        metadata = dict(self._extras[extra])
+        if self._sources[source]:
+            metadata[SOURCE_KEY] = self._sources[source]
+        if page != NO_PAGE:
+            metadata[PAGE_KEY] = page
+        if self._doc_types[doc_type]:
+            metadata[DOC_TYPE_KEY] = self._doc_types[doc_type]
+        return metadata
+
+    def tokens(self, chunk_id: int) -> Dict[str, ChunkTokens]:
+        """Токены фрагмента по версиям токенизаторов (без версий, для которых токенов нет)."""
+        tokens = {}
+        for key, (ids, starts, offsets) in self._tokens.items():
+            start, end = int(offsets[chunk_id]), int(offsets[chunk_id + 1])
+            if end > start:
+                tokens[key] = ChunkTokens(ids[start:end].tolist(), starts[start:end].tolist())
+        return tokens
+
+    def document_metadata(self, chunk_id: int) -> Dict[str, Any]:
+        """Метаданные фрагмента для документа: исходные и токены под ключом TOKENS_KEY."""
+        metadata = self.metadata(chunk_id)
+        if self._tokens:
+            metadata[TOKENS_KEY] = self.tokens(chunk_id)
+        return metadata
+
+    def get(self, chunk_ids: Sequence[int]) -> List:
+        """
+        Возвращает документы по ID фрагментов в том же порядке.
+
+        Args:
+            chunk_ids: ID фрагментов
+
+        Returns:
+            List: Документы (document_cls) с page_content и metadata (с токенами фрагментов)
+        """
+        return [self.document_cls(page_content=self.text(chunk_id), metadata=self.document_metadata(chunk_id))
+                for chunk_id in chunk_ids]
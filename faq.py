@@ -0,0 +1,88 @@
+# Быстрый ответ статьёй портала без вызова LLM, если вопрос совпадает с заголовком статьи
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from config import ARTICLES_PATH, EMBEDDING_MODEL_NAME, FAQ_MATCH_THRESHOLD
+from file_cache import file_sha256, cache_path
+from knowledge_base import load_articles_frame, ARTICLE_SOURCE_PREFIX
+
+
+@dataclass
+class FAQMatch:
+    """
+    Найденная статья для быстрого ответа.
+
+    Attributes:
+        article_id (str): Стабильный идентификатор статьи
+        topic (str): Заголовок статьи
+        content (str): Текст статьи ("Описание")
+        score (float): Косинусная близость вопроса и заголовка
+    """
+    article_id: str
+    topic: str
+    content: str
+    score: float
+
+    @property
+    def source(self) -> str:
+        """Источник в том же формате, что и у статей в векторном индексе."""
+        return f"{ARTICLE_SOURCE_PREFIX}{self.topic}"
+
+
+class FAQIndex:
+    """
+    Индекс эмбеддингов заголовков статей из arcticles.xls.
+
+    Матрица эмбеддингов кэшируется на диске по хэшу файла статей и имени модели,
+    поэтому при повторном запуске заголовки не векторизуются заново.
+
+    Attributes:
+        embeddings: Модель эмбеддингов с интерфейсом langchain Embeddings
+        threshold (float): Минимальная косинусная близость для быстрого ответа
+    """
+
+    def __init__(self, embeddings, articles_path: str = ARTICLES_PATH,
+                 threshold: float = FAQ_MATCH_THRESHOLD, model_name: str = EMBEDDING_MODEL_NAME):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.articles = load_articles_frame(articles_path)
+        self._matrix = self._load_matrix(articles_path, model_name)
+
+    def _load_matrix(self, articles_path: str, model_name: str) -> np.ndarray:
+        """Загружает нормированные эмбеддинги заголовков из кэша или вычисляет их."""
+        model_key = model_name.replace("/", "__")
+        path = cache_path("faq", f"{file_sha256(articles_path)}_{model_key}.npy")
+        if os.path.exists(path):
+            return np.load(path)
+
+        matrix = np.asarray(self.embeddings.embed_documents(self.articles["topic"].tolist()), dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, path)
+        return matrix
+
+    def match(self, query: str) -> Optional[FAQMatch]:
+        """
+        Ищет статью, заголовок которой совпадает с вопросом.
+
+        Args:
+            query: Вопрос пользователя
+
+        Returns:
+            Optional[FAQMatch]: Статья, если близость не ниже порога, иначе None
+        """
+        if not len(self._matrix):
+            return None
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        vector /= max(np.linalg.norm(vector), 1e-12)
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        row = self.articles.iloc[best]
+        return FAQMatch(row["article_id"], row["topic"], row["content"], float(scores[best]))
@@ -0,0 +1,31 @@
+# Вспомогательные функции для дисковых кэшей, привязанных к содержимому файлов
+
+import hashlib
+import os
+
+from config import CACHE_DIR
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Вычисляет SHA-256 содержимого файла.
+
+    Args:
+        path: Путь к файлу
+        block_size: Размер блока чтения в байтах
+
+    Returns:
+        str: Хэш в шестнадцатеричном виде
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(*parts: str) -> str:
+    """Возвращает путь внутри CACHE_DIR, создавая недостающие каталоги."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -1,7 +1,10 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional
 from dataclasses import dataclass
-from config import LLM_MODEL_NAME, MAX_NEW_TOKENS, TEMPERATURE
+from config import (LLM_MODEL_NAME, MAX_NEW_TOKENS, TEMPERATURE, CONTEXT_TOKEN_BUDGET,
+                    MODEL_CONTEXT_WINDOW, CONTEXT_SAFETY_MARGIN, GENERATION_BACKEND, GENERATION_BATCH_SIZE)
+from generation_backends import GenerationBackend, create_backend
+from context_packer import ContextPacker, ContextOverflowError, TOKENS_KEY, tokenizer_key, tokenize_chunk
+from dedup import get_duplicate_sources
 
 
 @dataclass
@@ -19,7 +22,11 @@ class AnswerGenerator:
         model_name (str): Название модели HuggingFace
         max_new_tokens (int): Максимальное количество новых токенов
         temperature (float): Температура генерации
-        generator: Паплайн для генерации текста
+        context_token_budget (int): Бюджет токенов на документы в промпте
+        backend (GenerationBackend): Среда выполнения языковой модели
+        context_window (int): Размер контекстного окна модели в токенах
+        context_packer (ContextPacker): Упаковщик документов в контекст
+        generation_batch_size (int): Число промптов в одном проходе модели при пакетной генерации
     """
     
     def __init__(
@@ -28,7 +35,12 @@ class AnswerGenerator:
         max_new_tokens: int = MAX_NEW_TOKENS,
         temperature: float = TEMPERATURE,
         device_map: str = "auto",
-        load_in_8bit: bool = True
+        load_in_8bit: bool = True,
+        context_token_budget: int = CONTEXT_TOKEN_BUDGET,
+        context_window: int = MODEL_CONTEXT_WINDOW,
+        backend: Optional[GenerationBackend] = None,
+        backend_name: str = GENERATION_BACKEND,
+        generation_batch_size: int = GENERATION_BATCH_SIZE
     ):
         """
         Инициализирует генератор ответов.
@@ -39,46 +51,74 @@ class AnswerGenerator:
             temperature: Температура для креативности ответов
             device_map: Стратегия распределения по устройствам
             load_in_8bit: Использовать 8-битную квантизацию
+            context_token_budget: Бюджет токенов на документы в промпте
+            context_window: Окно контекста модели; None - взять из конфигурации модели
+            backend: Готовая среда выполнения модели (если не задана, создаётся по backend_name)
+            backend_name: Среда выполнения: "hf", "llama_cpp" или "stub"
+            generation_batch_size: Число промптов в одном проходе модели при пакетной генерации
         """
         self.model_name = model_name
         self.max_new_tokens = max_new_tokens
         self.temperature = temperature
         self.device_map = device_map
         self.load_in_8bit = load_in_8bit
-        self.generator = self._init_generator()
-    
-    def _init_generator(self):
-        """Инициализирует паплайн для генерации текста."""
-        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
-            device_map=self.device_map,
-            load_in_8bit=self.load_in_8bit
-        )
-        return pipeline(
-            "text-generation",
-            model=model,
-            tokenizer=tokenizer,
-            max_new_tokens=self.max_new_tokens,
-            temperature=self.temperature
+        self.context_token_budget = context_token_budget
+        self.generation_batch_size = generation_batch_size
+        self.backend = backend or create_backend(backend_name, model_name, device_map, load_in_8bit)
+        self.context_window = context_window or self.backend.context_window
+        # Токены документов, сохранённые при индексации, используются, если совпадает версия токенизатора
+        tokenizer_name = self.backend.tokenizer_name
+        self.context_packer = ContextPacker(
+            self.backend.tokenizer, context_token_budget,
+            tokenizer_name=tokenizer_key(tokenizer_name, self.backend.tokenizer) if tokenizer_name else None
         )
-    
-    def format_context(self, docs: List[Document]) -> str:
+        if self.context_packer.tokenizer_name is not None and not self._prompt_ids_match_text():
+            print(f"⚠️ Токены промпта из токенов фрагментов не совпадают с токенизацией текста "
+                  f"({tokenizer_name}), промпт будет токенизироваться целиком")
+            self.context_packer.tokenizer_name = None
+
+    def count_tokens(self, text: str) -> int:
+        """Возвращает длину текста в токенах модели."""
+        return self.context_packer.count_tokens(text)
+
+    def context_budget(self, user_query: str) -> int:
+        """
+        Вычисляет, сколько токенов можно отдать под документы, чтобы промпт
+        вместе с ответом поместился в окно модели.
+        
+        Args:
+            user_query: Запрос пользователя
+            
+        Returns:
+            int: Бюджет токенов на контекст
+            
+        Raises:
+            ContextOverflowError: Если даже промпт без документов не помещается в окно
+        """
+        prompt_tokens = self.count_tokens(self.generate_prompt(user_query, ""))
+        available = self.context_window - self.max_new_tokens - prompt_tokens - CONTEXT_SAFETY_MARGIN
+        if available < 0:
+            raise ContextOverflowError(
+                f"Промпт ({prompt_tokens} токенов) не помещается в окно модели "
+                f"({self.context_window} токенов, из них {self.max_new_tokens} на ответ)"
+            )
+        return min(self.context_token_budget, available)
+
+    def format_context(self, docs: List[Document], token_budget: int = None) -> str:
         """
         Форматирует контекст из документов для включения в промпт.
         
+        Перекрывающиеся чанки одного источника склеиваются, фрагменты
+        добавляются по убыванию релевантности в пределах бюджета токенов.
+        
         Args:
-            docs: Список документов
+            docs: Список документов в порядке убывания релевантности
+            token_budget: Бюджет токенов (по умолчанию context_token_budget)
             
         Returns:
             str: Отформатированный контекст
         """
-        context_parts = []
-        for i, doc in enumerate(docs, start=1):
-            source = doc.metadata.get("source", f"Документ_{i}")
-            excerpt = doc.page_content[:300].replace("\n", " ")
-            context_parts.append(f"Документ {i} ({source}): {excerpt}...")
-        return "\n\n".join(context_parts)
+        return self.context_packer.format(docs, token_budget)
     
     def generate_prompt(self, user_query: str, context: str) -> str:
         """
@@ -91,16 +131,79 @@ class AnswerGenerator:
         Returns:
             str: Полный промпт для модели
         """
-        return (
+        prefix, suffix = self.generate_prompt_parts(user_query)
+        return prefix + context + suffix
+
+    def generate_prompt_parts(self, user_query: str) -> Tuple[str, str]:
+        """
+        Части промпта до и после контекста из документов.
+
+        Args:
+            user_query: Запрос пользователя
+
+        Returns:
+            Tuple[str, str]: Текст до контекста и после него
+        """
+        prefix = (
             "Ты — интеллектуальный помощник для пользователей портала поставщиков. "
             "Используя информацию из нижеприведённых документов, дай подробный и точный ответ на вопрос. "
             # "Если информации недостаточно, сообщи об этом и предложи обратиться в службу поддержки, указав контакты.
             
             "Документы:\n"
-            f"{context}\n\n"
+        )
+        suffix = (
+            "\n\n"
             f"Вопрос: {user_query}\n\n"
             "Ответ:"
         )
+        return prefix, suffix
+
+    def generate_prompt_ids(self, user_query: str, docs: List[Document]) -> Optional[List[int]]:
+        """
+        Собирает токены промпта из токенов документов, сохранённых при индексации:
+        токенизируются только шаблон промпта, вопрос и заголовки фрагментов.
+
+        Args:
+            user_query: Запрос пользователя
+            docs: Список документов в порядке убывания релевантности
+
+        Returns:
+            Optional[List[int]]: Токены промпта или None, если у документов нет токенов этой модели
+
+        Raises:
+            ContextOverflowError: Если запрос не помещается в окно модели
+        """
+        prefix, suffix = self.generate_prompt_parts(user_query)
+        prompt_ids = self.context_packer.format_ids(docs, self.context_budget(user_query), prefix, suffix)
+        if prompt_ids is not None and len(prompt_ids) + self.max_new_tokens > self.context_window:
+            raise ContextOverflowError(
+                f"Промпт ({len(prompt_ids)} токенов) не помещается в окно модели "
+                f"({self.context_window} токенов, из них {self.max_new_tokens} на ответ)"
+            )
+        return prompt_ids
+
+    def _prompt_ids_match_text(self) -> bool:
+        """
+        Проверяет на примере, что токены промпта, собранные из токенов фрагментов, совпадают
+        с токенизацией текстового промпта: иначе модель получила бы другой промпт.
+        """
+        packer = self.context_packer
+        docs = [
+            Document(page_content=text, metadata={"source": source, "page": page,
+                                                  TOKENS_KEY: {packer.tokenizer_name: tokenize_chunk(packer.tokenizer,
+                                                                                                     text)}})
+            for text, source, page in (
+                ("Для регистрации на Портале поставщиков нажмите кнопку «Регистрация» и заполните "
+                 "карточку организации.", "Инструкция_по_работе_с_Порталом.pdf", 3),
+                ("Электронное исполнение контракта (44-ФЗ) осуществляется в ЕИС", "Регламент.pdf", None),
+            )
+        ]
+        query = "Как зарегистрироваться на портале?"
+        budget = self.context_budget(query)
+        prompt_ids = self.generate_prompt_ids(query, docs)
+        expected = self.backend.tokenizer.encode(
+            self.generate_prompt(query, self.format_context(docs, budget)), add_special_tokens=True)
+        return prompt_ids is not None and list(prompt_ids) == list(expected)
     
     def generate_official_prompt(self, user_query: str) -> str:
         """
@@ -171,19 +274,6 @@ class AnswerGenerator:
 
     
 
-    def postprocess_answer(self, generated_text: str, prompt: str) -> str:
-        """
-        Постобработка сгенерированного ответа.
-        
-        Args:
-            generated_text: Полный сгенерированный текст
-            prompt: Промпт, который был передан модели
-            
-        Returns:
-            str: Очищенный ответ
-        """
-        return generated_text[len(prompt):].strip()
-    
     def extract_sources(self, docs: List[Document]) -> str:
         """
         Извлекает источники из списка документов, формируя строку с указанием 
@@ -193,17 +283,19 @@ class AnswerGenerator:
             return "Неизвестный источник"
         sources_info = {}  # словарь: имя источника -> набор страниц/разделов
         for doc in docs:
-            source_name = doc.metadata.get("source", "Неизвестный источник")
-            page_num = doc.metadata.get("page")
             section_name = doc.metadata.get("section")
-            # Инициализируем запись в словаре, если еще нет
-            if source_name not in sources_info:
-                sources_info[source_name] = {"pages": set(), "sections": set()}
-            # Сохраняем номер страницы (если есть) и название раздела (если есть)
-            if isinstance(page_num, int) or str(page_num).isdigit():
-                sources_info[source_name]["pages"].add(int(page_num))
-            if section_name:
-                sources_info[source_name]["sections"].add(str(section_name))
+            # Источники удалённых при индексации дубликатов указываем наравне с основным
+            locations = [(doc.metadata.get("source", "Неизвестный источник"), doc.metadata.get("page"))]
+            locations.extend((source, page) for source, page in get_duplicate_sources(doc))
+            for source_name, page_num in locations:
+                # Инициализируем запись в словаре, если еще нет
+                if source_name not in sources_info:
+                    sources_info[source_name] = {"pages": set(), "sections": set()}
+                # Сохраняем номер страницы (если есть) и название раздела (если есть)
+                if isinstance(page_num, int) or str(page_num).isdigit():
+                    sources_info[source_name]["pages"].add(int(page_num))
+                if section_name:
+                    sources_info[source_name]["sections"].add(str(section_name))
         # Формируем строки для каждого источника
         source_strings = []
         for source, info in sources_info.items():
@@ -225,51 +317,99 @@ class AnswerGenerator:
                 source_strings.append(source)
         return "; ".join(source_strings)
     
-    def get_answer(self, promt):
-        generated = self.generator(promt)[0]["generated_text"]
-        answer = self.postprocess_answer(generated, promt)
-        return answer
-        
+    @property
+    def stopped_by_time(self) -> bool:
+        """Последний вызов модели в этом потоке остановлен по max_time, а не закончен моделью."""
+        return self.backend.stopped_by_time
+
+    @property
+    def last_generation_stats(self):
+        """Статистика последней генерации в этом потоке (например, AssistedGenerationStats), если среда её собирает."""
+        return self.backend.last_stats
+
+    def get_answer(self, promt, max_time: Optional[float] = None):
+        if isinstance(promt, str):
+            generated = self.backend.generate(promt, self.max_new_tokens, self.temperature, max_time)
+        else:
+            generated = self.backend.generate_ids(promt, self.max_new_tokens, self.temperature, max_time)
+        return generated.strip()
+
+    def get_answers(self, promts: List) -> List[str]:
+        """Пакетный get_answer: промпты (тексты или токены) генерируются батчами модели."""
+        generated = self.backend.generate_batch(promts, self.max_new_tokens, self.temperature,
+                                                self.generation_batch_size)
+        return [text.strip() for text in generated]
+
+    def build_answer_prompt(self, user_query: str, docs: List[Document]):
+        """
+        Промпт ответа по документам: токены, если у документов есть токены этой модели, иначе текст.
 
-    def generate_answer(self, user_query: str, docs: List[Document]) -> Tuple[str, str]:
+        Raises:
+            ContextOverflowError: Если запрос не помещается в окно модели
+        """
+        prompt_ids = self.generate_prompt_ids(user_query, docs)
+        if prompt_ids is not None:
+            return prompt_ids
+        return self.generate_prompt(user_query, self.format_context(docs, self.context_budget(user_query)))
+
+
+    def generate_answer(self, user_query: str, docs: List[Document],
+                        max_time: Optional[float] = None) -> Tuple[str, str]:
         """
         Генерирует ответ на основе запроса пользователя и документов.
         
         Args:
             user_query: Запрос пользователя
             docs: Список релевантных документов
+            max_time: Ограничение времени генерации в секундах (None - без ограничения)
             
         Returns:
             Tuple[str, str]: Ответ и строка источников
+            
+        Raises:
+            ContextOverflowError: Если запрос не помещается в окно модели
         """
 
-        context = self.format_context(docs)
-        promt = self.generate_prompt(user_query, context)
-        model_answer = self.get_answer(promt)
+        model_answer = self.get_answer(self.build_answer_prompt(user_query, docs), max_time)
         sources = self.extract_sources(docs)
 
         return model_answer, sources
 
     
-    def generate_official_query(self,user_query):
+    def generate_official_query(self,user_query, max_time: Optional[float] = None):
         promt = self.generate_official_prompt(user_query)
-        model_answer = self.get_answer(promt)
+        model_answer = self.get_answer(promt, max_time)
         return model_answer
     
-    def is_good_answer(self,user_query, model_answer):
+    def generate_official_queries(self, user_queries: List[str]) -> List[str]:
+        """Пакетный generate_official_query."""
+        return self.get_answers([self.generate_official_prompt(user_query) for user_query in user_queries])
+
+    def is_good_answer(self,user_query, model_answer, max_time: Optional[float] = None):
         promt = self.generate_prompt_diff_user_query_bot_answer(user_query, model_answer)
-        is_correct_model_answer = self.get_answer(promt)
+        is_correct_model_answer = self.get_answer(promt, max_time)
         is_correct_answer = True if is_correct_model_answer == "да" else False
         return is_correct_answer
+
+    def are_good_answers(self, user_queries: List[str], model_answers: List[str]) -> List[bool]:
+        """Пакетный is_good_answer."""
+        verdicts = self.get_answers([self.generate_prompt_diff_user_query_bot_answer(user_query, model_answer)
+                                     for user_query, model_answer in zip(user_queries, model_answers)])
+        return [verdict == "да" for verdict in verdicts]
     
-    def generate_new_query(self, user_queries, model_answers):
+    def generate_new_query(self, user_queries, model_answers, max_time: Optional[float] = None):
         user_queries = "\n".join(user_queries)
         model_answers = "\n".join(model_answers)
         promt = self.generate_better_promt(user_queries, model_answers) #
-        new_query = self.get_answer(promt)
+        new_query = self.get_answer(promt, max_time)
 
         return new_query
 
+    def generate_new_queries(self, user_queries_list: List[List[str]], model_answers_list: List[List[str]]) -> List[str]:
+        """Пакетный generate_new_query: для каждого вопроса - его предыдущие формулировки и ответы."""
+        return self.get_answers([self.generate_better_promt("\n".join(user_queries), "\n".join(model_answers))
+                                 for user_queries, model_answers in zip(user_queries_list, model_answers_list)])
+
 if __name__ == "__main__":
     # Пример использования
     generator = AnswerGenerator()
@@ -0,0 +1,461 @@
+# Среды выполнения языковой модели для AnswerGenerator:
+#  HuggingFace transformers, квантованная GGUF-модель (llama.cpp) и детерминированная заглушка
+
+import logging
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import (LLM_MODEL_NAME, GGUF_MODEL_PATH, GGUF_CONTEXT_WINDOW, GGUF_THREADS,
+                    STUB_CONTEXT_WINDOW, STUB_SECONDS_PER_TOKEN, DRAFT_MODEL_NAME, GENERATION_BATCH_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Причина остановки и статистика последней генерации - отдельно для каждого потока (среда общая для запросов)
+_last_call = threading.local()
+
+
+@dataclass
+class AssistedGenerationStats:
+    """
+    Статистика одного вызова генерации с черновой моделью.
+
+    Скорость сравнивается только по декодированию: время обработки промпта (prefill) не зависит
+    от черновой модели и при коротких ответах завышало бы оценку ускорения.
+
+    Attributes:
+        new_tokens (int): Число сгенерированных токенов
+        draft_tokens (int): Число токенов, предложенных черновой моделью
+        accepted_tokens (int): Число предложенных токенов, подтверждённых основной моделью
+        seconds (float): Время генерации
+        baseline_ms_per_token (Optional[float]): Время токена при обычном декодировании (без prefill)
+        prefill_seconds (float): Оценка времени обработки промпта и первого токена
+    """
+    new_tokens: int
+    draft_tokens: int
+    accepted_tokens: int
+    seconds: float
+    baseline_ms_per_token: Optional[float] = None
+    prefill_seconds: float = 0.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted_tokens / self.draft_tokens if self.draft_tokens else 0.0
+
+    @property
+    def ms_per_token(self) -> float:
+        """Время токена декодирования: без prefill и первого токена."""
+        return 1000 * max(self.seconds - self.prefill_seconds, 0.0) / max(self.new_tokens - 1, 1)
+
+    @property
+    def speedup(self) -> Optional[float]:
+        if not self.baseline_ms_per_token:
+            return None
+        return self.baseline_ms_per_token / max(self.ms_per_token, 1e-6)
+
+    def summary(self) -> str:
+        speedup = f"x{self.speedup:.2f}" if self.speedup else "н/д"
+        return (f"токенов: {self.new_tokens}, принято черновых: {self.accepted_tokens}/{self.draft_tokens} "
+                f"({self.acceptance_rate:.0%}), {self.ms_per_token:.1f} мс/токен, ускорение: {speedup}")
+
+
+class _ForwardCounter:
+    """Считает вызовы forward модели через hook."""
+
+    def __init__(self, model):
+        self.calls = 0
+        model.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, outputs):
+        self.calls += 1
+
+
+class GenerationBackend:
+    """
+    Базовый класс среды выполнения языковой модели.
+
+    Attributes:
+        tokenizer: Токенизатор с методами encode(text, add_special_tokens)
+            и decode(ids, skip_special_tokens) (интерфейс HuggingFace)
+        tokenizer_name (Optional[str]): Имя токенизатора, под которым его токены сохраняются
+            при индексации (None - сохранённые токены не используются)
+        context_window (int): Размер контекстного окна модели в токенах
+        last_stats: Статистика последнего вызова generate в этом потоке (если среда её собирает)
+    """
+    tokenizer = None
+    tokenizer_name: Optional[str] = None
+    context_window: int = 0
+
+    @property
+    def stopped_by_time(self) -> bool:
+        """Последний вызов generate/generate_ids в этом потоке остановлен по max_time, а не закончен моделью."""
+        return getattr(_last_call, "stopped_by_time", False)
+
+    @property
+    def last_stats(self):
+        return getattr(_last_call, "stats", None)
+
+    @staticmethod
+    def _record_stop(stopped_by_time: bool) -> None:
+        _last_call.stopped_by_time = stopped_by_time
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float,
+                 max_time: Optional[float] = None) -> str:
+        """
+        Генерирует продолжение промпта.
+
+        Args:
+            prompt: Промпт
+            max_new_tokens: Максимальное количество новых токенов
+            temperature: Температура; 0 - жадное декодирование
+            max_time: Ограничение времени генерации в секундах (None - без ограничения);
+                по его истечении возвращается уже сгенерированная часть
+
+        Returns:
+            str: Сгенерированный текст без промпта
+        """
+        raise NotImplementedError("Должен быть реализован в дочерних классах")
+
+    def generate_ids(self, input_ids: List[int], max_new_tokens: int, temperature: float,
+                     max_time: Optional[float] = None) -> str:
+        """
+        Генерирует продолжение промпта, заданного токенами (со служебными токенами начала).
+
+        По умолчанию токены декодируются в текст и передаются в generate.
+
+        Returns:
+            str: Сгенерированный текст без промпта
+        """
+        return self.generate(self.tokenizer.decode(input_ids, skip_special_tokens=True), max_new_tokens,
+                             temperature, max_time)
+
+    def generate_batch(self, prompts: List, max_new_tokens: int, temperature: float,
+                       batch_size: int = GENERATION_BATCH_SIZE) -> List[str]:
+        """
+        Генерирует продолжения нескольких промптов (текстов или списков токенов).
+
+        По умолчанию промпты обрабатываются по одному; среды, умеющие батчи, переопределяют метод.
+
+        Args:
+            prompts: Промпты - строки или токены (как в generate_ids)
+            max_new_tokens: Максимальное количество новых токенов
+            temperature: Температура; 0 - жадное декодирование
+            batch_size: Число промптов в одном проходе модели
+
+        Returns:
+            List[str]: Сгенерированные тексты в порядке промптов
+        """
+        return [self.generate(prompt, max_new_tokens, temperature) if isinstance(prompt, str)
+                else self.generate_ids(prompt, max_new_tokens, temperature)
+                for prompt in prompts]
+
+
+class HFBackend(GenerationBackend):
+    """
+    Модель HuggingFace transformers (AutoModelForCausalLM).
+
+    Если задана черновая модель (draft_model_name), используется assisted
+    (speculative) decoding: черновая модель предлагает несколько токенов, основная
+    проверяет их одним проходом. При жадном декодировании результат совпадает
+    с обычной генерацией. Черновая модель должна иметь тот же токенизатор.
+
+    Статистика assisted decoding считается по hook-ам forward, общим для всех потоков,
+    поэтому генерация с черновой моделью (и замер базы) выполняется под блокировкой.
+    """
+
+    def __init__(self, model_name: str = LLM_MODEL_NAME, device_map: str = "auto", load_in_8bit: bool = True,
+                 draft_model_name: Optional[str] = DRAFT_MODEL_NAME):
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.tokenizer_name = model_name
+        self.model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            device_map=device_map,
+            load_in_8bit=load_in_8bit
+        )
+        window = getattr(self.model.config, "max_position_embeddings", None)
+        self.context_window = int(window or self.tokenizer.model_max_length)
+
+        self.draft_model = None
+        self.baseline_ms_per_token = None
+        self.prefill_ms_per_prompt_token = None
+        self._assisted_lock = threading.Lock()
+        if draft_model_name:
+            self.draft_model = AutoModelForCausalLM.from_pretrained(draft_model_name, device_map=device_map)
+            self._main_counter = _ForwardCounter(self.model)
+            self._draft_counter = _ForwardCounter(self.draft_model)
+
+    @staticmethod
+    def _sampling(temperature: float) -> dict:
+        return {"do_sample": True, "temperature": temperature} if temperature > 0 else {"do_sample": False}
+
+    def _input_ids(self, prompt):
+        """Токены промпта (текста или готовых токенов) на устройстве модели."""
+        import torch
+
+        if isinstance(prompt, str):
+            input_ids = self.tokenizer(prompt, return_tensors="pt")["input_ids"]
+        else:
+            input_ids = torch.tensor([list(prompt)], dtype=torch.long)
+        return input_ids.to(self.model.device)
+
+    def _generate_ids(self, prompt, max_new_tokens: int, temperature: float, assisted: bool,
+                      max_time: Optional[float] = None, min_new_tokens: Optional[int] = None):
+        """
+        Генерирует токены напрямую через model.generate; возвращает (новые токены, время).
+        prompt - текст или готовые токены промпта.
+        """
+        import torch
+
+        input_ids = self._input_ids(prompt)
+        extra = {"assistant_model": self.draft_model} if assisted else {}
+        if max_time is not None:
+            extra["max_time"] = max_time
+        if min_new_tokens is not None:
+            extra["min_new_tokens"] = min_new_tokens
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                         max_new_tokens=max_new_tokens, **self._sampling(temperature), **extra)
+        return output[0, input_ids.shape[1]:], time.perf_counter() - start
+
+    def calibrate(self, prompt: str, max_new_tokens: int) -> float:
+        """
+        Замеряет время токена при обычном жадном декодировании - базу для оценки ускорения
+        assisted decoding. Выполняется при прогреве (startup.warm_up), а не в запросах пользователей.
+
+        Время prefill измеряется генерацией одного токена и вычитается: сравнивается только
+        декодирование ответа той же длины (max_new_tokens), что и в рабочих запросах.
+
+        Args:
+            prompt: Промпт замера
+            max_new_tokens: Длина ответа, как у рабочих запросов
+
+        Returns:
+            float: Миллисекунды на токен декодирования
+        """
+        max_new_tokens = max(max_new_tokens, 2)
+        prompt_tokens = self._input_ids(prompt).shape[1]
+        with self._assisted_lock:
+            _, prefill_seconds = self._generate_ids(prompt, 1, 0.0, assisted=False)
+            new_ids, seconds = self._generate_ids(prompt, max_new_tokens, 0.0, assisted=False,
+                                                  min_new_tokens=max_new_tokens)
+        self.prefill_ms_per_prompt_token = 1000 * prefill_seconds / max(prompt_tokens, 1)
+        self.baseline_ms_per_token = 1000 * max(seconds - prefill_seconds, 0.0) / max(len(new_ids) - 1, 1)
+        logger.info("Обычное декодирование: %.1f мс/токен, prefill %.2f мс/токен промпта",
+                    self.baseline_ms_per_token, self.prefill_ms_per_prompt_token)
+        return self.baseline_ms_per_token
+
+    def _generate_assisted(self, prompt, max_new_tokens: int, temperature: float,
+                           max_time: Optional[float] = None) -> str:
+        prompt_tokens = len(prompt) if not isinstance(prompt, str) else self._input_ids(prompt).shape[1]
+        # Счётчики проходов общие для потоков: между замерами не должно быть чужих генераций
+        with self._assisted_lock:
+            main_calls, draft_calls = self._main_counter.calls, self._draft_counter.calls
+            new_ids, seconds = self._generate_ids(prompt, max_new_tokens, temperature, assisted=True,
+                                                  max_time=max_time)
+            # Каждый проход основной модели подтверждает часть черновых токенов и добавляет один свой
+            rounds = self._main_counter.calls - main_calls
+            draft_tokens = self._draft_counter.calls - draft_calls
+        stats = AssistedGenerationStats(
+            new_tokens=len(new_ids),
+            draft_tokens=draft_tokens,
+            accepted_tokens=max(len(new_ids) - rounds, 0),
+            seconds=seconds,
+            baseline_ms_per_token=self.baseline_ms_per_token,
+            prefill_seconds=(self.prefill_ms_per_prompt_token or 0.0) * prompt_tokens / 1000,
+        )
+        _last_call.stats = stats
+        logger.info("Assisted decoding: %s", stats.summary())
+        self._record_stop(self._hit_time_limit(new_ids, max_new_tokens, max_time))
+        return self.tokenizer.decode(new_ids, skip_special_tokens=True)
+
+    def _hit_time_limit(self, new_ids, max_new_tokens: int, max_time: Optional[float]) -> bool:
+        """Генерация остановлена по max_time: токенов меньше max_new_tokens, и модель не закончила ответ (EOS)."""
+        if max_time is None or len(new_ids) >= max_new_tokens:
+            return False
+        return not len(new_ids) or int(new_ids[-1]) != self.tokenizer.eos_token_id
+
+    def _generate(self, prompt, max_new_tokens: int, temperature: float, max_time: Optional[float]) -> str:
+        if self.draft_model is not None:
+            return self._generate_assisted(prompt, max_new_tokens, temperature, max_time)
+        # max_time - встроенный критерий остановки generate (MaxTimeCriteria)
+        new_ids, _ = self._generate_ids(prompt, max_new_tokens, temperature, assisted=False, max_time=max_time)
+        self._record_stop(self._hit_time_limit(new_ids, max_new_tokens, max_time))
+        return self.tokenizer.decode(new_ids, skip_special_tokens=True)
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float,
+                 max_time: Optional[float] = None) -> str:
+        return self._generate(prompt, max_new_tokens, temperature, max_time)
+
+    def generate_ids(self, input_ids: List[int], max_new_tokens: int, temperature: float,
+                     max_time: Optional[float] = None) -> str:
+        return self._generate(input_ids, max_new_tokens, temperature, max_time)
+
+    def generate_batch(self, prompts: List, max_new_tokens: int, temperature: float,
+                       batch_size: int = GENERATION_BATCH_SIZE) -> List[str]:
+        if self.draft_model is not None:
+            # Assisted decoding в transformers поддерживает только батч из одного промпта
+            return super().generate_batch(prompts, max_new_tokens, temperature, batch_size)
+        import torch
+
+        encoded = [self.tokenizer(prompt)["input_ids"] if isinstance(prompt, str) else list(prompt)
+                   for prompt in prompts]
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self.tokenizer.eos_token_id
+        # Промпты близкой длины попадают в один батч - меньше лишних вычислений на выравнивании
+        order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+        results = [""] * len(prompts)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            width = max(len(encoded[i]) for i in batch)
+            # Выравнивание слева: новые токены всех промптов начинаются с одной позиции
+            input_ids = torch.tensor([[pad_id] * (width - len(encoded[i])) + encoded[i] for i in batch])
+            attention_mask = torch.tensor([[0] * (width - len(encoded[i])) + [1] * len(encoded[i]) for i in batch])
+            with torch.no_grad():
+                output = self.model.generate(input_ids=input_ids.to(self.model.device),
+                                             attention_mask=attention_mask.to(self.model.device),
+                                             max_new_tokens=max_new_tokens, pad_token_id=pad_id,
+                                             **self._sampling(temperature))
+            for row, i in enumerate(batch):
+                results[i] = self.tokenizer.decode(output[row, width:], skip_special_tokens=True)
+        return results
+
+
+class _LlamaTokenizer:
+    """Обёртка токенизатора llama.cpp с интерфейсом HuggingFace."""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=add_special_tokens)
+
+    def decode(self, ids: List[int], skip_special_tokens: bool = True) -> str:
+        return self.llm.detokenize(ids).decode("utf-8", errors="ignore")
+
+
+class LlamaCppBackend(GenerationBackend):
+    """Квантованная GGUF-модель на CPU через llama-cpp-python."""
+
+    def __init__(self, model_path: str = GGUF_MODEL_PATH, context_window: int = GGUF_CONTEXT_WINDOW,
+                 n_threads: Optional[int] = GGUF_THREADS):
+        from llama_cpp import Llama
+
+        self.llm = Llama(model_path=model_path, n_ctx=context_window, n_threads=n_threads, verbose=False)
+        self.tokenizer = _LlamaTokenizer(self.llm)
+        self.context_window = self.llm.n_ctx()
+
+    def _generate(self, prompt, max_new_tokens: int, temperature: float, max_time: Optional[float]) -> str:
+        """Генерация с остановкой по времени (аналог max_time в transformers); prompt - текст или токены."""
+        stopping_criteria, stopped = None, []
+        if max_time is not None:
+            from llama_cpp import StoppingCriteriaList
+
+            stop_at = time.monotonic() + max_time
+
+            def out_of_time(input_ids, logits) -> bool:
+                if time.monotonic() >= stop_at:
+                    stopped.append(True)
+                    return True
+                return False
+
+            stopping_criteria = StoppingCriteriaList([out_of_time])
+        result = self.llm(prompt, max_tokens=max_new_tokens, temperature=temperature,
+                          stopping_criteria=stopping_criteria)
+        self._record_stop(bool(stopped))
+        return result["choices"][0]["text"]
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float,
+                 max_time: Optional[float] = None) -> str:
+        return self._generate(prompt, max_new_tokens, temperature, max_time)
+
+    def generate_ids(self, input_ids: List[int], max_new_tokens: int, temperature: float,
+                     max_time: Optional[float] = None) -> str:
+        # create_completion принимает промпт и списком токенов
+        return self._generate(list(input_ids), max_new_tokens, temperature, max_time)
+
+
+class _StubTokenizer:
+    """Детерминированный токенизатор по словам и знакам препинания."""
+
+    _pattern = re.compile(r"\w+|[^\w\s]|\s+")
+
+    def __init__(self):
+        self._vocab: Dict[int, str] = {}
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        ids = []
+        for token in self._pattern.findall(text):
+            token_id = zlib.crc32(token.encode("utf-8"))
+            self._vocab[token_id] = token
+            ids.append(token_id)
+        return ids
+
+    def decode(self, ids: List[int], skip_special_tokens: bool = True) -> str:
+        return "".join(self._vocab.get(token_id, "") for token_id in ids)
+
+
+class StubBackend(GenerationBackend):
+    """
+    Детерминированная заглушка без весов для нагрузочного тестирования и бенчмарков.
+
+    На промпты проверки ответа ("либо да ... нет") отвечает "да", на остальные -
+    первыми словами вопроса из промпта. Задержка имитирует декодирование:
+    seconds_per_token на каждый сгенерированный токен.
+
+    Attributes:
+        seconds_per_token (float): Имитируемое время генерации одного токена
+    """
+
+    def __init__(self, context_window: int = STUB_CONTEXT_WINDOW,
+                 seconds_per_token: float = STUB_SECONDS_PER_TOKEN):
+        self.tokenizer = _StubTokenizer()
+        self.tokenizer_name = "stub"
+        self.context_window = context_window
+        self.seconds_per_token = seconds_per_token
+
+    def generate(self, prompt: str, max_new_tokens: int, temperature: float,
+                 max_time: Optional[float] = None) -> str:
+        if "либо да" in prompt:
+            answer = "да"
+        else:
+            questions = re.findall(r"Вопрос[^:\n]*:\s*(.+)", prompt)
+            question = questions[-1].strip() if questions else prompt[-200:]
+            answer = f"Ответ-заглушка [{zlib.crc32(prompt.encode('utf-8')):08x}]: {question}"
+        ids = self.tokenizer.encode(answer, add_special_tokens=False)[:max_new_tokens]
+        full_length = len(ids)
+        if self.seconds_per_token and max_time is not None:
+            ids = ids[:max(int(max_time / self.seconds_per_token), 1)]
+        self._record_stop(len(ids) < full_length)
+        if self.seconds_per_token:
+            time.sleep(self.seconds_per_token * len(ids))
+        return self.tokenizer.decode(ids)
+
+
+def create_backend(name: str, model_name: str = LLM_MODEL_NAME, device_map: str = "auto",
+                   load_in_8bit: bool = True) -> GenerationBackend:
+    """
+    Создаёт среду выполнения по имени.
+
+    Args:
+        name: "hf", "llama_cpp" или "stub"
+        model_name: Название модели HuggingFace (для "hf")
+        device_map: Стратегия распределения по устройствам (для "hf")
+        load_in_8bit: Использовать 8-битную квантизацию (для "hf")
+
+    Returns:
+        GenerationBackend: Инициализированная среда выполнения
+    """
+    if name == "hf":
+        return HFBackend(model_name, device_map, load_in_8bit)
+    if name == "llama_cpp":
+        return LlamaCppBackend()
+    if name == "stub":
+        return StubBackend()
+    raise ValueError(f"Неизвестная среда выполнения LLM: {name}")
@@ -0,0 +1,305 @@
+# Версионированные снимки векторного индекса: фоновая пересборка и атомарное переключение
+#  Пересборка (можно запускать по расписанию, работающее приложение подхватит новый снимок):
+#   python index_manager.py rebuild
+#  Приложение без индекса строит первый снимок так же, в отдельном процессе
+
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Set, Tuple
+
+from config import (CHROMA_PERSIST_DIR, INDEX_SNAPSHOTS_TO_KEEP, INDEX_CHECK_INTERVAL, INDEX_LEASE_SECONDS,
+                    DOCSTORE_ENABLED)
+
+SNAPSHOTS_DIRNAME = "snapshots"
+CURRENT_FILENAME = "CURRENT"
+# Хэш содержимого фрагментов снимка (пишется create_vector_store): снимки с одинаковыми
+# фрагментами дают одинаковую близость при поиске, поэтому пороги relevance_gate.py переносятся между ними
+FINGERPRINT_FILENAME = "fingerprint.txt"
+# Отметки об используемых снимках: файл <версия>.<pid>, время изменения - последнее продление
+LEASES_DIRNAME = "leases"
+# Индекс старого формата, лежащий прямо в CHROMA_PERSIST_DIR
+LEGACY_VERSION = "legacy"
+# Приоритет процесса фоновой пересборки (nice), чтобы не отнимать CPU у обработки запросов
+REBUILD_NICENESS = 10
+
+
+class IndexManager:
+    """
+    Управляет неизменяемыми снимками индекса в CHROMA_PERSIST_DIR/snapshots/<версия>
+    и указателем CURRENT на текущий снимок.
+
+    Снимок строится во временном каталоге, после готовности переименовывается,
+    а указатель заменяется атомарно (os.replace), поэтому читатели всегда видят
+    либо старый, либо новый полностью построенный снимок.
+
+    Процессы приложения продлевают отметку (lease) снимка, которым обслуживают запросы;
+    очистка не удаляет снимки с отметкой моложе lease_seconds.
+
+    Attributes:
+        root (str): Корневой каталог индекса
+        snapshots_to_keep (int): Сколько старых снимков хранить помимо текущего
+        lease_seconds (float): Срок действия отметки об использовании снимка
+    """
+
+    def __init__(self, root: str = CHROMA_PERSIST_DIR, snapshots_to_keep: int = INDEX_SNAPSHOTS_TO_KEEP,
+                 lease_seconds: float = INDEX_LEASE_SECONDS):
+        self.root = root
+        self.snapshots_to_keep = snapshots_to_keep
+        self.lease_seconds = lease_seconds
+        self.snapshots_dir = os.path.join(root, SNAPSHOTS_DIRNAME)
+        self.leases_dir = os.path.join(root, LEASES_DIRNAME)
+
+    def _has_legacy_index(self) -> bool:
+        return os.path.isdir(self.root) and any(
+            name not in (SNAPSHOTS_DIRNAME, CURRENT_FILENAME, LEASES_DIRNAME) for name in os.listdir(self.root))
+
+    def current_version(self) -> Optional[str]:
+        """Возвращает версию текущего снимка или None, если индекса ещё нет."""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILENAME), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return LEGACY_VERSION if self._has_legacy_index() else None
+
+    def snapshot_dir(self, version: str) -> str:
+        """Каталог снимка указанной версии."""
+        if version == LEGACY_VERSION:
+            return self.root
+        return os.path.join(self.snapshots_dir, version)
+
+    def fingerprint(self, version: str) -> Optional[str]:
+        """Хэш содержимого фрагментов снимка или None, если снимок построен до его появления."""
+        try:
+            with open(os.path.join(self.snapshot_dir(version), FINGERPRINT_FILENAME), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def list_versions(self) -> List[str]:
+        """Версии готовых снимков от старых к новым."""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        return sorted(name for name in os.listdir(self.snapshots_dir) if not name.endswith(".tmp"))
+
+    def _set_current(self, version: str) -> None:
+        path = os.path.join(self.root, CURRENT_FILENAME)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_path, path)
+
+    def build_snapshot(self, embeddings=None) -> str:
+        """
+        Строит новый снимок индекса и делает его текущим.
+
+        Args:
+            embeddings: Модель эмбеддингов (по умолчанию создаётся get_embeddings())
+
+        Returns:
+            str: Версия построенного снимка
+        """
+        from knowledge_base import create_vector_store
+
+        version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        tmp_dir = os.path.join(self.snapshots_dir, f"{version}.tmp")
+        os.makedirs(tmp_dir)
+        # Неизменившиеся шарды текущего снимка переносятся без повторной векторизации
+        current = self.current_version()
+        reuse_dir = self.snapshot_dir(current) if current and current != LEGACY_VERSION else None
+        vector_store = create_vector_store(tmp_dir, embeddings, reuse_dir)
+        del vector_store
+        os.replace(tmp_dir, self.snapshot_dir(version))
+        self._set_current(version)
+        print(f"✅ Текущий снимок индекса: {version}")
+        self.collect_garbage()
+        return version
+
+    def touch_lease(self, version: str) -> None:
+        """Отмечает, что этот процесс обслуживает запросы снимком version."""
+        if version == LEGACY_VERSION:
+            return
+        os.makedirs(self.leases_dir, exist_ok=True)
+        path = os.path.join(self.leases_dir, f"{version}.{os.getpid()}")
+        with open(path, "a", encoding="utf-8"):
+            pass
+        os.utime(path)
+
+    def _leased_versions(self) -> Set[str]:
+        """Версии с действующими отметками; просроченные отметки удаляются."""
+        if not os.path.isdir(self.leases_dir):
+            return set()
+        leased = set()
+        now = time.time()
+        for name in os.listdir(self.leases_dir):
+            path = os.path.join(self.leases_dir, name)
+            try:
+                fresh = now - os.path.getmtime(path) < self.lease_seconds
+            except FileNotFoundError:
+                continue
+            if fresh:
+                leased.add(name.rsplit(".", 1)[0])
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return leased
+
+    def collect_garbage(self) -> List[str]:
+        """
+        Удаляет старые снимки, оставляя текущий, snapshots_to_keep самых новых
+        и снимки, которыми процессы приложения пользовались в последние lease_seconds
+        (они могут ещё не переключиться на новый снимок).
+
+        Returns:
+            List[str]: Удалённые версии
+        """
+        current = self.current_version()
+        versions = [v for v in self.list_versions() if v != current]
+        leased = self._leased_versions()
+        stale = [v for v in versions[:max(len(versions) - self.snapshots_to_keep, 0)] if v not in leased]
+        for version in stale:
+            shutil.rmtree(self.snapshot_dir(version), ignore_errors=True)
+        return stale
+
+    def start_background_rebuild(self) -> subprocess.Popen:
+        """
+        Запускает пересборку в отдельном процессе с пониженным приоритетом,
+        чтобы она не конкурировала с обработкой запросов за GIL и CPU.
+
+        Returns:
+            subprocess.Popen: Процесс пересборки
+        """
+        script = os.path.abspath(__file__)
+        return subprocess.Popen([sys.executable, script, "rebuild"], cwd=os.getcwd(),
+                                preexec_fn=lambda: os.nice(REBUILD_NICENESS))
+
+
+class IndexWatcher:
+    """
+    Держит ретривер текущего снимка и переключает его на новый снимок без остановки приложения.
+
+    Не чаще раза в check_interval секунд проверяет указатель CURRENT; новый снимок
+    открывается в фоновом потоке, а до готовности запросы обслуживает старый.
+    Отметка об использовании текущего снимка продлевается фоновым потоком каждые
+    check_interval секунд, чтобы пересборка в другом процессе его не удалила.
+
+    Attributes:
+        manager (IndexManager): Менеджер снимков
+        embeddings: Общая для всех снимков модель эмбеддингов
+        version (str): Версия снимка, которым обслуживаются запросы
+        vector_store: Векторное хранилище текущей версии
+        retriever: Ретривер текущей версии
+        on_new_snapshot: Функция (версия, ретривер), вызываемая для нового снимка до переключения
+            на него (например, прогрев кэша ответов)
+    """
+
+    on_new_snapshot: Optional[Callable[[str, object], None]] = None
+
+    def __init__(self, embeddings, retriever_factory, manager: Optional[IndexManager] = None,
+                 check_interval: float = INDEX_CHECK_INTERVAL):
+        """
+        Args:
+            embeddings: Модель эмбеддингов
+            retriever_factory: Функция (vector_store, docstore) -> ретривер; для шардированного
+                снимка vector_store - ShardedIndex, docstore - None (у шардов свои)
+            manager: Менеджер снимков
+            check_interval: Период проверки указателя в секундах
+        """
+        self.manager = manager or IndexManager()
+        self.embeddings = embeddings
+        self.retriever_factory = retriever_factory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._loading = False
+        self._last_check = time.monotonic()
+
+        version = self.manager.current_version()
+        if version is None:
+            # Без индекса отвечать нечем, но построение идёт вне процесса приложения
+            # (загрузка PDF и векторизация не держат GIL и память приложения)
+            print("🆕 Индекс не найден. Загружаем документы и создаём новый...")
+            process = self.manager.start_background_rebuild()
+            if process.wait() != 0:
+                raise RuntimeError(f"Построение индекса завершилось с кодом {process.returncode}")
+            version = self.manager.current_version()
+        self.version, self.vector_store, self.retriever = version, *self._open(version)
+        threading.Thread(target=self._keep_lease, daemon=True).start()
+
+    def _keep_lease(self) -> None:
+        while True:
+            time.sleep(self.check_interval)
+            with self._lock:
+                version = self.version
+            try:
+                self.manager.touch_lease(version)
+            except OSError as error:
+                print(f"⚠️ Не удалось продлить отметку снимка {version}: {error}")
+
+    def _open(self, version: str):
+        from knowledge_base import load_vector_store
+        from docstore import DocStore
+        from sharded_index import open_shards
+
+        # Отметка ставится до открытия, чтобы снимок не удалили, пока он загружается
+        self.manager.touch_lease(version)
+        snapshot_dir = self.manager.snapshot_dir(version)
+        sharded = open_shards(snapshot_dir, self.embeddings)
+        if sharded is not None:
+            return sharded, self.retriever_factory(sharded, None)
+        vector_store = load_vector_store(snapshot_dir, self.embeddings)
+        docstore = DocStore.open(snapshot_dir) if DOCSTORE_ENABLED else None
+        return vector_store, self.retriever_factory(vector_store, docstore)
+
+    def _swap(self, version: str) -> None:
+        try:
+            vector_store, retriever = self._open(version)
+            if self.on_new_snapshot is not None:
+                try:
+                    self.on_new_snapshot(version, retriever)
+                except Exception as error:
+                    print(f"⚠️ Ошибка подготовки снимка {version}: {error}")
+            with self._lock:
+                self.version, self.vector_store, self.retriever = version, vector_store, retriever
+            print(f"🔁 Индекс переключён на снимок {version}")
+        finally:
+            self._loading = False
+
+    def refresh(self) -> None:
+        """Запускает переключение на новый снимок, если указатель CURRENT изменился."""
+        with self._lock:
+            now = time.monotonic()
+            if self._loading or now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            version = self.manager.current_version()
+            if not version or version == self.version:
+                return
+            self._loading = True
+        threading.Thread(target=self._swap, args=(version,), daemon=True).start()
+
+    def get_snapshot(self) -> Tuple[str, object]:
+        """Возвращает версию и ретривер текущего снимка, при необходимости запуская переключение."""
+        self.refresh()
+        with self._lock:
+            return self.version, self.retriever
+
+    def get_retriever(self):
+        """Возвращает ретривер текущего снимка, при необходимости запуская переключение."""
+        return self.get_snapshot()[1]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    manager = IndexManager()
+    if command == "rebuild":
+        manager.build_snapshot()
+    elif command == "gc":
+        print("Удалены снимки:", manager.collect_garbage())
+    else:
+        sys.exit(f"Неизвестная команда: {command} (ожидается rebuild или gc)")
@@ -3,56 +3,155 @@ import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import os
+from typing import Dict, List
+
 import pandas as pd
 from langchain.schema import Document
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import Chroma
-from config import PDF_DOCS_DIR, CHROMA_PERSIST_DIR, EMBEDDING_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP
- 
-def load_documents_from_pdfs():
+from config import (PDF_DOCS_DIR, CHROMA_PERSIST_DIR, EMBEDDING_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP,
+                    DEDUP_ENABLED, ARTICLES_PATH, PDF_BACKEND, DOC_TYPE_FILENAME_PATTERNS,
+                    INFERENCE_BACKEND, DOCSTORE_ENABLED, INDEX_SHARDS, PRETOKENIZE_TOKENIZERS)
+from dedup import NearDuplicateDetector
+from file_cache import file_sha256, cache_path
+from pdf_loader import PyMuPDFLoader
+
+DEDUP_REPORT_FILENAME = "dedup_report.json"
+# Ключ метаданных с типом источника, по которому индекс делится на разделы
+DOC_TYPE_KEY = "doc_type"
+ARTICLE_DOC_TYPE = "article"
+OTHER_DOC_TYPE = "other"
+
+
+def doc_type_for_filename(filename: str) -> str:
+    """Определяет тип источника (раздел индекса) по имени PDF-файла."""
+    lowered = filename.lower()
+    for doc_type, patterns in DOC_TYPE_FILENAME_PATTERNS.items():
+        if any(pattern in lowered for pattern in patterns):
+            return doc_type
+    return OTHER_DOC_TYPE
+
+def list_pdf_files(pdf_dir: str = PDF_DOCS_DIR) -> List[str]:
+    """Возвращает пути ко всем PDF в папке в детерминированном порядке."""
+    return [os.path.join(pdf_dir, filename) for filename in sorted(os.listdir(pdf_dir))
+            if filename.lower().endswith(".pdf")]
+
+
+def load_documents_from_pdfs(backend: str = PDF_BACKEND):
     """
     Загружает все PDF из папки pdf_docs и возвращает список документов.
     Каждый документ - объект langchain Document.
+    
+    Args:
+        backend: "pymupdf" - параллельное извлечение с кэшем страниц,
+            "pypdf" - последовательная загрузка через PyPDFLoader
     """
-    documents = []
-    for filename in os.listdir(PDF_DOCS_DIR):
-        if filename.lower().endswith(".pdf"):
-            file_path = os.path.join(PDF_DOCS_DIR, filename)
+    file_paths = list_pdf_files()
+    if backend == "pymupdf":
+        documents = PyMuPDFLoader().load(file_paths)
+    elif backend == "pypdf":
+        from langchain.document_loaders import PyPDFLoader
+
+        documents = []
+        for file_path in file_paths:
             loader = PyPDFLoader(file_path)
             docs = loader.load()  # список документов (по страницам)
             # Добавляем метаданные – имя файла
             for doc in docs:
-                doc.metadata["source"] = filename
+                doc.metadata["source"] = os.path.basename(file_path)
             documents.extend(docs)
+    else:
+        raise ValueError(f"Неизвестный способ загрузки PDF: {backend}")
+
+    for doc in documents:
+        doc.metadata[DOC_TYPE_KEY] = doc_type_for_filename(doc.metadata["source"])
     return documents
 
+ARTICLE_TOPIC_COLUMN = "Заголовок статьи"
+ARTICLE_CONTENT_COLUMN = "Описание"
+ARTICLE_SOURCE_PREFIX = "статья с сайта портал поставщиков: "
+
+
+def _stable_ids(values: pd.Series) -> pd.Series:
+    """
+    Возвращает стабильные идентификаторы строк: хэш значения,
+    а для повторяющихся значений - с порядковым суффиксом.
+    """
+    hashes = pd.util.hash_pandas_object(values, index=False).map("{:016x}".format)
+    occurrence = values.groupby(values).cumcount()
+    return hashes.where(occurrence == 0, hashes + "-" + occurrence.astype(str))
+
+
+def load_articles_frame(file_path: str) -> pd.DataFrame:
+    """
+    Загружает таблицу статей с колонками article_id, topic, content, content_hash.
+    
+    Разобранная таблица кэшируется в Parquet по хэшу файла, поэтому медленный
+    разбор .xls выполняется только при изменении файла. article_id стабилен
+    между версиями таблицы (зависит от заголовка), content_hash - от текста,
+    что позволяет находить изменённые статьи (см. diff_articles).
+    """
+    snapshot_path = cache_path("articles", f"{file_sha256(file_path)}.parquet")
+    if os.path.exists(snapshot_path):
+        return pd.read_parquet(snapshot_path)
+
+    # Читаем Excel-файл (две колонки: тема и содержание)
+    df = pd.read_excel(file_path)
+    print("Размер таблицы", df.shape)
+    topic_column = ARTICLE_TOPIC_COLUMN if ARTICLE_TOPIC_COLUMN in df.columns else df.columns[0]
+    content_column = ARTICLE_CONTENT_COLUMN if ARTICLE_CONTENT_COLUMN in df.columns else df.columns[1]
+    # Приводим к строке на случай наличия чисел/NaN
+    frame = pd.DataFrame({
+        "topic": df[topic_column].astype(str),
+        "content": df[content_column].astype(str),
+    })
+    frame.insert(0, "article_id", _stable_ids(frame["topic"]))
+    frame["content_hash"] = pd.util.hash_pandas_object(frame["content"], index=False).map("{:016x}".format)
+
+    # Пишем во временный файл, чтобы параллельная сборка не прочитала недописанный снимок
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    frame.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, snapshot_path)
+    return frame
+
+
+def diff_articles(old: pd.DataFrame, new: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    Сравнивает две версии таблицы статей по article_id и content_hash.
+    
+    Returns:
+        Dict[str, List[str]]: article_id добавленных, удалённых и изменённых статей
+    """
+    merged = old[["article_id", "content_hash"]].merge(
+        new[["article_id", "content_hash"]], on="article_id", how="outer",
+        suffixes=("_old", "_new"), indicator=True
+    )
+    changed = (merged["_merge"] == "both") & (merged["content_hash_old"] != merged["content_hash_new"])
+    return {
+        "added": merged.loc[merged["_merge"] == "right_only", "article_id"].tolist(),
+        "removed": merged.loc[merged["_merge"] == "left_only", "article_id"].tolist(),
+        "changed": merged.loc[changed, "article_id"].tolist(),
+    }
+
+
 def load_documents_from_excel(file_path: str):
     """
     Загружает статьи из Excel-файла и возвращает список документов.
     Каждый документ – объект LangChain Document с указанием источника.
     """
-    documents = []
-    # Читаем Excel-файл (две колонки: тема и содержание)
-    df = pd.read_excel(file_path)
-    print("Размер таблицы",df.shape)
-    for _, row in df.iterrows():
-        # Извлекаем тему и содержание (приводим к строке на случай наличия чисел/NaN)
-        topic = str(row["Заголовок статьи"]) if "Заголовок статьи" in df.columns else str(row[df.columns[0]])
-        content = str(row["Описание"]) if "Описание" in df.columns else str(row[df.columns[1]])
-        # Создаём документ с нужным форматом источника
-        doc = Document(
-            page_content=content,
-            metadata={"source": f"статья с сайта портал поставщиков: {topic}"}
-        )
-        documents.append(doc)
-    return documents
+    frame = load_articles_frame(file_path)
+    sources = ARTICLE_SOURCE_PREFIX + frame["topic"]
+    # Создаём документы с нужным форматом источника
+    return [
+        Document(page_content=content,
+                 metadata={"source": source, "article_id": article_id, DOC_TYPE_KEY: ARTICLE_DOC_TYPE})
+        for content, source, article_id in zip(frame["content"], sources, frame["article_id"])
+    ]
  
 def split_documents(documents):
     """
     Разбивает документы на более мелкие фрагменты.
     """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size = CHUNK_SIZE,
         chunk_overlap = CHUNK_OVERLAP,
@@ -61,46 +160,156 @@ def split_documents(documents):
     docs_split = text_splitter.split_documents(documents)
     return docs_split
  
-def build_vector_store():
+def get_embeddings(backend: str = INFERENCE_BACKEND):
+    """
+    Создаёт модель эмбеддингов для выбранной среды выполнения.
+    
+    Args:
+        backend: "torch" - HuggingFaceEmbeddings, "onnx" - квантованная int8 модель на ONNX Runtime
+    """
+    if backend == "onnx":
+        from onnx_backend import OnnxEmbeddings
+        return OnnxEmbeddings(EMBEDDING_MODEL_NAME)
+    if backend != "torch":
+        raise ValueError(f"Неизвестная среда выполнения моделей: {backend}")
+    from langchain.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def embed_queries(embeddings, queries: List[str]) -> List[List[float]]:
+    """
+    Векторизует поисковые запросы через embed_query (модели с отдельной инструкцией
+    для запросов кодируют их иначе, чем фрагменты документов).
+
+    Args:
+        embeddings: Модель эмбеддингов (get_embeddings)
+        queries: Тексты запросов
+
+    Returns:
+        List[List[float]]: Векторы запросов; у моделей с методом embed_queries - одним батчем
+    """
+    batched = getattr(embeddings, "embed_queries", None)
+    if batched is not None:
+        return batched(queries)
+    return [embeddings.embed_query(query) for query in queries]
+
+
+def load_index_tokenizers(names: List[str] = PRETOKENIZE_TOKENIZERS) -> Dict[str, object]:
+    """
+    Загружает токенизаторы генерирующих моделей, токены которых сохраняются в docstore.
+
+    Returns:
+        Dict[str, object]: Токенизаторы по версии (context_packer.tokenizer_key)
+    """
+    if not names:
+        return {}
+    from transformers import AutoTokenizer
+    from context_packer import tokenizer_key
+
+    tokenizers = {}
+    for name in names:
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        tokenizers[tokenizer_key(name, tokenizer)] = tokenizer
+    return tokenizers
+
+
+def build_vector_store(persist_dir: str = CHROMA_PERSIST_DIR, embeddings=None):
     """
     Загружает или создает Chroma векторное хранилище.
+    
+    Args:
+        persist_dir: Каталог индекса
+        embeddings: Модель эмбеддингов (по умолчанию создаётся get_embeddings())
     """
-    if os.path.exists(CHROMA_PERSIST_DIR) and os.listdir(CHROMA_PERSIST_DIR):
+    if os.path.exists(persist_dir) and os.listdir(persist_dir):
         print("🔄 Загружаем существующий Chroma индекс...")
-        return load_vector_store()
+        return load_vector_store(persist_dir, embeddings)
 
     print("🆕 Индекс не найден. Загружаем документы и создаём новый...")
+    return create_vector_store(persist_dir, embeddings)
+
+
+def create_vector_store(persist_dir: str = CHROMA_PERSIST_DIR, embeddings=None, reuse_dir: str = None):
+    """
+    Загружает документы и строит новое Chroma векторное хранилище в persist_dir
+    (при INDEX_SHARDS > 1 - шардированный индекс, см. sharded_index.py).
+    
+    Args:
+        persist_dir: Каталог индекса
+        embeddings: Модель эмбеддингов (по умолчанию создаётся get_embeddings())
+        reuse_dir: Каталог предыдущего снимка, из которого копируются неизменившиеся шарды
+    """
     documents = []
     # Загрузка документов из PDF (постранично)
     documents.extend(load_documents_from_pdfs())
     # Загрузка документов из Excel, если файл существует
-    excel_path = "./arcticles.xls"
-    if os.path.exists(excel_path):
-        documents.extend(load_documents_from_excel(excel_path))
+    if os.path.exists(ARTICLES_PATH):
+        documents.extend(load_documents_from_excel(ARTICLES_PATH))
+    detector = NearDuplicateDetector()
+    if DEDUP_ENABLED:
+        # Файлы-дубликаты отбрасываем до разбиения, чтобы не резать и не векторизовать их
+        documents = detector.dedup_files(documents)
     # Разбиение всех документов на фрагменты текста
     docs_split = split_documents(documents)
+    if DEDUP_ENABLED:
+        docs_split = detector.dedup_chunks(docs_split)
+        print("🧹 Удалены дубликаты:", detector.report.summary())
+
     # Инициализация эмбеддингов и векторного хранилища
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-    vector_store = Chroma.from_documents(
-        docs_split, embedding=embeddings, persist_directory=CHROMA_PERSIST_DIR
-    )
-    vector_store.persist()
+    embeddings = embeddings or get_embeddings()
+    tokenizers = load_index_tokenizers() if DOCSTORE_ENABLED else {}
+    if INDEX_SHARDS > 1:
+        from sharded_index import build_shards
+        vector_store = build_shards(docs_split, persist_dir, embeddings, reuse_dir=reuse_dir, tokenizers=tokenizers)
+    else:
+        from langchain.vectorstores import Chroma
+
+        # ID фрагмента в Chroma - его номер, по нему же текст читается из docstore
+        vector_store = Chroma.from_documents(
+            docs_split, embedding=embeddings, persist_directory=persist_dir,
+            ids=[str(chunk_id) for chunk_id in range(len(docs_split))]
+        )
+        vector_store.persist()
+        if DOCSTORE_ENABLED:
+            from docstore import build_docstore, DOCSTORE_DIRNAME
+            build_docstore(docs_split, os.path.join(persist_dir, DOCSTORE_DIRNAME), tokenizers=tokenizers)
+    if DEDUP_ENABLED:
+        detector.report.save(os.path.join(persist_dir, DEDUP_REPORT_FILENAME))
+    from index_manager import FINGERPRINT_FILENAME
+    from sharded_index import fingerprint
+    with open(os.path.join(persist_dir, FINGERPRINT_FILENAME), "w", encoding="utf-8") as f:
+        f.write(fingerprint(docs_split))
     print("✅ Индекс сохранён.")
     return vector_store
 
 
-def load_vector_store():
+def load_vector_store(persist_dir: str = CHROMA_PERSIST_DIR, embeddings=None):
     """
     Загружает ранее сохранённое векторное хранилище Chroma.
+    
+    Args:
+        persist_dir: Каталог индекса
+        embeddings: Модель эмбеддингов (по умолчанию создаётся get_embeddings())
     """
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    from langchain.vectorstores import Chroma
+
     vector_store = Chroma(
-        persist_directory=CHROMA_PERSIST_DIR,
-        embedding_function=embeddings
+        persist_directory=persist_dir,
+        embedding_function=embeddings or get_embeddings()
     )
     return vector_store
 
 if __name__ == "__main__":
-    # Для предварительной индексации: запуск из командной строки
-    vs = build_vector_store()
-    print(f"Индекс построен, число фрагментов: {len(vs._collection.get()['documents'])}")
\ No newline at end of file
+    # Для предварительной индексации: запуск из командной строки (строит новый снимок индекса)
+    from index_manager import IndexManager
+    manager = IndexManager()
+    version = manager.build_snapshot()
+    from sharded_index import open_shards
+    snapshot_dir = manager.snapshot_dir(version)
+    embeddings = get_embeddings()
+    index = open_shards(snapshot_dir, embeddings)
+    if index is None:
+        from sharded_index import IndexShard
+        index = IndexShard(load_vector_store(snapshot_dir, embeddings))
+    count = index.count()
+    print(f"Индекс построен, число фрагментов: {count}")
\ No newline at end of file
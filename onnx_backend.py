@@ -0,0 +1,122 @@
+# Экспорт моделей эмбеддингов и классификации в ONNX с динамической int8-квантизацией
+#  и их использование на CPU через ONNX Runtime
+#  Экспорт:  python onnx_backend.py export
+#  Проверка совпадения с исходными моделями: python -m pytest tests/test_onnx_backend.py
+
+import json
+import os
+import sys
+from typing import List
+
+import numpy as np
+from transformers import AutoTokenizer, pipeline
+from optimum.onnxruntime import (ORTModelForFeatureExtraction, ORTModelForSequenceClassification,
+                                 ORTQuantizer)
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+from config import EMBEDDING_MODEL_NAME, CLASSIFIER_MODEL_NAME, ONNX_MODELS_DIR, ONNX_EMBEDDING_BATCH_SIZE
+
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+# Настройки sentence-transformers, сохраняемые рядом с моделью эмбеддингов (max_seq_length)
+SENTENCE_CONFIG_FILE_NAME = "sentence_bert_config.json"
+
+
+def onnx_model_dir(model_name: str) -> str:
+    """Каталог экспортированной модели внутри ONNX_MODELS_DIR."""
+    return os.path.join(ONNX_MODELS_DIR, model_name.replace("/", "__"))
+
+
+def _export(model_cls, model_name: str) -> str:
+    """Экспортирует модель в ONNX, квантует веса в int8 и сохраняет рядом токенизатор."""
+    out_dir = onnx_model_dir(model_name)
+    model = model_cls.from_pretrained(model_name, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    # Динамическая квантизация: веса в int8, активации квантуются на лету
+    config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=out_dir, quantization_config=config)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(out_dir)
+    model.config.save_pretrained(out_dir)
+    print(f"✅ {model_name} -> {out_dir}")
+    return out_dir
+
+
+def export_models() -> None:
+    """Экспортирует модель эмбеддингов и zero-shot классификатор."""
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = _export(ORTModelForFeatureExtraction, EMBEDDING_MODEL_NAME)
+    # sentence-transformers обрезает тексты по max_seq_length модели (для MiniLM - 128 токенов),
+    # а не по пределу токенизатора (512): без него длинные фрагменты получат другие векторы
+    max_seq_length = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu").max_seq_length
+    with open(os.path.join(out_dir, SENTENCE_CONFIG_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump({"max_seq_length": max_seq_length}, f)
+    _export(ORTModelForSequenceClassification, CLASSIFIER_MODEL_NAME)
+
+
+def _max_seq_length(model_dir: str, tokenizer) -> int:
+    """Длина обрезки текстов, как у sentence-transformers, или предел токенизатора для старого экспорта."""
+    path = os.path.join(model_dir, SENTENCE_CONFIG_FILE_NAME)
+    if not os.path.exists(path):
+        print(f"⚠️ В {model_dir} нет {SENTENCE_CONFIG_FILE_NAME}, повторите экспорт: python onnx_backend.py export")
+        return tokenizer.model_max_length
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["max_seq_length"]
+
+
+class OnnxEmbeddings:
+    """
+    Эмбеддинги sentence-transformers на ONNX Runtime (интерфейс langchain Embeddings).
+
+    Повторяет обрезку (max_seq_length) и пулинг исходной модели: усреднение скрытых
+    состояний по маске внимания.
+
+    Attributes:
+        model: Квантованная ONNX-модель
+        tokenizer: Токенизатор модели
+        batch_size (int): Размер батча при векторизации
+        max_seq_length (int): Сколько токенов текста учитывается
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, batch_size: int = ONNX_EMBEDDING_BATCH_SIZE):
+        model_dir = onnx_model_dir(model_name)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=QUANTIZED_FILE_NAME)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_seq_length = _max_seq_length(model_dir, self.tokenizer)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length,
+                                return_tensors="np")
+        hidden = self.model(**inputs).last_hidden_state
+        hidden = np.asarray(hidden)
+        mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+        return (hidden * mask).sum(axis=1) / mask.sum(axis=1).clip(min=1e-9)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Векторизует список текстов батчами."""
+        vectors = [self._embed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        """Векторизует один запрос."""
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Векторизует несколько запросов одним батчем (модель не различает запросы и документы)."""
+        return self.embed_documents(texts)
+
+
+def onnx_zero_shot_pipeline(model_name: str = CLASSIFIER_MODEL_NAME):
+    """Возвращает zero-shot паплайн transformers поверх квантованной ONNX-модели."""
+    model_dir = onnx_model_dir(model_name)
+    model = ORTModelForSequenceClassification.from_pretrained(model_dir, file_name=QUANTIZED_FILE_NAME)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "export":
+        export_models()
+    else:
+        sys.exit(f"Неизвестная команда: {command} (ожидается export)")
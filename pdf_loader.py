@@ -0,0 +1,99 @@
+# Параллельное извлечение текста из PDF на PyMuPDF с постраничным дисковым кэшем
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pymupdf
+from langchain.schema import Document
+
+from config import PDF_WORKERS, PDF_PAGES_PER_TASK
+from file_cache import file_sha256, cache_path
+
+
+def _page_cache_path(file_hash: str, page: int) -> str:
+    return cache_path("pdf_pages", file_hash, f"{page}.txt")
+
+
+def _extract_pages(file_path: str, file_hash: str, pages: List[int]) -> Dict[int, str]:
+    """
+    Извлекает текст указанных страниц и сохраняет его в кэш.
+    Выполняется в дочернем процессе, поэтому документ открывается заново.
+    """
+    texts = {}
+    with pymupdf.open(file_path) as pdf:
+        for page in pages:
+            text = pdf[page].get_text()
+            path = _page_cache_path(file_hash, page)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            texts[page] = text
+    return texts
+
+
+def _read_cached_pages(file_hash: str, page_count: int) -> Tuple[Dict[int, str], List[int]]:
+    """Возвращает закэшированные тексты страниц и список отсутствующих в кэше страниц."""
+    cached, missing = {}, []
+    for page in range(page_count):
+        path = _page_cache_path(file_hash, page)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                cached[page] = f.read()
+        else:
+            missing.append(page)
+    return cached, missing
+
+
+class PyMuPDFLoader:
+    """
+    Загрузчик PDF: страницы распределяются по пулу процессов, извлечённый текст
+    кэшируется на диске по ключу (хэш файла, номер страницы).
+
+    Метаданные совпадают с PyPDFLoader: "source" - имя файла, "page" - номер страницы с нуля.
+
+    Attributes:
+        max_workers (int): Число процессов (None - по числу ядер)
+        pages_per_task (int): Число страниц в одной задаче пула
+    """
+
+    def __init__(self, max_workers: Optional[int] = PDF_WORKERS,
+                 pages_per_task: int = PDF_PAGES_PER_TASK):
+        self.max_workers = max_workers or os.cpu_count()
+        self.pages_per_task = pages_per_task
+
+    def load(self, file_paths: List[str]) -> List[Document]:
+        """
+        Загружает все страницы указанных файлов.
+
+        Args:
+            file_paths: Пути к PDF-файлам
+
+        Returns:
+            List[Document]: Документы по страницам в порядке файлов и страниц
+        """
+        pages_by_file: Dict[str, Dict[int, str]] = {}
+        tasks = []
+        for file_path in file_paths:
+            file_hash = file_sha256(file_path)
+            with pymupdf.open(file_path) as pdf:
+                page_count = pdf.page_count
+            cached, missing = _read_cached_pages(file_hash, page_count)
+            pages_by_file[file_path] = cached
+            for start in range(0, len(missing), self.pages_per_task):
+                tasks.append((file_path, file_hash, missing[start:start + self.pages_per_task]))
+
+        if tasks:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = [(path, pool.submit(_extract_pages, path, file_hash, pages))
+                           for path, file_hash, pages in tasks]
+                for path, future in futures:
+                    pages_by_file[path].update(future.result())
+
+        documents = []
+        for file_path in file_paths:
+            filename = os.path.basename(file_path)
+            for page, text in sorted(pages_by_file[file_path].items()):
+                documents.append(Document(page_content=text, metadata={"source": filename, "page": page}))
+        return documents
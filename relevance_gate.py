@@ -0,0 +1,255 @@
+# Отсечение вопросов по близости найденных фрагментов: если в индексе нет ничего близкого,
+#  вопрос сразу получает контакты поддержки без генерации, а при очень близких фрагментах
+#  ответ не перепроверяется моделью. Пороги подбираются на размеченных вопросах:
+#   python relevance_gate.py calibrate labeled.jsonl
+
+import argparse
+import csv
+import json
+import os
+from dataclasses import dataclass, asdict, fields
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import (RELEVANCE_THRESHOLDS_PATH, RELEVANCE_MAX_MISSED_RELEVANT, RELEVANCE_MIN_ON_TOPIC_PRECISION,
+                    EMBEDDING_MODEL_NAME, INFERENCE_BACKEND)
+
+# Ключ метаданных документа с близостью фрагмента к запросу (лучшая по всем формулировкам)
+RELEVANCE_KEY = "_relevance"
+
+# Решения
+OFF_TOPIC = "off_topic"
+ON_TOPIC = "on_topic"
+UNCERTAIN = "uncertain"
+
+
+def relevance_from_distance(distance: float) -> float:
+    """
+    Близость фрагмента по расстоянию Chroma (квадрат L2): для нормированных эмбеддингов -
+    косинусная близость. Пороги калибруются по этой же шкале, поэтому важна только монотонность.
+    """
+    return 1.0 - distance / 2.0
+
+
+def top_relevance(docs: Sequence) -> Optional[float]:
+    """Наибольшая близость среди найденных фрагментов или None, если ретривер её не сообщает."""
+    scores = [doc.metadata[RELEVANCE_KEY] for doc in docs if RELEVANCE_KEY in doc.metadata]
+    return max(scores) if scores else None
+
+
+@dataclass
+class RelevanceThresholds:
+    """
+    Пороги близости лучшего фрагмента.
+
+    Близость зависит от модели эмбеддингов, среды выполнения (int8 ONNX смещает оценки)
+    и содержимого индекса, поэтому пороги действуют только для тех, на которых подобраны.
+    Содержимое сравнивается по хэшу фрагментов снимка, а не по версии: пересборка
+    без изменений в документах порогов не сбрасывает.
+
+    Attributes:
+        off_topic (float): Ниже - в индексе нет ничего по теме вопроса
+        on_topic (float): Не ниже - ответ не перепроверяется моделью
+        embedding_model (str): Модель эмбеддингов, для которой подобраны пороги
+        inference_backend (Optional[str]): Среда выполнения эмбеддингов при калибровке
+        index_fingerprint (Optional[str]): Хэш фрагментов снимка, на котором подобраны пороги
+            (IndexManager.fingerprint)
+    """
+    off_topic: float
+    on_topic: float
+    embedding_model: str = EMBEDDING_MODEL_NAME
+    inference_backend: Optional[str] = None
+    index_fingerprint: Optional[str] = None
+
+    def save(self, path: str = RELEVANCE_THRESHOLDS_PATH) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str = RELEVANCE_THRESHOLDS_PATH) -> Optional["RelevanceThresholds"]:
+        """Загружает пороги или возвращает None, если калибровка не выполнялась."""
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        # Поля старых версий файла (например, index_version) не используются
+        known = {field.name for field in fields(cls)}
+        return cls(**{name: value for name, value in data.items() if name in known})
+
+
+class RelevanceGate:
+    """
+    Решение по близости лучшего найденного фрагмента.
+
+    Attributes:
+        thresholds (RelevanceThresholds): Откалиброванные пороги
+        fingerprint_of: Функция (версия снимка) -> хэш его фрагментов или None
+            (по умолчанию - IndexManager().fingerprint)
+    """
+
+    def __init__(self, thresholds: RelevanceThresholds,
+                 fingerprint_of: Optional[Callable[[str], Optional[str]]] = None):
+        self.thresholds = thresholds
+        if fingerprint_of is None:
+            from index_manager import IndexManager
+            fingerprint_of = IndexManager().fingerprint
+        self.fingerprint_of = fingerprint_of
+        # Снимки неизменяемы, поэтому решение для версии вычисляется один раз
+        self._applies: Dict[str, bool] = {}
+
+    @classmethod
+    def load(cls, path: str = RELEVANCE_THRESHOLDS_PATH, embedding_model: str = EMBEDDING_MODEL_NAME,
+             inference_backend: str = INFERENCE_BACKEND) -> Optional["RelevanceGate"]:
+        """Создаёт отсечение из сохранённых порогов или возвращает None, если они не подходят."""
+        thresholds = RelevanceThresholds.load(path)
+        if thresholds is None:
+            print(f"⚠️ Пороги близости не откалиброваны ({path}), отсечение выключено")
+            return None
+        if thresholds.embedding_model != embedding_model:
+            print(f"⚠️ Пороги близости подобраны для {thresholds.embedding_model}, отсечение выключено")
+            return None
+        if thresholds.inference_backend != inference_backend:
+            print(f"⚠️ Пороги близости подобраны для среды {thresholds.inference_backend}, "
+                  f"а эмбеддинги считаются в {inference_backend}: отсечение выключено")
+            return None
+        return cls(thresholds)
+
+    def applies_to(self, index_version: str) -> bool:
+        """Подходят ли пороги для снимка индекса: фрагменты снимка те же, что при калибровке."""
+        applies = self._applies.get(index_version)
+        if applies is None:
+            fingerprint = self.fingerprint_of(index_version)
+            applies = fingerprint is not None and fingerprint == self.thresholds.index_fingerprint
+            if not applies:
+                print(f"⚠️ Фрагменты снимка {index_version} отличаются от снимка калибровки порогов близости, "
+                      f"отсечение для него выключено")
+            self._applies[index_version] = applies
+        return applies
+
+    def decide(self, relevance: Optional[float]) -> str:
+        """
+        Args:
+            relevance: Близость лучшего фрагмента (top_relevance)
+
+        Returns:
+            str: OFF_TOPIC, ON_TOPIC или UNCERTAIN (обычный путь с проверкой ответа)
+        """
+        if relevance is None:
+            return UNCERTAIN
+        if relevance < self.thresholds.off_topic:
+            return OFF_TOPIC
+        if relevance >= self.thresholds.on_topic:
+            return ON_TOPIC
+        return UNCERTAIN
+
+
+def fit_thresholds(scores: Sequence[float], relevant: Sequence[bool],
+                   max_missed_relevant: float = RELEVANCE_MAX_MISSED_RELEVANT,
+                   min_on_topic_precision: float = RELEVANCE_MIN_ON_TOPIC_PRECISION) -> RelevanceThresholds:
+    """
+    Подбирает пороги по размеченным вопросам.
+
+    Порог off_topic - наибольший, при котором отсекается не больше max_missed_relevant доли
+    вопросов по теме; порог on_topic - наименьший, выше которого доля вопросов по теме
+    не ниже min_on_topic_precision.
+
+    Args:
+        scores: Близость лучшего фрагмента для каждого вопроса
+        relevant: Есть ли ответ на вопрос в базе знаний
+        max_missed_relevant: Допустимая доля отсечённых вопросов по теме
+        min_on_topic_precision: Требуемая доля вопросов по теме выше порога on_topic
+
+    Returns:
+        RelevanceThresholds: Пороги (off_topic <= on_topic)
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    relevant = np.asarray(relevant, dtype=bool)
+    if not relevant.any():
+        raise ValueError("В разметке нет ни одного вопроса по теме")
+
+    relevant_scores = np.sort(scores[relevant])
+    allowed = int(np.floor(max_missed_relevant * len(relevant_scores)))
+    off_topic = float(relevant_scores[allowed]) if allowed < len(relevant_scores) else float(relevant_scores[-1])
+
+    on_topic = float("inf")
+    order = np.argsort(-scores)
+    precision = np.cumsum(relevant[order]) / np.arange(1, len(order) + 1)
+    for i in range(len(order)):
+        # Порог может проходить только между разными значениями близости
+        if i + 1 < len(order) and scores[order[i + 1]] == scores[order[i]]:
+            continue
+        if precision[i] >= min_on_topic_precision:
+            on_topic = float(scores[order[i]])
+    return RelevanceThresholds(off_topic, max(on_topic, off_topic))
+
+
+def evaluate(thresholds: RelevanceThresholds, scores: Sequence[float], relevant: Sequence[bool]) -> dict:
+    """Доли решений и ошибок порогов на размеченных вопросах."""
+    gate = RelevanceGate(thresholds)
+    decisions = [gate.decide(score) for score in scores]
+    relevant_count = max(sum(relevant), 1)
+    return {
+        "off_topic": decisions.count(OFF_TOPIC) / len(decisions),
+        "on_topic": decisions.count(ON_TOPIC) / len(decisions),
+        "missed_relevant": sum(d == OFF_TOPIC and r for d, r in zip(decisions, relevant)) / relevant_count,
+        "unverified_off_topic": sum(d == ON_TOPIC and not r for d, r in zip(decisions, relevant))
+                                / max(decisions.count(ON_TOPIC), 1),
+    }
+
+
+def load_labeled(path: str) -> List[Tuple[str, bool]]:
+    """
+    Читает размеченные вопросы: JSONL с полями query и relevant (например, выгрузка
+    benchmarks.replay extract с добавленной разметкой) или CSV с теми же колонками.
+    """
+    def parse(value) -> bool:
+        return value if isinstance(value, bool) else str(value).strip().lower() in ("1", "true", "да", "yes")
+
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            return [(row["query"], parse(row["relevant"])) for row in csv.DictReader(f)]
+        return [(item["query"], parse(item["relevant"])) for item in map(json.loads, f) if "relevant" in item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Калибровка порогов близости найденных фрагментов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    calibrate = subparsers.add_parser("calibrate", help="Подобрать пороги по размеченным вопросам")
+    calibrate.add_argument("labeled", help="JSONL/CSV с полями query и relevant")
+    calibrate.add_argument("--max-missed", type=float, default=RELEVANCE_MAX_MISSED_RELEVANT)
+    calibrate.add_argument("--min-precision", type=float, default=RELEVANCE_MIN_ON_TOPIC_PRECISION)
+    calibrate.add_argument("--output", default=RELEVANCE_THRESHOLDS_PATH)
+    args = parser.parse_args()
+
+    from preprocess import preprocess_query
+    from startup import _load_embeddings, _load_index_watcher
+
+    labeled = load_labeled(args.labeled)
+    watcher = _load_index_watcher(_load_embeddings())
+    index_version, retriever = watcher.get_snapshot()
+    index_fingerprint = watcher.manager.fingerprint(index_version)
+    if index_fingerprint is None:
+        raise SystemExit(f"У снимка {index_version} нет хэша фрагментов: пересоберите индекс "
+                         "(python index_manager.py rebuild)")
+    # Те же формулировки, по которым конвейер принимает решение до генерации
+    scored = [(top_relevance(retriever.get_relevant_documents_multi([query, preprocess_query(query)])), label)
+              for query, label in labeled]
+    # Ретривер не сообщил близость (ничего не найдено) - вопрос не участвует в подборе
+    skipped = sum(score is None for score, _ in scored)
+    if skipped:
+        print(f"⚠️ Без оценки близости пропущено вопросов: {skipped}")
+    scores = [score for score, _ in scored if score is not None]
+    relevant = [label for score, label in scored if score is not None]
+    if not scores:
+        raise SystemExit("Ни для одного вопроса не получена близость найденных фрагментов")
+    thresholds = fit_thresholds(scores, relevant, args.max_missed, args.min_precision)
+    thresholds.inference_backend, thresholds.index_fingerprint = INFERENCE_BACKEND, index_fingerprint
+    thresholds.save(args.output)
+    print(f"📏 Пороги: off_topic {thresholds.off_topic:.3f}, on_topic {thresholds.on_topic:.3f} -> {args.output}")
+    print("📊", ", ".join(f"{name} {value:.1%}" for name, value in evaluate(thresholds, scores, relevant).items()))
+
+
+if __name__ == "__main__":
+    main()
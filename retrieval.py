@@ -0,0 +1,145 @@
+# Поиск фрагментов в векторном индексе с учётом категории запроса
+
+from typing import List, Optional, Tuple
+
+from langchain.schema import Document
+
+from config import RETRIEVER_TOP_K, CATEGORY_PARTITIONS, CATEGORY_MARGIN_THRESHOLD, RRF_K
+from knowledge_base import DOC_TYPE_KEY, embed_queries
+from relevance_gate import RELEVANCE_KEY, relevance_from_distance
+from sharded_index import IndexShard, ShardedIndex
+
+
+class PartitionedRetriever:
+    """
+    Ретривер, который сначала ищет в разделах индекса, соответствующих категории
+    запроса, и обращается ко всему индексу, если классификатор не уверен
+    или в разделах не нашлось достаточного числа фрагментов.
+
+    Attributes:
+        vector_store: Векторное хранилище Chroma или ShardedIndex
+        k (int): Число возвращаемых фрагментов
+        category_partitions (dict): Категория -> список типов источников (None - весь индекс)
+        margin_threshold (float): Минимальный отрыв лучшей категории от второй
+        rrf_k (int): Сглаживающая константа Reciprocal Rank Fusion
+        docstore: DocStore снимка из одной коллекции; если задан, Chroma возвращает только
+            ID фрагментов, а тексты и метаданные читаются из него (у шардов свои docstore)
+    """
+
+    def __init__(
+        self,
+        vector_store,
+        k: int = RETRIEVER_TOP_K,
+        category_partitions: dict = CATEGORY_PARTITIONS,
+        margin_threshold: float = CATEGORY_MARGIN_THRESHOLD,
+        rrf_k: int = RRF_K,
+        docstore=None
+    ):
+        self.vector_store = vector_store
+        if isinstance(vector_store, ShardedIndex):
+            self.index = vector_store
+        else:
+            self.index = ShardedIndex([IndexShard(vector_store, docstore)], vector_store.embeddings)
+        self.k = k
+        self.category_partitions = category_partitions
+        self.margin_threshold = margin_threshold
+        self.rrf_k = rrf_k
+        self.docstore = docstore
+
+    def select_partitions(self, category_scores: Optional[List[Tuple[str, float]]]) -> Optional[List[str]]:
+        """
+        Выбирает разделы индекса по результату классификации.
+
+        Args:
+            category_scores: Пары (категория, вероятность) по убыванию вероятности
+
+        Returns:
+            Optional[List[str]]: Типы источников или None, если искать нужно по всему индексу
+        """
+        if not category_scores:
+            return None
+        best_label, best_score = category_scores[0]
+        second_score = category_scores[1][1] if len(category_scores) > 1 else 0.0
+        if best_score - second_score < self.margin_threshold:
+            return None
+        return self.category_partitions.get(best_label)
+
+    def _search(self, embeddings: List[List[float]],
+                where: Optional[dict]) -> List[List[Tuple[str, Document, float]]]:
+        """
+        Ищет ближайшие фрагменты сразу для всех векторов (во всех шардах индекса).
+
+        Returns:
+            List[List[Tuple[str, Document, float]]]: Для каждого вектора - (id, документ, расстояние)
+                по убыванию близости
+        """
+        return self.index.query(embeddings, self.k, where)
+
+    def _fuse(self, ranked_lists: List[List[Tuple[str, Document, float]]]) -> List[Tuple[str, Document]]:
+        """
+        Объединяет ранжированные списки методом Reciprocal Rank Fusion. Близость фрагмента
+        (лучшая по всем формулировкам) записывается в метаданные под ключом RELEVANCE_KEY.
+        """
+        scores, docs, distances = {}, {}, {}
+        for ranked in ranked_lists:
+            for rank, (chunk_id, doc, distance) in enumerate(ranked):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                docs[chunk_id] = doc
+                distances[chunk_id] = min(distance, distances.get(chunk_id, distance))
+        order = sorted(scores, key=scores.get, reverse=True)
+        for chunk_id in order:
+            docs[chunk_id].metadata[RELEVANCE_KEY] = relevance_from_distance(distances[chunk_id])
+        return [(chunk_id, docs[chunk_id]) for chunk_id in order]
+
+    def get_relevant_documents_multi(
+        self,
+        queries: List[str],
+        category_scores: Optional[List[Tuple[str, float]]] = None
+    ) -> List[Document]:
+        """
+        Ищет фрагменты по нескольким формулировкам запроса и объединяет результаты.
+
+        Все формулировки векторизуются одним батчем и ищутся одним запросом к индексу,
+        ранжированные списки объединяются через Reciprocal Rank Fusion.
+
+        Args:
+            queries: Формулировки запроса (исходная, переформулированные и т.п.)
+            category_scores: Результат ZeroShotQueryClassifier.classify_with_scores
+
+        Returns:
+            List[Document]: k фрагментов в порядке убывания объединённой релевантности
+                (близость фрагмента - в metadata[RELEVANCE_KEY])
+        """
+        queries = list(dict.fromkeys(q for q in queries if q and q.strip()))
+        embeddings = embed_queries(self.index.embeddings, queries)
+        partitions = self.select_partitions(category_scores)
+        if partitions is None:
+            return [doc for _, doc in self._fuse(self._search(embeddings, None))[:self.k]]
+
+        fused = self._fuse(self._search(embeddings, {DOC_TYPE_KEY: {"$in": partitions}}))[:self.k]
+        if len(fused) < self.k:
+            # Разделы пусты (например, индекс построен без типов источников) - дополняем из всего индекса
+            seen = {chunk_id for chunk_id, _ in fused}
+            for chunk_id, doc in self._fuse(self._search(embeddings, None)):
+                if len(fused) >= self.k:
+                    break
+                if chunk_id not in seen:
+                    fused.append((chunk_id, doc))
+        return [doc for _, doc in fused]
+
+    def get_relevant_documents(
+        self,
+        query: str,
+        category_scores: Optional[List[Tuple[str, float]]] = None
+    ) -> List[Document]:
+        """
+        Возвращает k наиболее близких к запросу фрагментов.
+
+        Args:
+            query: Текст запроса
+            category_scores: Результат ZeroShotQueryClassifier.classify_with_scores
+
+        Returns:
+            List[Document]: Фрагменты в порядке убывания близости
+        """
+        return self.get_relevant_documents_multi([query], category_scores)
@@ -0,0 +1,245 @@
+# Шардированный векторный индекс: фрагменты делятся на N независимых коллекций Chroma
+#  (по источнику или по хэшу текста), шарды строятся параллельно, неизменившиеся шарды
+#  переносятся из предыдущего снимка, поиск идёт по всем шардам параллельно с объединением по близости
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from config import (INDEX_SHARDS, INDEX_SHARD_BY, INDEX_BUILD_WORKERS, SHARD_SEARCH_WORKERS, DOCSTORE_ENABLED,
+                    EMBEDDING_MODEL_NAME, INFERENCE_BACKEND)
+from docstore import DocStore, build_docstore, DOCSTORE_DIRNAME
+
+SHARDS_DIRNAME = "shards"
+MANIFEST_FILENAME = "shards.json"
+
+
+def shard_for(doc, num_shards: int, by: str = INDEX_SHARD_BY) -> int:
+    """
+    Номер шарда для фрагмента.
+
+    Args:
+        doc: Фрагмент
+        num_shards: Число шардов
+        by: "source" - все фрагменты файла в одном шарде (при изменении файла пересобирается
+            один шард), "hash" - по тексту фрагмента (равномерное распределение)
+    """
+    if by == "source":
+        key = str(doc.metadata.get("source", ""))
+    elif by == "hash":
+        key = doc.page_content
+    else:
+        raise ValueError(f"Неизвестный способ шардирования: {by}")
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
+def fingerprint(docs: Sequence) -> str:
+    """Хэш содержимого фрагментов: совпадает, только если их тексты, метаданные и порядок не изменились."""
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(json.dumps(doc.metadata, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _build_settings(num_shards: int, by: str, tokenizers: Dict[str, Any]) -> dict:
+    """
+    Настройки построения, от которых зависит содержимое шарда помимо фрагментов: шард
+    предыдущего снимка переносится, только если они совпадают (иначе в одном индексе
+    оказались бы векторы разных моделей эмбеддингов или шарды без docstore).
+    """
+    return {"count": num_shards, "by": by, "tokenizers": sorted(tokenizers),
+            "embedding_model": EMBEDDING_MODEL_NAME, "inference_backend": INFERENCE_BACKEND,
+            "docstore": DOCSTORE_ENABLED}
+
+
+def _read_manifest(snapshot_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def query_collection(vector_store, embeddings: List[List[float]], k: int, where: Optional[dict],
+                     include: List[str]) -> dict:
+    """
+    Поиск по векторам напрямую в коллекции Chroma. У langchain-обёртки нет батчевого поиска
+    по готовым векторам, поэтому это единственное место, где используется её приватная коллекция.
+
+    Returns:
+        dict: Ответ Collection.query (ids, distances и поля из include) - по списку на вектор
+    """
+    return vector_store._collection.query(query_embeddings=embeddings, n_results=k, where=where, include=include)
+
+
+def collection_count(vector_store) -> int:
+    """Число фрагментов в коллекции Chroma."""
+    return vector_store._collection.count()
+
+
+class IndexShard:
+    """
+    Одна коллекция Chroma с хранилищем фрагментов (docstore) или без него.
+
+    Attributes:
+        vector_store: Векторное хранилище Chroma
+        docstore: DocStore шарда или None (тексты читаются из Chroma)
+        prefix (str): Префикс ID фрагментов, чтобы ID разных шардов не совпадали
+    """
+
+    def __init__(self, vector_store, docstore: Optional[DocStore] = None, prefix: str = ""):
+        self.vector_store = vector_store
+        self.docstore = docstore
+        self.prefix = prefix
+
+    def query(self, embeddings: List[List[float]], k: int,
+              where: Optional[dict]) -> List[List[Tuple[str, Document, float]]]:
+        """
+        Ищет ближайшие фрагменты сразу для всех векторов одним запросом к коллекции.
+
+        Returns:
+            List[List[Tuple[str, Document, float]]]: Для каждого вектора - (id, документ, расстояние)
+                по возрастанию расстояния
+        """
+        if self.docstore is not None:
+            result = query_collection(self.vector_store, embeddings, k, where, include=["distances"])
+            # Каждый фрагмент читается один раз, даже если найден по нескольким формулировкам
+            chunk_ids = list(dict.fromkeys(chunk_id for ids in result["ids"] for chunk_id in ids))
+            docs = {chunk_id: Document(page_content=self.docstore.text(int(chunk_id)),
+                                       metadata=self.docstore.document_metadata(int(chunk_id)))
+                    for chunk_id in chunk_ids}
+            return [[(self.prefix + chunk_id, docs[chunk_id], distance) for chunk_id, distance in zip(ids, distances)]
+                    for ids, distances in zip(result["ids"], result["distances"])]
+
+        result = query_collection(self.vector_store, embeddings, k, where,
+                                  include=["documents", "metadatas", "distances"])
+        return [
+            [(self.prefix + chunk_id, Document(page_content=text, metadata=metadata or {}), distance)
+             for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)]
+            for ids, texts, metadatas, distances in zip(result["ids"], result["documents"],
+                                                        result["metadatas"], result["distances"])
+        ]
+
+    def count(self) -> int:
+        return collection_count(self.vector_store)
+
+
+class ShardedIndex:
+    """
+    Набор шардов с параллельным поиском (scatter-gather).
+
+    Поиск по шардам выполняется в пуле потоков (поиск HNSW в Chroma отпускает GIL),
+    результаты для каждого вектора объединяются по расстоянию и обрезаются до k.
+
+    Attributes:
+        shards (List[IndexShard]): Шарды
+        embeddings: Модель эмбеддингов запросов
+    """
+
+    def __init__(self, shards: List[IndexShard], embeddings, workers: Optional[int] = SHARD_SEARCH_WORKERS):
+        self.shards = shards
+        self.embeddings = embeddings
+        self._pool = ThreadPoolExecutor(max_workers=workers or len(shards)) if len(shards) > 1 else None
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def count(self) -> int:
+        """Общее число фрагментов."""
+        return sum(shard.count() for shard in self.shards)
+
+    def query(self, embeddings: List[List[float]], k: int,
+              where: Optional[dict]) -> List[List[Tuple[str, Document, float]]]:
+        """Ищет в каждом шарде k ближайших фрагментов и объединяет их в общий top-k для каждого вектора."""
+        # Все шарды пусты (пустой корпус или все источники отфильтрованы) - найти нечего
+        if not self.shards:
+            return [[] for _ in embeddings]
+        if self._pool is None:
+            return self.shards[0].query(embeddings, k, where)
+        per_shard = list(self._pool.map(lambda shard: shard.query(embeddings, k, where), self.shards))
+        return [sorted((hit for shard_hits in hits for hit in shard_hits), key=lambda hit: hit[2])[:k]
+                for hits in zip(*per_shard)]
+
+
+def open_shards(snapshot_dir: str, embeddings) -> Optional[ShardedIndex]:
+    """Открывает шардированный снимок или возвращает None, если снимок построен одной коллекцией."""
+    from knowledge_base import load_vector_store
+
+    manifest = _read_manifest(snapshot_dir)
+    if manifest is None:
+        return None
+    shards = []
+    for i, chunks in enumerate(manifest["chunks"]):
+        if not chunks:
+            continue
+        shard_dir = os.path.join(snapshot_dir, SHARDS_DIRNAME, str(i))
+        docstore = DocStore.open(shard_dir) if DOCSTORE_ENABLED else None
+        shards.append(IndexShard(load_vector_store(shard_dir, embeddings), docstore, prefix=f"{i}:"))
+    return ShardedIndex(shards, embeddings)
+
+
+def build_shards(docs: Sequence, snapshot_dir: str, embeddings, num_shards: int = INDEX_SHARDS,
+                 by: str = INDEX_SHARD_BY, reuse_dir: Optional[str] = None,
+                 workers: Optional[int] = INDEX_BUILD_WORKERS,
+                 tokenizers: Optional[Dict[str, Any]] = None) -> ShardedIndex:
+    """
+    Строит шарды снимка индекса. Шард, содержимое и настройки построения которого совпадают
+    с шардом предыдущего снимка (reuse_dir), копируется без повторной векторизации.
+
+    Args:
+        docs: Фрагменты
+        snapshot_dir: Каталог нового снимка
+        embeddings: Модель эмбеддингов
+        num_shards: Число шардов
+        by: Способ шардирования ("source" или "hash")
+        reuse_dir: Каталог предыдущего снимка
+        workers: Число потоков построения (по умолчанию - по потоку на шард)
+        tokenizers: Токенизаторы, токены которых сохраняются в docstore шардов (см. docstore.build_tokens)
+
+    Returns:
+        ShardedIndex: Открытый индекс
+    """
+    from langchain.vectorstores import Chroma
+
+    groups = [[] for _ in range(num_shards)]
+    for doc in docs:
+        groups[shard_for(doc, num_shards, by)].append(doc)
+    fingerprints = [fingerprint(group) for group in groups]
+    tokenizers = tokenizers or {}
+    settings = _build_settings(num_shards, by, tokenizers)
+    previous = _read_manifest(reuse_dir) if reuse_dir else None
+    if previous and any(previous.get(key) != value for key, value in settings.items()):
+        print("🧩 Настройки индекса изменились, все шарды строятся заново")
+        previous = None
+
+    def build(i: int) -> str:
+        shard_dir = os.path.join(snapshot_dir, SHARDS_DIRNAME, str(i))
+        if previous and previous["fingerprints"][i] == fingerprints[i]:
+            shutil.copytree(os.path.join(reuse_dir, SHARDS_DIRNAME, str(i)), shard_dir)
+            return "скопирован"
+        os.makedirs(shard_dir)
+        if groups[i]:
+            vector_store = Chroma.from_documents(
+                groups[i], embedding=embeddings, persist_directory=shard_dir,
+                ids=[str(chunk_id) for chunk_id in range(len(groups[i]))])
+            vector_store.persist()
+            if DOCSTORE_ENABLED:
+                build_docstore(groups[i], os.path.join(shard_dir, DOCSTORE_DIRNAME), tokenizers=tokenizers)
+        return "построен"
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or num_shards) as pool:
+        statuses = list(pool.map(build, range(num_shards)))
+    with open(os.path.join(snapshot_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({**settings, "fingerprints": fingerprints, "chunks": [len(group) for group in groups]}, f)
+    print(f"🧩 Шарды ({time.perf_counter() - start:.1f} с):",
+          ", ".join(f"{i}: {len(group)} фрагм. {status}" for i, (group, status) in enumerate(zip(groups, statuses))))
+    return open_shards(snapshot_dir, embeddings)
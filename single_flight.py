@@ -0,0 +1,61 @@
+# Объединение одинаковых одновременных вычислений: пока первый вызов с ключом выполняется,
+#  остальные вызовы с тем же ключом ждут его результат, а не запускают вычисление повторно
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    """
+    Реестр выполняющихся вычислений по ключу.
+
+    Результат не сохраняется после завершения вычисления: повторный вызов
+    с тем же ключом после окончания первого снова выполнит func.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Выполняет func или дожидается уже выполняющегося вычисления с тем же ключом.
+
+        Args:
+            key: Ключ вычисления
+            func: Функция без аргументов
+            timeout: Сколько ждать чужое вычисление, секунды (None - без ограничения);
+                на собственное вычисление не влияет
+
+        Returns:
+            Tuple[Any, bool]: Результат и признак того, что он получен от другого вызова
+
+        Raises:
+            Exception: Исключение func пробрасывается всем ожидающим вызовам
+            concurrent.futures.TimeoutError: Если чужое вычисление не закончилось за timeout
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(timeout), True
+
+        try:
+            result = func()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self) -> int:
+        """Число выполняющихся вычислений."""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,192 @@
+# Быстрый запуск приложения: параллельная загрузка моделей в фоне, общая модель эмбеддингов,
+#  прогрев и журнал длительности этапов запуска
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from single_flight import SingleFlight
+from deadline import RoundTimeEstimate
+from config import (FAQ_ENABLED, STARTUP_WARMUP, GENERATION_BACKEND, ANSWER_CACHE_ENABLED,
+                    CACHE_WARMUP_ON_SWAP, ADMISSION_ENABLED, RELEVANCE_GATE_ENABLED)
+
+WARMUP_QUERY = "Как зарегистрироваться на портале поставщиков?"
+
+
+@dataclass
+class Components:
+    """
+    Модели и индексы, необходимые для ответа на вопросы.
+
+    Attributes:
+        classifier: ZeroShotQueryClassifier
+        answer_generator: AnswerGenerator
+        embeddings: Общая модель эмбеддингов (индекс и запросы)
+        index_watcher: IndexWatcher с ретривером текущего снимка индекса
+        faq_index: FAQIndex или None, если быстрый путь выключен
+        answer_cache: AnswerCache или None, если кэш ответов выключен
+        inflight (SingleFlight): Выполняющиеся ответы, общие для всех сессий
+        admission: AdmissionController или None, если контроль нагрузки выключен
+        relevance_gate: RelevanceGate или None, если отсечение по близости выключено или не откалибровано
+        round_estimate (RoundTimeEstimate): Оценка длительности раунда генерации для сроков запросов
+        timings (Dict[str, float]): Длительность этапов запуска в секундах
+    """
+    classifier: Any
+    answer_generator: Any
+    embeddings: Any
+    index_watcher: Any
+    faq_index: Any
+    answer_cache: Any = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    inflight: SingleFlight = field(default_factory=SingleFlight)
+    admission: Any = None
+    relevance_gate: Any = None
+    round_estimate: RoundTimeEstimate = field(default_factory=RoundTimeEstimate)
+
+
+def _timed(timings: Dict[str, float], name: str, func: Callable, *args):
+    """Выполняет func и записывает длительность в timings."""
+    start = time.perf_counter()
+    result = func(*args)
+    timings[name] = time.perf_counter() - start
+    return result
+
+
+# Тяжёлые модули (transformers, langchain, chromadb) импортируются только внутри загрузчиков
+def _load_classifier():
+    from classification import ZeroShotQueryClassifier
+    return ZeroShotQueryClassifier()
+
+
+def _load_answer_generator(backend_name: str):
+    from generate_answer import AnswerGenerator
+    return AnswerGenerator(backend_name=backend_name)
+
+
+def _load_embeddings():
+    from knowledge_base import get_embeddings
+    return get_embeddings()
+
+
+def _load_index_watcher(embeddings):
+    from index_manager import IndexWatcher
+    from retrieval import PartitionedRetriever
+    return IndexWatcher(embeddings, lambda vector_store, docstore: PartitionedRetriever(vector_store, docstore=docstore))
+
+
+def _load_faq_index(embeddings):
+    from faq import FAQIndex
+    return FAQIndex(embeddings) if FAQ_ENABLED else None
+
+
+def _load_answer_cache():
+    from answer_cache import AnswerCache
+    return AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+
+def _load_relevance_gate():
+    from relevance_gate import RelevanceGate
+    return RelevanceGate.load() if RELEVANCE_GATE_ENABLED else None
+
+
+def _prepare_snapshot(components: Components, version: str, retriever) -> None:
+    """Прогревает кэш новым снимком до переключения на него и удаляет записи устаревших версий."""
+    from cache_warmer import CacheWarmer
+    CacheWarmer(components).warm((version, retriever))
+    components.answer_cache.purge([version, components.index_watcher.version])
+
+
+def warm_up(components: Components) -> None:
+    """
+    Прогоняет по одному запросу через все модели, чтобы первый пользователь
+    не платил за выделение памяти, компиляцию ядер и заполнение кэшей.
+    """
+    components.classifier.classify_with_scores(WARMUP_QUERY)
+    components.index_watcher.get_retriever().get_relevant_documents(WARMUP_QUERY)
+    if components.faq_index is not None:
+        components.faq_index.match(WARMUP_QUERY)
+    answer_generator = components.answer_generator
+    answer_generator.backend.generate(WARMUP_QUERY, 1, 0.0)
+    if getattr(answer_generator.backend, "draft_model", None) is not None:
+        # База для оценки ускорения assisted decoding - замер вне запросов пользователей
+        answer_generator.backend.calibrate(answer_generator.generate_prompt(WARMUP_QUERY, ""),
+                                           answer_generator.max_new_tokens)
+
+
+def load_components(warmup: bool = STARTUP_WARMUP, generation_backend: str = GENERATION_BACKEND) -> Components:
+    """
+    Загружает модели параллельно: классификатор, LLM и эмбеддинги независимы,
+    индекс и FAQ используют одну и ту же модель эмбеддингов.
+
+    Args:
+        warmup: Выполнить прогрев моделей после загрузки
+        generation_backend: Среда выполнения LLM ("hf", "llama_cpp" или "stub")
+
+    Returns:
+        Components: Загруженные компоненты с журналом длительностей
+    """
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        classifier = pool.submit(_timed, timings, "классификатор", _load_classifier)
+        answer_generator = pool.submit(_timed, timings, "LLM", _load_answer_generator, generation_backend)
+        embeddings = _timed(timings, "эмбеддинги", _load_embeddings)
+        index_watcher = pool.submit(_timed, timings, "индекс", _load_index_watcher, embeddings)
+        faq_index = pool.submit(_timed, timings, "FAQ", _load_faq_index, embeddings)
+        answer_cache = pool.submit(_load_answer_cache)
+        components = Components(classifier.result(), answer_generator.result(), embeddings,
+                                index_watcher.result(), faq_index.result(), answer_cache.result(), timings)
+    timings["загрузка"] = time.perf_counter() - start
+    if ADMISSION_ENABLED:
+        from admission import AdmissionController
+        components.admission = AdmissionController()
+    components.relevance_gate = _load_relevance_gate()
+    if components.answer_cache is not None and CACHE_WARMUP_ON_SWAP:
+        components.index_watcher.on_new_snapshot = (
+            lambda version, retriever: _prepare_snapshot(components, version, retriever))
+    if warmup:
+        _timed(timings, "прогрев", warm_up, components)
+    timings["всего"] = time.perf_counter() - start
+    print("⏱ Запуск:", ", ".join(f"{name} {seconds:.1f} с" for name, seconds in timings.items()))
+    return components
+
+
+class BackgroundLoader:
+    """
+    Загружает компоненты в фоновом потоке, чтобы интерфейс отрисовывался сразу,
+    а ожидание моделей приходилось только на первый вопрос, заданный до окончания загрузки.
+    """
+
+    def __init__(self, loader: Callable[[], Components] = load_components):
+        self._ready = threading.Event()
+        self._components: Optional[Components] = None
+        self._error: Optional[BaseException] = None
+        threading.Thread(target=self._run, args=(loader,), daemon=True).start()
+
+    def _run(self, loader: Callable[[], Components]) -> None:
+        try:
+            self._components = loader()
+        except BaseException as error:
+            self._error = error
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        """Загрузка завершена."""
+        return self._ready.is_set()
+
+    def get(self, timeout: Optional[float] = None) -> Components:
+        """
+        Возвращает компоненты, дожидаясь окончания загрузки.
+
+        Raises:
+            TimeoutError: Если загрузка не завершилась за timeout секунд
+        """
+        if not self._ready.wait(timeout):
+            raise TimeoutError("Модели ещё загружаются")
+        if self._error is not None:
+            raise self._error
+        return self._components
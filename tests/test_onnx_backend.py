@@ -0,0 +1,88 @@
+# Совпадение квантованных ONNX-моделей с исходными (torch) на вопросах и фрагментах длины CHUNK_SIZE.
+#  Требует экспортированных моделей: python onnx_backend.py export
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("optimum.onnxruntime")
+pytest.importorskip("sentence_transformers")
+
+from config import (EMBEDDING_MODEL_NAME, CLASSIFIER_MODEL_NAME, CHUNK_SIZE,
+                    ONNX_EMBEDDING_TOLERANCE, ONNX_CLASSIFIER_TOLERANCE)
+from db import CANDIDATE_LABELS
+from onnx_backend import OnnxEmbeddings, onnx_model_dir, onnx_zero_shot_pipeline
+
+QUERIES = [
+    "Как зарегистрироваться на портале поставщиков?",
+    "Я не могу зайти в личный кабинет, появляется ошибка",
+    "Как осуществляется электронное исполнение контракта?",
+    "Какие документы нужны для участия в закупке по 44-ФЗ?",
+    "Не приходит письмо с подтверждением электронной почты",
+]
+
+_PARAGRAPHS = [
+    "Для регистрации на Портале поставщиков нажмите кнопку «Регистрация», войдите с помощью "
+    "электронной подписи и заполните карточку организации. После проверки данных организация "
+    "получает доступ к личному кабинету, где можно размещать оферты и участвовать в закупках. ",
+    "Электронное исполнение контракта осуществляется с использованием электронных документов, "
+    "подписанных усиленной квалифицированной электронной подписью. Документ о приемке формируется "
+    "поставщиком и направляется заказчику, который подписывает его или направляет мотивированный отказ. ",
+    "Заказчики при осуществлении закупок используют конкурентные способы определения поставщиков "
+    "(подрядчиков, исполнителей) или осуществляют закупки у единственного поставщика. Конкурентными "
+    "способами являются конкурсы, аукционы и запрос котировок в электронной форме. ",
+]
+
+# Фрагменты длины CHUNK_SIZE: заметно длиннее max_seq_length модели эмбеддингов в токенах
+CHUNKS = [(paragraph * (CHUNK_SIZE // len(paragraph) + 1))[:CHUNK_SIZE] for paragraph in _PARAGRAPHS]
+
+pytestmark = pytest.mark.skipif(
+    not all(os.path.isdir(onnx_model_dir(name)) for name in (EMBEDDING_MODEL_NAME, CLASSIFIER_MODEL_NAME)),
+    reason="ONNX-модели не экспортированы (python onnx_backend.py export)")
+
+
+@pytest.fixture(scope="module")
+def onnx_embeddings():
+    return OnnxEmbeddings()
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@pytest.mark.parametrize("texts", [QUERIES, CHUNKS], ids=["queries", "chunks"])
+def test_embeddings_match_torch(onnx_embeddings, texts):
+    from langchain.embeddings import HuggingFaceEmbeddings
+
+    reference = np.asarray(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME).embed_documents(texts))
+    quantized = np.asarray(onnx_embeddings.embed_documents(texts))
+    assert _cosine(reference, quantized).min() >= 1 - ONNX_EMBEDDING_TOLERANCE
+
+
+def test_embeddings_truncate_like_sentence_transformers(onnx_embeddings):
+    from sentence_transformers import SentenceTransformer
+
+    assert onnx_embeddings.max_seq_length == SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu").max_seq_length
+    # Текст за пределами max_seq_length не влияет на вектор
+    vectors = np.asarray(onnx_embeddings.embed_documents([CHUNKS[0], CHUNKS[0] + CHUNKS[1]]))
+    assert _cosine(vectors[:1], vectors[1:])[0] == pytest.approx(1.0, abs=1e-6)
+
+
+@pytest.fixture(scope="module")
+def classifiers():
+    from transformers import pipeline
+
+    return pipeline("zero-shot-classification", model=CLASSIFIER_MODEL_NAME), onnx_zero_shot_pipeline()
+
+
+@pytest.mark.parametrize("text", QUERIES + CHUNKS)
+def test_classifier_matches_torch(classifiers, text):
+    torch_classifier, onnx_classifier = classifiers
+    expected = torch_classifier(text, candidate_labels=CANDIDATE_LABELS, hypothesis_template="Это {}.")
+    actual = onnx_classifier(text, candidate_labels=CANDIDATE_LABELS, hypothesis_template="Это {}.")
+    expected_scores = dict(zip(expected["labels"], expected["scores"]))
+    actual_scores = dict(zip(actual["labels"], actual["scores"]))
+    assert actual["labels"][0] == expected["labels"][0]
+    assert max(abs(expected_scores[label] - actual_scores[label]) for label in CANDIDATE_LABELS) \
+        <= ONNX_CLASSIFIER_TOLERANCE
@@ -0,0 +1,99 @@
+# Токены промпта, собранные из токенов фрагментов (generate_prompt_ids), должны совпадать
+#  с токенизацией текстового промпта - иначе модель видит другой промпт, чем в текстовом пути.
+
+import pytest
+
+from config import LLM_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP, CONTEXT_SAFETY_MARGIN
+from context_packer import TOKENS_KEY, chunk_prompt_text, tokenize_chunk
+from generate_answer import AnswerGenerator, Document
+from generation_backends import StubBackend
+
+QUERY = "Как зарегистрироваться на портале поставщиков и подписать контракт?"
+
+_ARTICLE = (
+    "Для регистрации на Портале поставщиков нажмите кнопку «Регистрация», войдите с помощью "
+    "электронной подписи и заполните карточку организации. После проверки данных организация "
+    "получает доступ к личному кабинету (раздел «Мои оферты»), где можно размещать оферты.\n"
+    "Электронное исполнение контракта осуществляется с использованием электронных документов, "
+    "подписанных усиленной квалифицированной электронной подписью; документ о приемке "
+    "формируется поставщиком и направляется заказчику в ЕИС. "
+)
+_TEXT = (_ARTICLE * (2 * CHUNK_SIZE // len(_ARTICLE) + 1))[:2 * CHUNK_SIZE]
+
+
+def _chunks():
+    """Соседние чанки одной страницы с перекрытием до CHUNK_OVERLAP по границам слов, как при нарезке индекса."""
+    words = _TEXT.split(" ")
+    chunks, start = [], 0
+    while start < len(words):
+        end = start
+        while end < len(words) and len(" ".join(words[start:end + 1])) <= CHUNK_SIZE:
+            end += 1
+        chunks.append(" ".join(words[start:end]).strip())
+        if end == len(words):
+            break
+        overlap = end
+        while overlap > start + 1 and len(" ".join(words[overlap - 1:end])) <= CHUNK_OVERLAP:
+            overlap -= 1
+        start = overlap
+    return chunks
+
+
+def _tokenizers():
+    yield pytest.param(None, id="stub")
+    yield pytest.param(LLM_MODEL_NAME, id="llm")
+
+
+@pytest.fixture(params=list(_tokenizers()))
+def generator(request):
+    backend = StubBackend()
+    if request.param is not None:
+        transformers = pytest.importorskip("transformers")
+        try:
+            backend.tokenizer = transformers.AutoTokenizer.from_pretrained(request.param)
+        except OSError as error:
+            pytest.skip(f"Токенизатор {request.param} недоступен: {error}")
+    return AnswerGenerator(backend=backend)
+
+
+def _document(packer, text, source, page=None, with_tokens=True):
+    metadata = {"source": source, "page": page}
+    if with_tokens:
+        metadata[TOKENS_KEY] = {packer.tokenizer_name: tokenize_chunk(packer.tokenizer, chunk_prompt_text(text))}
+    return Document(page_content=text, metadata=metadata)
+
+
+def _documents(generator, with_tokens=True):
+    """Перекрывающиеся чанки статьи, документ без токенов (токенизируется заново) и короткий документ."""
+    packer = generator.context_packer
+    docs = [_document(packer, text, "Инструкция_по_работе_с_Порталом.pdf", 3, with_tokens) for text in _chunks()]
+    docs.insert(1, _document(packer, "Регламент: заказчик подписывает документ о приемке в течение 20 дней.",
+                             "Регламент.pdf", with_tokens=False))
+    docs.append(_document(packer, "Контакты службы поддержки: 8-800-000-00-00.", "Контакты", None, with_tokens))
+    return docs
+
+
+def _text_prompt_ids(generator, docs):
+    budget = generator.context_budget(QUERY)
+    prompt = generator.generate_prompt(QUERY, generator.format_context(docs, budget))
+    return generator.backend.tokenizer.encode(prompt, add_special_tokens=True)
+
+
+@pytest.mark.parametrize("budget", [4000, 300, 60])
+def test_prompt_ids_match_text_prompt(generator, budget):
+    generator.context_packer.token_budget = budget
+    docs = _documents(generator)
+    prompt_ids = generator.generate_prompt_ids(QUERY, docs)
+    assert prompt_ids is not None
+    assert list(prompt_ids) == list(_text_prompt_ids(generator, docs))
+
+
+def test_prompt_ids_fit_context_window(generator):
+    generator.context_window = generator.count_tokens(generator.generate_prompt(QUERY, "")) \
+        + generator.max_new_tokens + CONTEXT_SAFETY_MARGIN + 300
+    prompt_ids = generator.generate_prompt_ids(QUERY, _documents(generator))
+    assert len(prompt_ids) + generator.max_new_tokens <= generator.context_window
+
+
+def test_documents_without_tokens_use_text_prompt(generator):
+    assert generator.generate_prompt_ids(QUERY, _documents(generator, with_tokens=False)) is None